@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Red Alien.
+
+#    Red Alien is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    Red Alien is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with Red Alien.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Free space allocation for #dyn chunks: all the chunks of a build
+    are packed at once, biggest first, each in the smallest free run
+    it fits in '''
+
+import re
+from bisect import bisect_left, insort
+
+FREE = 0xFF
+# Bytes left free before every chunk, in case whatever comes before
+# needs its 0xFF (a text terminator, for example)
+MARGIN = 2
+# Bytes left free after a chunk when another one goes in the same run,
+# so the chunks of a build don't touch
+GAP = 10
+ALIGN = 1
+
+def free_runs(rom, start, min_length=1):
+    ''' (start, end) of every run of at least min_length 0xFF bytes
+        from start on. A run going through start is cut there. '''
+    run_re = re.compile(b"\\xff{" + str(max(min_length, 1)).encode() + b",}")
+    return [m.span() for m in run_re.finditer(rom, start)]
+
+def align_up(offset, align):
+    return -(-offset // align) * align
+
+def capacity(start, end, margin, exact):
+    ''' How long a chunk can be in the run, before alignment. No margin
+        is needed at exact (the #dyn offset the user gave). '''
+    return end - start - (0 if start == exact else margin)
+
+def pack(lengths, runs, align=ALIGN, margin=MARGIN, exact=None, gap=GAP):
+    ''' Place chunks of the given lengths (a list, in source order) in
+        the free runs ((start, end) list). Chunks are taken biggest
+        first (ties in source order) and each goes in the smallest run
+        it fits in (ties at the lowest offset), so the result only
+        depends on the input. What is left of a run after a chunk and
+        gap more bytes is still free for the next ones.
+        Returns the offsets (in the order of lengths) and a dict of
+        stats for pack_report. '''
+    if align < 1 or margin < 0 or gap < 0:
+        raise Exception("ERROR: bad alignment or margin")
+    # (capacity, start, end), so the smallest run that can take a
+    # chunk is found with a binary search
+    free = sorted((capacity(start, end, margin, exact), start, end)
+                  for start, end in runs)
+    offsets = [None] * len(lengths)
+    padding = 0
+    used = set()
+    order = sorted(range(len(lengths)), key=lambda i: (-lengths[i], i))
+    for i in order:
+        length = lengths[i]
+        # Only alignment can make a run with enough capacity too short,
+        # and then it's short by less than align bytes
+        j = bisect_left(free, (length,))
+        while j < len(free):
+            room, start, end = free[j]
+            offset = align_up(end - room, align)
+            if offset + length <= end:
+                break
+            j += 1
+        else:
+            raise Exception("ERROR: no free space for a chunk of " +
+                            hex(length) + " bytes")
+        del free[j]
+        rest = offset + length + gap
+        if capacity(rest, end, margin, exact) > 0:
+            insort(free, (capacity(rest, end, margin, exact), rest, end))
+        offsets[i] = offset
+        padding += offset - start + min(gap, end - offset - length)
+        used.add(end)
+    stats = {
+        "chunks": len(lengths),
+        "bytes": sum(lengths),
+        "padding": padding,
+        "runs": len(used),
+        "free": sum(end - start for _, start, end in free),
+        "free_runs": len(free),
+        "largest": max((end - start for _, start, end in free), default=0),
+    }
+    return offsets, stats
+
+def place(lengths, rom, start, align=ALIGN, margin=MARGIN, gap=GAP):
+    ''' pack, into the free space of rom (bytes or mmap) from start on.
+        Only runs the smallest chunk fits in are looked at. If start is
+        free, it's used even if the run there is short. '''
+    if not lengths:
+        return [], pack([], [])[1]
+    runs = free_runs(rom, start, min(lengths) + margin)
+    if (not runs or runs[0][0] != start) and rom[start:start+1] == b"\xFF":
+        end = start
+        while end < len(rom) and rom[end] == FREE:
+            end += 1
+        runs.insert(0, (start, end))
+    return pack(lengths, runs, align, margin, start, gap)
+
+def duplicates(chunks):
+    ''' For every chunk (bytes, or None if it can't be shared), the
+        index of the first one with the same bytes, and how many bytes
+        sharing saves '''
+    first = {}
+    same = []
+    saved = 0
+    for n, data in enumerate(chunks):
+        if data is None:
+            same.append(n)
+            continue
+        same.append(first.setdefault(data, n))
+        if same[-1] != n:
+            saved += len(data)
+    return same, saved
+
+def duplicates_report(same, saved):
+    shared = sum(1 for n, first in enumerate(same) if first != n)
+    return ("' {} chunks share the place of an identical one, {} bytes "
+            "saved\n").format(shared, hex(saved))
+
+def pack_report(stats):
+    ''' The stats from pack as comment lines '''
+    fragmentation = 0
+    if stats["free"]:
+        fragmentation = 100 - 100 * stats["largest"] // stats["free"]
+    return ("' packed {} chunks ({} bytes) in {} free runs, {} bytes lost "
+            "to margins and alignment\n"
+            "' free space left: {} bytes in {} runs, the largest {} bytes, "
+            "{}% fragmented\n").format(
+                stats["chunks"], hex(stats["bytes"]), stats["runs"],
+                hex(stats["padding"]), hex(stats["free"]),
+                stats["free_runs"], hex(stats["largest"]), fragmentation)
@@ -20,14 +20,24 @@
 
 import sys
 import os
-import argparse
 import re
+import time
+from collections import deque
+from functools import lru_cache
 from . import pokecommands as pk
 from . import text_translate
-from pprint import pprint
-from .preprocessor import preprocess, remove_comments
+from . import textlayout
+from .preprocessor import (preprocess, remove_comments, path_resolver,
+                           cached_resolver, get_defines)
 
 MAX_NOPS = 10
+# How #dyn chunks are placed, see alloc.pack (None for its defaults)
+DYN_ALIGN = None
+DYN_MARGIN = None
+# Whether identical #dyn chunks share a placement
+DEDUPE = False
+# Why a decompile can stop early, and how we call it in messages
+BUDGETS = {"bytes": "byte", "instructions": "instruction", "time": "time"}
 USING_WINDOWS = (os.name == 'nt')
 USING_DYNAMIC = False
 END_COMMANDS = ["end", "jump", "return"]
@@ -58,10 +68,12 @@ def vdebug(*args):
 
 def pdebug(*args):
     if not QUIET:
+        from pprint import pprint
         pprint(*args)
 
 def vpdebug(*args):
     if VERBOSE:
+        from pprint import pprint
         pprint(*args)
 
 def hprint(bytes_):
@@ -76,15 +88,25 @@ def phdebug(bytes_):
     if not QUIET:
         hprint(bytes_)
 
-def dirty_compile(text_script, include_path):
-    text_script = remove_comments(text_script)
-    text_script = re.sub("^[ \t]*", "", text_script, flags=re.MULTILINE)
+def dirty_compile(text_script, include_path, check_labels=True):
+    ''' The preprocessing. Without check_labels, @labels with no #org
+        are fine (objects get them when linked) '''
+    text_script = strip_script(text_script)
     text_script = preprocess(text_script, include_path)
-    text_script = regexps(text_script)
+    return compile_high_level(text_script, check_labels)
+
+def strip_script(text_script):
+    ''' Remove the comments and the indentation '''
+    text_script = remove_comments(text_script)
+    return re.sub("^[ \t]*", "", text_script, flags=re.MULTILINE)
+
+def compile_high_level(text_script, check_labels=True):
+    ''' What comes after the preprocessor '''
+    text_script = regexps(text_script, check_labels)
     text_script = compile_clike_blocks(text_script)
     return text_script
 
-def regexps(text_script):
+def regexps(text_script, check_labels=True):
     ''' Part of the preparsing '''
     # FIXME: We beak line numbers everywhere :(
     # XSE 1.1.1 like msgboxes
@@ -95,7 +117,7 @@ def regexps(text_script):
     # Join lines ending with \
     text_script = re.sub("\\\\\\n", r"", text_script)
     for label in re.findall(r"@\S+", text_script, re.MULTILINE):
-        if not "#org "+label in text_script:
+        if check_labels and not "#org "+label in text_script:
             raise Exception("ERROR: Unmatched @ label %s" % label)
     return text_script
 
@@ -124,81 +146,203 @@ def grep_statement(text, name):
     body = text[body_start:body_end]
     return (pos, body_end+1, condition, body)
 
-def compile_while(text_script, level):
-    pos, end_pos, condition, body = grep_statement(text_script, "while")
-    body = compile_clike_blocks(body, level+1)
-    # Any operator in the condition expression
-    part = ":while_start" + str(level) + '\n'
+def script_labels(text_script):
+    ''' What new_label needs: the :labels text_script has ("taken") and
+        the next number to try for every name '''
+    return {"taken": set(re.findall(r":\S+", text_script)), "next": {}}
+
+def new_label(name, labels):
+    ''' A :name0, :name1... label nothing in the script has, so every
+        block gets its own labels, however they're nested '''
+    n = labels["next"].get(name, 0)
+    while ":" + name + str(n) in labels["taken"]:
+        n += 1
+    labels["next"][name] = n + 1
+    labels["taken"].add(":" + name + str(n))
+    return ":" + name + str(n)
+
+def condition_jump(condition, label):
+    ''' The commands that jump to label if condition (see
+        compile_clike_blocks) is false '''
     for operator in OPERATORS_LIST:
         if operator in condition:
             var, constant = condition.split(operator)
-            part += "compare " + var.strip() + " " + constant.strip() + "\n"
-            part += ("if " + OPPOSITE_OPERATORS[operator] +
-                     " jump :while_end" + str(level) + '\n')
-            break
+            return ("compare " + var.strip() + " " + constant.strip() + "\n" +
+                    "if " + OPPOSITE_OPERATORS[operator] + " jump " + label +
+                    "\n")
+    # We are checking a flag
+    if condition[0] == "!":
+        flag = condition[1:]
+        operator = "=="
     else:
-        # We are checking a flag
-        if condition[0] == "!":
-            flag = condition[1:]
-            operator = "=="
-        else:
-            flag = condition
-            operator = "!="
-        part += "checkflag " + flag + "\n"
-        part += "if " + operator + " jump :while_end" + str(level) + '\n'
+        flag = condition
+        operator = "!="
+    return "checkflag " + flag + "\n" + "if " + operator + " jump " + label + "\n"
+
+def compile_while(text_script, labels):
+    pos, end_pos, condition, body = grep_statement(text_script, "while")
+    body = compile_clike_blocks(body, labels)
+    start = new_label("while_start", labels)
+    end = new_label("while_end", labels)
+    part = start + '\n'
+    part += condition_jump(condition, end)
     part += body
-    part += "\njump :while_start" + str(level)
-    part += "\n:while_end" + str(level) + "\n"
+    part += "\njump " + start
+    part += "\n" + end + "\n"
     # hack
     if text_script[pos] == "\n":
         pos -= 1
-    if text_script[end_pos] == "\n":
+    if text_script[end_pos:end_pos+1] == "\n":
         end_pos += 1
     text_script = text_script[:pos] + part + text_script[end_pos:]
     return text_script
 
-def compile_if(text_script, level):
+def compile_if(text_script, labels):
     pos, end_pos, condition, body = grep_statement(text_script, "if")
-    body = compile_clike_blocks(body)
+    body = compile_clike_blocks(body, labels)
     have_else = re.match("\\selse\\s*?{", text_script[end_pos:])
-    # Any operator in the condition expression
-    part = ''
-    for operator in OPERATORS_LIST:
-        if operator in condition:
-            var, constant = condition.split(operator)
-            part += "compare " + var.strip() + " " + constant.strip() + "\n"
-            part += ("if " + OPPOSITE_OPERATORS[operator] +
-                     " jump :if_end" + str(level) + '\n')
-            break
-    else:
-        # We are checking a flag
-        if condition[0] == "!":
-            flag = condition[1:]
-            operator = "=="
-        else:
-            flag = condition
-            operator = "!="
-        part += "checkflag " + flag + "\n"
-        part += "if " + operator + " jump :if_end" + str(level) + "\n"
-    part += body
+    else_body = ''
     if have_else:
         else_body_start, else_body_end = grep_part(text_script,
                                                    end_pos, "{", "}")
         else_body = text_script[else_body_start:else_body_end]
-        else_body = compile_clike_blocks(else_body, level+1)
-        part += "\njump :else_end" + str(level) + "\n"
-        part += ":if_end" + str(level) + "\n"
-        part += else_body + '\n:else_end' + str(level) + '\n'
+        else_body = compile_clike_blocks(else_body, labels)
+    if_end = new_label("if_end", labels)
+    part = condition_jump(condition, if_end)
+    part += body
+    if have_else:
+        else_end = new_label("else_end", labels)
+        part += "\njump " + else_end + "\n"
+        part += if_end + "\n"
+        part += else_body + '\n' + else_end + '\n'
         end_pos = else_body_end + 1
 
     else:
-        part += "\n:if_end" + str(level)
+        part += "\n" + if_end
     text_script = text_script[:pos] + part + text_script[end_pos:]
     return text_script
 
-def compile_clike_blocks(text_script, level=0):
+CASE_RE = re.compile(r"(?:case\s+(\S+?)|default)\s*:(.*)")
+MAX_VAR_VALUE = 0xFFFF
+
+def switch_cases(var, body):
+    ''' Split a switch body into [values, is default, lines] cases.
+        case lines right after each other share the lines. '''
+    cases = []
+    depth = 0
+    for line in body.split("\n"):
+        stripped = line.strip()
+        m = CASE_RE.match(stripped) if depth == 0 else None
+        if m:
+            if not cases or cases[-1][2]:
+                cases.append([[], False, []])
+            if m.group(1) is None:
+                cases[-1][1] = True
+            else:
+                value = m.group(1)
+                try:
+                    value = int(value, 16) if value[:2] == "0x" else int(value)
+                except ValueError:
+                    raise Exception("ERROR: bad case in switch (" + var +
+                                    "): " + value)
+                if not 0 <= value <= MAX_VAR_VALUE:
+                    raise Exception("ERROR: case out of range in switch (" +
+                                    var + "): " + hex(value))
+                cases[-1][0].append(value)
+            if m.group(2).strip():
+                cases[-1][2].append(m.group(2).strip())
+            continue
+        if not stripped:
+            continue
+        if not cases:
+            raise Exception("ERROR: there are commands before the first "
+                            "case in switch (" + var + ")")
+        cases[-1][2].append(line)
+        if stripped[0] != "=":
+            depth += line.count("{") - line.count("}")
+    values = [value for case in cases for value in case[0]]
+    if len(values) != len(set(values)):
+        raise Exception("ERROR: a case is there twice in switch (" + var +
+                        ")")
+    if sum(1 for case in cases if case[1]) > 1:
+        raise Exception("ERROR: more than one default in switch (" + var +
+                        ")")
+    return cases
+
+def case_intervals(targets):
+    ''' {value: label} -> sorted [low, high, label] runs of values that
+        go to the same label '''
+    intervals = []
+    for value in sorted(targets):
+        if (intervals and intervals[-1][1] == value - 1 and
+                intervals[-1][2] == targets[value]):
+            intervals[-1][1] = value
+        else:
+            intervals.append([value, value, targets[value]])
+    return intervals
+
+def switch_tree(var, intervals, default, new_node, low=0,
+                high=MAX_VAR_VALUE):
+    ''' Jumps to the label of the interval var is in, or to default,
+        comparing against the middle interval first, so there are
+        O(log n) compares on any path. low and high are what var can be
+        here, so we don't test what we already know. '''
+    if not intervals:
+        return "jump " + default + "\n"
+    mid = len(intervals) // 2
+    first, last, target = intervals[mid]
+    left, right = intervals[:mid], intervals[mid+1:]
+    left_label = new_node() if left else default
+    part = ''
+    compared = None
+    if first > low:
+        part += "compare " + var + " " + hex(first) + "\n"
+        part += "if < jump " + left_label + "\n"
+        compared = first
+    if last < high:
+        if compared != last:
+            part += "compare " + var + " " + hex(last) + "\n"
+        part += "if <= jump " + target + "\n"
+        part += switch_tree(var, right, default, new_node, last + 1, high)
+    else:
+        part += "jump " + target + "\n"
+    if left:
+        part += left_label + "\n"
+        part += switch_tree(var, left, default, new_node, low, first - 1)
+    return part
+
+def compile_switch(text_script, labels):
+    pos, end_pos, var, body = grep_statement(text_script, "switch")
+    var = var.strip()
+    cases = switch_cases(var, body)
+    bodies = [compile_clike_blocks("\n".join(case[2]), labels)
+              for case in cases]
+    end = new_label("switch_end", labels)
+    case_labels = [new_label("case", labels) for case in cases]
+    default = next((label for label, case in zip(case_labels, cases)
+                    if case[1]), end)
+    targets = {value: label for label, case in zip(case_labels, cases)
+               for value in case[0]}
+    part = switch_tree(var, case_intervals(targets), default,
+                       lambda: new_label("switch_node", labels))
+    for i, (label, case_body) in enumerate(zip(case_labels, bodies)):
+        part += label + "\n" + case_body + "\n"
+        # Cases don't fall through
+        if i < len(bodies) - 1:
+            part += "jump " + end + "\n"
+    part += end + "\n"
+    # hack
+    if text_script[pos] == "\n":
+        pos -= 1
+    if text_script[end_pos:end_pos+1] == "\n":
+        end_pos += 1
+    text_script = text_script[:pos] + part + text_script[end_pos:]
+    return text_script
+
+def compile_clike_blocks(text_script, labels=None):
     ''' The awesome preparsing (actually you could call it compiling)
-        of cool stuctures '''
+        of cool stuctures. labels is what new_label needs, from the
+        whole script (see script_labels) '''
     # FIXME: this is crap really
 
     # Okay, so this is what we want:
@@ -217,26 +361,44 @@ def compile_clike_blocks(text_script, level=0):
     #   . . .
     # }]
     #
-    # 3. ----------- expressions -----------
+    # 3. ----------- switch -----------
+    # switch (<var num>) {
+    # case <literal num>:
+    # [case <literal num>:]
+    #   <command>
+    #   . . .
+    # [default:
+    #   <command>
+    #   . . .]
+    # }
+    # Cases don't fall through to the next one.
+    #
+    # 4. ----------- expressions -----------
     # (<var num> <operator> <literal num>)
     # or
     # (<flag num>)
 
+    if labels is None:
+        labels = script_labels(text_script)
+
+    while re.search(r"switch.?\(", text_script):
+        text_script = compile_switch(text_script, labels)
+
     while re.search(r"while.?\(", text_script):
-        text_script = compile_while(text_script, level)
-        level += 1
+        text_script = compile_while(text_script, labels)
 
     # I'll refactor this one day, I promise =P
     while re.search(r"if.?\(", text_script):
-        text_script = compile_if(text_script, level)
-        level += 1
+        text_script = compile_if(text_script, labels)
 
     text_script = text_script.strip("\n")
     return text_script
 
 def asm_parse(text_script, end_commands=("end", "softend"),
-        cmd_table=pk.pkcommands):
+        cmd_table=None):
     ''' The basic language preparsing function '''
+    if cmd_table is None:
+        cmd_table = pk.pkcommands
     list_script = text_script.split("\n")
     org_i = -1
     dyn = (False, 0)
@@ -343,62 +505,12 @@ def asm_parse(text_script, end_commands=("end", "softend"),
     return parsed_list, dyn
 
 def text_len(text):
-    #"0-9": "6",
-    #"..": "6",
-    #"A-Z": "6",
-    #"a-h": "6",
-    #"s-z": "6",
-    #"m-q": "6",
-    #"€": "6",
-    #'"': "6 (both)",
-    #"k": "6",
-    #"/": "6",
-    #"male": "6",
-    #"female": "6",
-    kernings = {
-        "!": 3,
-        "?": 6,
-        ".": 3,
-        #":": 5,
-        "·": 3,
-        "'": 3,
-        ",": 3,
-        "i": 4,
-        "j": 5,
-        "l": 3,
-        "r": 5,
-        ":": 3,
-        "↑": 7,
-        "→": 7,
-        "↓": 7,
-        "←": 7,
-        "+": 7,
-        " ": 3,
-    }
-    return sum([kernings[c] if c in kernings else 6 for c in text])
+    ''' Width of text in px, see textlayout '''
+    return textlayout.text_len(text)
 
 def autocut_text(text):
-    maxlen = 35 * 6
-    words = text.split(" ")
-    text = ''
-    line = ''
-    i = 0
-    delims = ('\\n', '\\p')
-    delim = 0
-    while i < len(words):
-        word = words[i]
-        if text_len(word) > maxlen:
-            line += words[i] + " "
-            i += 1
-        while i < len(words) and text_len(line+words[i]) < maxlen:
-            word = words[i]
-            line += word + " "
-            i += 1
-        text += line.rstrip(" ") + delims[delim]
-        delim = not delim
-        line = ''
-    text = text.rstrip('\\p').rstrip('\\n').rstrip(" ")
-    return text
+    ''' Wrap text to the text box with \\n and \\p '''
+    return textlayout.reflow(text)
 
 def find_nth(text, string, n):
     start = text.find(string)
@@ -407,13 +519,20 @@ def find_nth(text, string, n):
         n -= 1
     return start
 
-def make_bytecode(script_list, cmd_table=pk.pkcommands):
-    ''' Compile parsed script list '''
+def make_bytecode(script_list, cmd_table=None, relocations=None):
+    ''' Compile parsed script list.
+        With a relocations list, @labels and :labels don't need to be
+        known: they are left as zeros of the argument's size, and a list
+        of (position in the chunk, size, label, True if it's a pointer)
+        is appended to relocations for every chunk. '''
+    if cmd_table is None:
+        cmd_table = pk.pkcommands
     hex_scripts = []
     for script in script_list:
         addr = script[0]
         bytecode = b""
         labels = []
+        chunk_relocations = []
 
         for line in script[1:]:
             command = line[0]
@@ -424,6 +543,10 @@ def make_bytecode(script_list, cmd_table=pk.pkcommands):
             elif command == '#raw':
                 hexcommand = args[0]
                 bytecode += int(hexcommand, 16).to_bytes(1, "little")
+            elif command == '#fill':
+                count, hexcommand = args
+                count = int(count, 16) if count[:2] == "0x" else int(count)
+                bytecode += int(hexcommand, 16).to_bytes(1, "little") * count
             elif command[0] == ":":
                 labels.append([command, len(bytecode)])
             else:
@@ -454,6 +577,17 @@ def make_bytecode(script_list, cmd_table=pk.pkcommands):
                             arg_bytes = (cmd_table[command]["args"][2] +
                                          arg_bytes)
                         hexargs += arg_bytes
+                    elif relocations is not None:
+                        arg_len = cmd_table[command]["args"][1][i]
+                        prefix = b""
+                        if len(cmd_table[command]["args"]) == 3:
+                            prefix = cmd_table[command]["args"][2]
+                        pointer = any(o[0] == i for o in
+                                      cmd_table[command].get("offset", ()))
+                        chunk_relocations.append(
+                            (len(bytecode) + 1 + len(hexargs) + len(prefix),
+                             arg_len, arg, pointer))
+                        hexargs += prefix + bytes(arg_len)
                     else:
                         if arg[0] == "@" and not USING_DYNAMIC:
                             error = "No #dynamic statement"
@@ -470,6 +604,8 @@ def make_bytecode(script_list, cmd_table=pk.pkcommands):
 
         hex_script = [addr, bytecode, labels]
         hex_scripts.append(hex_script)
+        if relocations is not None:
+            relocations.append(chunk_relocations)
     return hex_scripts
 
 
@@ -493,107 +629,297 @@ def put_addresses_labels(hex_chunks, text_script):
 
 def put_addresses(hex_chunks, text_script, file_name, dyn):
     ''' Find free space and replace #dynamic @labels with real addresses '''
-    dynamic_start = int(dyn, 16)
     rom_file_r = open(file_name, "rb")
     rom_bytes = rom_file_r.read()
     rom_file_r.close()
+    return place_dynamic(hex_chunks, text_script, rom_bytes, dyn)
+
+def place_dynamic(hex_chunks, text_script, rom_bytes, dyn,
+                  relocations=None):
+    ''' put_addresses, with the ROM already in memory (bytes, bytearray
+        or mmap). All the chunks are packed at once (see alloc.place),
+        with DYN_ALIGN and DYN_MARGIN, and the log ends with how well
+        it went.
+        With relocations (see make_bytecode), chunks that don't point
+        anywhere and have the same bytes are placed only once. '''
+    from . import alloc
+    dynamic_start = int(dyn, 16)
+    dynamic = [i for i, chunk in enumerate(hex_chunks) if chunk[0][0] == "@"]
+    if not dynamic:
+        return text_script, ''
+    same = list(range(len(dynamic)))
+    report = ''
+    if relocations is not None:
+        same, saved = alloc.duplicates([None if relocations[i] else
+                                        bytes(hex_chunks[i][1])
+                                        for i in dynamic])
+        report = alloc.duplicates_report(same, saved)
+    unique = [n for n, first in enumerate(same) if first == n]
+    offsets, stats = alloc.place([len(hex_chunks[dynamic[n]][1])
+                                  for n in unique], rom_bytes,
+                                 dynamic_start, *dyn_options())
+    placed = dict(zip(unique, offsets))
+    offsets = [placed[first] for first in same]
+    addresses = {}
     offsets_found_log = ''
-    last = dynamic_start
-    for i, chunk in enumerate(hex_chunks):
-        vdebug(chunk)
-        offset = chunk[0]
-        part = chunk[1] # The hex chunk we have to put somewhere
-        #labels = chunk[2]
-        if offset[0] != "@":
-            continue
-        length = len(part) + 2
-        free_space = b"\xFF" * length
-        address_with_free_space = rom_bytes.find(free_space, last)
-        # It's always good to leave some margin around things.
-        # If there is free space at the address the user has given us,
-        # though, it's ok to use it without margin.
-        if address_with_free_space != dynamic_start:
-            address_with_free_space += 2
-        if address_with_free_space == -1:
-            print(len(rom_bytes))
-            print(len(free_space))
-            print(dynamic_start)
-            print(last)
-            raise Exception("No free space to put script.")
-        text_script = text_script.replace(" " + offset + " ",
-                                          " " + hex(address_with_free_space) + " ")
-        text_script = text_script.replace(" " + offset + "\n",
-                                          " " + hex(address_with_free_space) + "\n")
-        hex_chunks[i][0] = hex(address_with_free_space)
-        last = address_with_free_space + length + 10
-        offsets_found_log += (offset + ' - ' +
-                              hex(address_with_free_space) + '\n')
-    return text_script, offsets_found_log
-
-def write_hex_script(hex_scripts, rom_file_name):
-    ''' Write every chunk of bytes onto the big ROM file '''
-    file_name = rom_file_name
+    for i, offset in zip(dynamic, offsets):
+        label = hex_chunks[i][0]
+        hex_chunks[i][0] = hex(offset)
+        addresses.setdefault(label, hex(offset))
+        offsets_found_log += label + ' - ' + hex(offset) + '\n'
+    # One pass for every label, instead of a replace per label
+    text_script = re.sub(r"(?<= )@\S+(?=[ \n])",
+                         lambda m: addresses.get(m.group(), m.group()),
+                         text_script)
+    return (text_script,
+            offsets_found_log + alloc.pack_report(stats) + report)
+
+def dyn_options():
+    ''' DYN_ALIGN and DYN_MARGIN, with alloc's defaults for None '''
+    from . import alloc
+    return (alloc.ALIGN if DYN_ALIGN is None else DYN_ALIGN,
+            alloc.MARGIN if DYN_MARGIN is None else DYN_MARGIN)
+
+def apply_chunks(hex_scripts, rom):
+    ''' write_hex_script for a ROM in memory (a bytearray or a writable
+        mmap) '''
     for script in hex_scripts:
-        with open(file_name, "rb") as f:
-            rom_bytes = f.read()
-        rom_ba = bytearray(rom_bytes)
-        offset = int(script[0], 16)
-        offset = get_rom_offset(offset)
-        hex_script = script[1]
-        vdebug("chunk length = " + hex(len(hex_script)))
-        rom_ba[offset:offset+len(hex_script)] = hex_script
-
-        with open(file_name, "wb") as f:
-            f.write(rom_ba)
+        offset = get_rom_offset(int(script[0], 16))
+        rom[offset:offset+len(script[1])] = script[1]
+
+def write_hex_script(hex_scripts, rom_file_name, journal_file_name=None):
+    ''' Write every chunk of bytes onto the big ROM file. With a
+        journal file, the bytes that get overwritten are appended to it
+        first, so the build can be reverted '''
+    with open(rom_file_name, "r+b") as f:
+        if journal_file_name:
+            from . import journal
+            journal.record(f, hex_scripts, journal_file_name)
+        for script in hex_scripts:
+            offset = int(script[0], 16)
+            offset = get_rom_offset(offset)
+            hex_script = script[1]
+            vdebug("chunk length = " + hex(len(hex_script)))
+            f.seek(offset)
+            f.write(hex_script)
 
 
 def decompile(file_name, offset, type_="script", raw=False,
               end_commands=END_COMMANDS, end_hex_commands=END_HEX_COMMANDS,
-              cmd_table=pk.pkcommands, dec_table=pk.dec_pkcommands,
-              verbose=0):
+              cmd_table=None, dec_table=None, verbose=0, symbolize=True):
+    return "".join(iter_decompile(file_name, offset, type_, raw,
+                                  end_commands, end_hex_commands,
+                                  cmd_table, dec_table, verbose,
+                                  symbolize=symbolize))
+
+def iter_decompile(file_name, offset, type_="script", raw=False,
+                   end_commands=END_COMMANDS,
+                   end_hex_commands=END_HEX_COMMANDS,
+                   cmd_table=None, dec_table=None, verbose=0,
+                   max_bytes=0, max_instructions=0, max_time=0,
+                   symbolize=True):
+    ''' Like decompile, but yields every #org block as soon as
+        it is decoded. See decompile_records for the budgets and
+        symbolize. The stdlib files the names come from are #include'd
+        right before the first block that needs them. '''
+    if cmd_table is None:
+        cmd_table = pk.pkcommands
     # Preparem ROM text
     debug("'file name = " + file_name)
     debug("'address = " + hex(offset))
     debug("'---\n")
     with open(file_name, "rb") as f:
         rombytes = f.read()
-    offsets = [[offset, type_]]
-    textscript = ''
-    decompiled_offsets = []
+    from . import symbols
+    files = symbols.name_files(data_path, rom_game(rombytes))
+    included = set()
+    for record in decompile_records(rombytes, offset, type_, raw,
+                                    end_commands, end_hex_commands,
+                                    cmd_table, dec_table, max_bytes,
+                                    max_instructions, max_time, symbolize):
+        # Names need their #define's to compile back
+        new_files = [fn for fn in record_includes(record, files)
+                     if fn not in included]
+        if new_files:
+            included.update(new_files)
+            yield "".join('#include "' + fn + '"\n' for fn in new_files) + "\n"
+        yield format_record(record, rombytes, cmd_table, verbose)
+
+def record_includes(record, files):
+    ''' The stdlib files with the names used in a record, files being
+        symbols.name_files '''
+    needed = []
+    if record["type"] == "summary":
+        return needed
+    if any(name is not None for name in record.get("mnemonics", ())):
+        needed.append(MOVEMENTS_FILE)
+    for ins in record.get("instructions", ()):
+        for name in ins.get("symbols", ()):
+            if name is not None and files[name] not in needed:
+                needed.append(files[name])
+    return needed
+
+def script_pointers(rombytes, offsets):
+    ''' (operand offset, target) for every pointer in the scripts that
+        can be reached from offsets '''
+    for offset in offsets:
+        for record in decompile_records(rombytes, offset, symbolize=False):
+            for ins in record.get("instructions", ()):
+                for pointer in ins["pointers"]:
+                    yield pointer["at"], pointer["target"]
+
+def rom_game(rombytes):
+    ''' "RS", "FR", "EM" or None '''
+    return GAME_CODES.get(bytes(rombytes[0xAC:0xB0]))
+
+def iter_decompile_records(file_name, offset, type_="script", raw=False,
+                           end_commands=END_COMMANDS,
+                           end_hex_commands=END_HEX_COMMANDS,
+                           cmd_table=None, dec_table=None,
+                           max_bytes=0, max_instructions=0, max_time=0,
+                           symbolize=True):
+    ''' Like iter_decompile, but yields the records from
+        decompile_records instead of text '''
+    with open(file_name, "rb") as f:
+        rombytes = f.read()
+    yield from decompile_records(rombytes, offset, type_, raw,
+                                 end_commands, end_hex_commands,
+                                 cmd_table, dec_table, max_bytes,
+                                 max_instructions, max_time, symbolize)
+
+def decompile_records(rombytes, offset, type_="script", raw=False,
+                      end_commands=END_COMMANDS,
+                      end_hex_commands=END_HEX_COMMANDS,
+                      cmd_table=None, dec_table=None,
+                      max_bytes=0, max_instructions=0, max_time=0,
+                      symbolize=True):
+    ''' Follow the pointers from offset and yield a dict for every
+        block found, in the same order decompile writes them:
+        {"offset", "type" ("script", "text", "movs" or "raw"), "length"}
+        plus "instructions" and "stopped" for scripts (see
+        decode_script), "text" for text and "data" (hex) for the rest.
+        Offsets are in the same form they have in the ROM/script.
+        offset can also be a list of them, to follow the pointers from
+        all of them at once, so every block is decoded only once.
+
+        max_bytes, max_instructions and max_time (seconds) limit the
+        whole crawl (0 means no limit). When one runs out, the last
+        record has type "summary", with what stopped it ("stopped"),
+        what was decoded ("blocks", "bytes", "instructions") and the
+        [offset, type] pairs that were never reached ("unexplored").
+
+        With symbolize, arguments and movements that have a name in
+        the stdlib get it (only with the script command table). '''
+    deadline = time.monotonic() + max_time if max_time else None
+    game = rom_game(rombytes)
+    if (symbolize and not raw and
+            (cmd_table is None or cmd_table is pk.pkcommands)):
+        from . import symbols
+        symbol_index = symbols.symbol_index(data_path, game)
+    else:
+        symbol_index = None
+    total_bytes = 0
+    total_instructions = 0
+    blocks = 0
+    if isinstance(offset, list):
+        roots = list(dict.fromkeys(offset))
+    else:
+        roots = [offset]
+    offsets = deque([root, type_] for root in roots)
+    queued = {(root, type_) for root in roots}
+    decompiled_offsets = set()
+    stopped = None
     while offsets:
         offset = offsets[0][0]
         type_ = offsets[0][1]
+        if max_bytes and total_bytes >= max_bytes:
+            stopped = "bytes"
+        elif max_instructions and total_instructions >= max_instructions:
+            stopped = "instructions"
+        elif deadline is not None and time.monotonic() >= deadline:
+            stopped = "time"
+        if stopped in BUDGETS:
+            break
+        rom_offset = get_rom_offset(offset)
+        record = {"offset": offset, "type": type_}
         if type_ == "script":
-            textscript_, new_offsets = demake_bytecode(rombytes, offset,
-                                                       offsets,
-                                                       end_commands=end_commands,
-                                                       end_hex_commands=end_hex_commands,
-                                                       raw=raw,
-                                                       cmd_table=cmd_table,
-                                                       dec_table=dec_table,
-                                                       verbose=verbose)
-            textscript += ("#org " + hex(offset) + "\n" +
-                           textscript_ + "\n")
-            for new_offset in new_offsets:
-                new_offset[0] &= 0xffffff
-                if (new_offset not in offsets and
-                        new_offset[0] not in decompiled_offsets):
-                    offsets += [new_offset]
-        if type_ == "text":
-            text = decompile_text(rombytes, offset, raw=raw)
-            lines = [text[i:i+80] for i in range(0, len(text), 80)]
-            text = "".join([("= " + line + "\n") for line in lines])
-            textscript += ("#org " + hex(offset) + "\n" + text)
+            instructions, stopped = decode_script(
+                rombytes, offset, end_commands, end_hex_commands, raw,
+                cmd_table, dec_table,
+                max_bytes - total_bytes if max_bytes else 0,
+                max_instructions - total_instructions
+                if max_instructions else 0,
+                deadline, symbol_index)
+            total_instructions += len(instructions)
+            record["length"] = sum(ins["length"] for ins in instructions)
+            record["instructions"] = instructions
+            record["stopped"] = stopped
+            for ins in instructions:
+                for pointer in ins["pointers"]:
+                    new_offset = (pointer["target"] & 0xffffff,
+                                  pointer["type"])
+                    if (new_offset not in queued and
+                            new_offset[0] not in decompiled_offsets):
+                        queued.add(new_offset)
+                        offsets.append(list(new_offset))
+        elif type_ == "text":
+            end = rombytes.find(b"\xff", rom_offset)
+            if end == -1:
+                end = rom_offset - 1
+            record["length"] = end - rom_offset + 1
+            record["text"] = decompile_text(rombytes, offset, raw=raw)
         # TODO: make them separate, nicer mov decomp
-        if type_ == "movs" or type_ == "raw":
-            textscript_tmp = decompile_movs(rombytes, offset, raw=raw)
-            textscript += ("#org " + hex(offset) + "\n" +
-                           textscript_tmp + "\n")
-        del offsets[0]
-        decompiled_offsets.append(offset)
-        # Removing duplicates doesn't hurt, right?
-        decompiled_offsets = list(set(decompiled_offsets))
-    return textscript
+        elif type_ == "movs" or type_ == "raw":
+            # Both end at 0xFE or 0xFF, like movements
+            data = decompile_raw_bytes(rombytes, offset, (0xFE, 0xFF))
+            record["length"] = len(data)
+            record["data"] = data.hex()
+            if type_ == "movs" and game is not None and symbol_index:
+                table = movement_table(game)
+                record["mnemonics"] = [table.get(n) for n in data]
+        total_bytes += record.get("length", 0)
+        blocks += 1
+        yield record
+        queued.discard(tuple(offsets.popleft()))
+        decompiled_offsets.add(offset)
+    if stopped in BUDGETS:
+        yield {"offset": offset, "type": "summary", "stopped": stopped,
+               "blocks": blocks, "bytes": total_bytes,
+               "instructions": total_instructions,
+               "unexplored": list(offsets)}
+
+def format_record(record, rombytes, cmd_table=None, verbose=0):
+    ''' The #org block for a record from decompile_records '''
+    offset = record["offset"]
+    if record["type"] == "summary":
+        return format_summary(record)
+    if record["type"] == "script":
+        return ("#org " + hex(offset) + "\n" +
+                format_instructions(record["instructions"], record["stopped"],
+                                    rombytes, verbose) + "\n")
+    if record["type"] == "text":
+        text = record["text"]
+        lines = [text[i:i+80] for i in range(0, len(text), 80)]
+        text = "".join([("= " + line + "\n") for line in lines])
+        return "#org " + hex(offset) + "\n" + text
+    data = bytes.fromhex(record["data"])
+    if "mnemonics" in record:
+        lines = [RAW_LINES[n] if name is None else name + "\n"
+                 for n, name in zip(data, record["mnemonics"])]
+    else:
+        lines = [RAW_LINES[n] for n in data]
+    return "#org " + hex(offset) + "\n" + "".join(lines) + "\n"
+
+def format_summary(record):
+    text = ("' Stopped: " + BUDGETS[record["stopped"]] + " budget used up"
+            " after " + str(record["blocks"]) + " blocks, " +
+            str(record["bytes"]) + " bytes, " + str(record["instructions"]) +
+            " instructions\n")
+    if record["unexplored"]:
+        text += "' Unexplored:\n"
+        text += "".join("'   " + hex(o) + " " + t + "\n"
+                        for o, t in record["unexplored"])
+    return text
 
 
 def get_rom_offset(offset):
@@ -602,28 +928,47 @@ def get_rom_offset(offset):
         rom_offset -= 0x8000000
     return rom_offset
 
-def demake_bytecode(rombytes, offset, added_offsets,
-                    end_commands=END_COMMANDS,
-                    end_hex_commands=END_HEX_COMMANDS, raw=False,
-                    cmd_table=pk.pkcommands,
-                    dec_table=pk.dec_pkcommands,
-                    verbose=0):
-    rom_offset = get_rom_offset(offset)
-    offsets = []
+def decode_script(rombytes, offset, end_commands=END_COMMANDS,
+                  end_hex_commands=END_HEX_COMMANDS, raw=False,
+                  cmd_table=None, dec_table=None, max_bytes=0,
+                  max_instructions=0, deadline=None, symbol_index=None):
+    ''' Decode the script at offset. Returns a list of instructions,
+        {"offset", "length", "mnemonic", "operands",
+         "pointers": [{"operand", "target", "type", "at" (its offset)}]}
+        (#raw bytes have "#raw" as mnemonic and the byte as operand),
+        plus "symbols", the name (or None) of every operand, if
+        symbol_index (from symbols.symbol_index) has one for any,
+        and why decoding stopped early: "nops" (too many nops), "end"
+        (end of the ROM), "bytes", "instructions" or "time" (a budget,
+        deadline is a time.monotonic() value), or None '''
+    if cmd_table is None:
+        cmd_table = pk.pkcommands
+    if dec_table is None:
+        dec_table = pk.dec_pkcommands
     hexscript = rombytes
-    i = rom_offset
-    textscript = ""
+    i = get_rom_offset(offset)
+    instructions = []
     text_command = ""
-    hex_command = 0
-    hex_command = hexscript[i]
+    hex_command = hexscript[i] if i < len(hexscript) else None
     nop_count = 0 # Stop on 10 nops for safety
+    start = i
     while (text_command not in end_commands and
            hex_command not in end_hex_commands):
+        if i >= len(hexscript):
+            return instructions, "end"
+        if max_bytes and i - start >= max_bytes:
+            return instructions, "bytes"
+        if max_instructions and len(instructions) >= max_instructions:
+            return instructions, "instructions"
+        if deadline is not None and time.monotonic() >= deadline:
+            return instructions, "time"
         hex_command = hexscript[i]
         orig_i = i
+        operands = []
+        pointers = []
         if hex_command in dec_table and not raw:
             text_command = dec_table[hex_command]
-            textscript += text_command
+            mnemonic = text_command
             i += 1
             command_data = cmd_table[text_command]
             if "args" in command_data:
@@ -632,101 +977,157 @@ def demake_bytecode(rombytes, offset, added_offsets,
                 for n, arg_len in enumerate(command_data["args"][1]):
                     arg = hexscript[i:i + arg_len]
                     arg = int.from_bytes(arg, "little")
-                    if "offset" in command_data:
-                        for o_arg_n, o_type in command_data["offset"]:
-                            if o_arg_n == n:
-                                tuple_to_add = [arg, o_type]
-                                if tuple_to_add not in added_offsets+offsets:
-                                    offsets.append(tuple_to_add)
-                    textscript += " " + hex(arg)
+                    for o_arg_n, o_type in command_data.get("offset", ()):
+                        if o_arg_n == n:
+                            pointers.append({"operand": n, "target": arg,
+                                             "type": o_type, "at": i})
+                    operands.append(arg)
                     i += arg_len
         else:
-            textscript += "#raw " + hex(hex_command)
+            mnemonic = "#raw"
+            operands.append(hex_command)
             i += 1
+        instruction = {"offset": orig_i, "length": i - orig_i,
+                       "mnemonic": mnemonic, "operands": operands,
+                       "pointers": pointers}
+        if symbol_index and mnemonic in symbol_index:
+            for n, table in symbol_index[mnemonic]:
+                if operands[n] in table:
+                    if "symbols" not in instruction:
+                        instruction["symbols"] = [None] * len(operands)
+                    instruction["symbols"][n] = table[operands[n]]
+        instructions.append(instruction)
         if hex_command == 0:
             nop_count += 1
             if nop_count >= MAX_NOPS and MAX_NOPS != 0:
-                textscript += " ' Too many nops. Stopping"
-                break
+                return instructions, "nops"
         else:
             nop_count = 0
+    return instructions, None
 
+def format_instructions(instructions, stopped, rombytes, verbose=0):
+    ''' Script text for the instructions from decode_script '''
+    lines = []
+    for ins in instructions:
+        line = format_instruction(ins)
         if verbose >= 1:
-            textscript += " //" + " ".join(hex(n)[2:].zfill(2) for n in hexscript[orig_i:i])
+            start = ins["offset"]
+            end = start + ins["length"]
+            line += " //" + " ".join(hex(n)[2:].zfill(2)
+                                     for n in rombytes[start:end])
             if verbose >= 2:
-                textscript += " -  " + hex(orig_i)
-        textscript += "\n"
-
-    #print(textscript)
-    #print("offsets")
-    #for o, type in offsets:
-    #    print(hex(o), type)
-    #print(offsets)
+                line += " -  " + hex(start)
+        lines.append(line + "\n")
+    if stopped == "nops":
+        lines[-1] = (format_instruction(instructions[-1]) +
+                     " ' Too many nops. Stopping")
+    elif stopped == "end":
+        lines.append("' End of the ROM. Stopping\n")
+    return "".join(lines)
+
+def format_instruction(ins):
+    if "symbols" in ins:
+        return ins["mnemonic"] + "".join(
+            " " + (hex(arg) if name is None else name)
+            for arg, name in zip(ins["operands"], ins["symbols"]))
+    return ins["mnemonic"] + "".join(" " + hex(arg) for arg in ins["operands"])
 
+def demake_bytecode(rombytes, offset, added_offsets,
+                    end_commands=END_COMMANDS,
+                    end_hex_commands=END_HEX_COMMANDS, raw=False,
+                    cmd_table=None, dec_table=None, verbose=0,
+                    symbol_index=None):
+    instructions, stopped = decode_script(rombytes, offset, end_commands,
+                                          end_hex_commands, raw,
+                                          cmd_table, dec_table,
+                                          symbol_index=symbol_index)
+    offsets = []
+    for ins in instructions:
+        for pointer in ins["pointers"]:
+            tuple_to_add = [pointer["target"], pointer["type"]]
+            if tuple_to_add not in added_offsets+offsets:
+                offsets.append(tuple_to_add)
+    textscript = format_instructions(instructions, stopped, rombytes,
+                                     verbose)
     return textscript, offsets
 
-def decompile_rawh(romtext, offset, end_hex_commands=[0xFF], raw=False):
+# One "#raw 0x.." line for every byte value
+RAW_LINES = tuple("#raw " + hex(n) + "\n" for n in range(256))
+MOVEMENTS_FILE = "stdlib/stdmoves.rbh"
+
+@lru_cache(maxsize=None)
+def movement_table(game):
+    ''' Movement names by byte for a game ("RS", "FR" or "EM"), from
+        the stdlib's #define's. Built once. Bytes without a name (and
+        games without a table) decompile as #raw. '''
+    defines = get_defines("#define " + game + "\n" +
+                          '#include "' + MOVEMENTS_FILE + '"\n',
+                          path_resolver((data_path,)))
+    table = {}
+    for name, value in defines:
+        value = value.split()
+        if len(value) == 2 and value[0] == "#raw":
+            table.setdefault(int(value[1], 16), name)
+    return table
+
+@lru_cache(maxsize=None)
+def movement_lines(game):
+    ''' Like RAW_LINES, using the movement names where there is one '''
+    table = movement_table(game)
+    return tuple(table[n] + "\n" if n in table else RAW_LINES[n]
+                 for n in range(256))
+
+def find_end(romtext, start, end_hex_commands):
+    ''' Position of the first of end_hex_commands from start on, or
+        the end of romtext if there's none '''
+    end = len(romtext)
+    for terminator in end_hex_commands:
+        # No need to look past the first terminator we already found
+        pos = romtext.find(bytes((terminator,)), start, end)
+        if pos != -1:
+            end = pos
+    return end
+
+def decompile_raw_bytes(romtext, offset, end_hex_commands=(0xFF,)):
+    ''' The bytes from offset to the first of end_hex_commands,
+        terminator included '''
     rom_offset = get_rom_offset(offset)
-    vdebug(offset)
-    hexscript = romtext
-    i = rom_offset
-    textscript = ""
-    hex_command = ""
-    while hex_command not in end_hex_commands:
-        try:
-            hex_command = hexscript[i]
-        except IndexError:
-            break
-        textscript += "#raw " + hex(hex_command)
-        i += 1
-        textscript += "\n"
-    return textscript
+    end = find_end(romtext, rom_offset, end_hex_commands)
+    return bytes(memoryview(romtext)[rom_offset:end + 1])
 
-def decompile_rawb(romtext, offset, end_hex_commands=[0xFF], raw=False):
-    rom_offset = get_rom_offset(offset)
+def decompile_raw(romtext, offset, end_hex_commands=(0xFF,), lines=RAW_LINES):
+    ''' Decompile the bytes from offset to the first of
+        end_hex_commands, one line per byte taken from lines (a byte ->
+        line table like RAW_LINES) '''
     vdebug(offset)
-    hexscript = romtext
-    i = rom_offset
-    textscript = ""
-    hex_command = ""
-    while hex_command not in end_hex_commands:
-        try:
-            hex_command = hexscript[i]
-        except IndexError:
-            break
-        textscript += "#raw " + hex(hex_command)
-        i += 1
-        textscript += "\n"
-    return textscript
+    data = decompile_raw_bytes(romtext, offset, end_hex_commands)
+    return "".join([lines[n] for n in data])
 
-# TODO: use nice define'd thingies
-def decompile_movs(romtext, offset, end_hex_commands=[0xFE, 0xFF], raw=False):
-    rom_offset = get_rom_offset(offset)
-    vdebug(offset)
-    hexscript = romtext
-    i = rom_offset
-    textscript = ""
-    hex_command = ""
-    while hex_command not in end_hex_commands:
-        try:
-            hex_command = hexscript[i]
-        except IndexError:
-            break
-        textscript += "#raw " + hex(hex_command)
-        i += 1
-        textscript += "\n"
-    return textscript
+def decompile_rawh(romtext, offset, end_hex_commands=(0xFF,), raw=False):
+    return decompile_raw(romtext, offset, end_hex_commands)
+
+def decompile_rawb(romtext, offset, end_hex_commands=(0xFF,), raw=False):
+    return decompile_raw(romtext, offset, end_hex_commands)
+
+def decompile_movs(romtext, offset, end_hex_commands=(0xFE, 0xFF), raw=False,
+                   game=None):
+    ''' Decompile a movement. With a game, movements are written with
+        their stdlib names '''
+    if game is None or raw:
+        lines = RAW_LINES
+    else:
+        lines = movement_lines(game)
+    return decompile_raw(romtext, offset, end_hex_commands, lines)
 
 
 def decompile_text(romtext, offset, raw=False):
     rom_offset = get_rom_offset(offset)
     start = rom_offset
-    end = start + romtext[start:].find(b"\xff")
+    end = romtext.find(b"\xff", start)
+    if end == -1:
+        end = start - 1
     text = romtext[start:end]
-    text_table = text_translate.table_str
-    # decoding table
-    d_table = text_translate.read_table_decode(text_table)
-    translated_text = text_translate.hex_to_ascii(text, d_table)
+    translated_text = text_translate.hex_to_ascii(text)
     return translated_text
 
 
@@ -744,27 +1145,38 @@ def open_script(file_name):
     script_text = script_text.replace("\r\n", "\n")
     return script_text
 
-def assemble(script, rom_file_name, cmd_table=pk.pkcommands):
+def assemble(script, rom_file_name, cmd_table=None):
     ''' Compiles a plain script and returns a tuple containing
         a list and a string. The string is the #dyn log.
         The list contains a list for every location where
         something should be written. These lists are 2
         elements each, the offset where data should be
         written and the data itself '''
+    if not rom_file_name:
+        return assemble_rom(script, None, cmd_table)
+    from . import patch
+    with patch.map_rom(rom_file_name) as rom:
+        return assemble_rom(script, rom, cmd_table)
+
+def assemble_rom(script, rom, cmd_table=None):
+    ''' assemble, with the ROM already in memory (bytes, bytearray or
+        mmap), or None if we have no ROM '''
     debug("parsing...")
     parsed_script, dyn = asm_parse(script, cmd_table=cmd_table)
     vpdebug(parsed_script)
     debug("compiling...")
-    hex_script = make_bytecode(parsed_script, cmd_table=cmd_table)
+    relocations = [] if DEDUPE else None
+    hex_script = make_bytecode(parsed_script, cmd_table=cmd_table,
+                               relocations=relocations)
     debug(hex_script)
     log = ''
     debug("doing dynamic and label things...")
 
-    if dyn[0] and rom_file_name:
+    if dyn[0] and rom is not None:
         debug("going dynamic!")
         debug("replacing dyn addresses by offsets...")
-        script, log = put_addresses(hex_script, script,
-                                    rom_file_name, dyn[1])
+        script, log = place_dynamic(hex_script, script, rom, dyn[1],
+                                    relocations)
         vdebug(script)
 
     # Now with :labels we have to recompile even if
@@ -782,16 +1194,169 @@ def assemble(script, rom_file_name, cmd_table=pk.pkcommands):
     # Remove the labels list, which will be empty and useless now
     for chunk in hex_script:
         del chunk[2] # Will always be []
+    if DEDUPE:
+        hex_script = unique_chunks(hex_script)
     return hex_script, log
 
+def unique_chunks(hex_script):
+    ''' Without the chunks that are there twice (same offset and bytes),
+        like the ones that share a placement '''
+    seen = set()
+    unique = []
+    for addr, data in hex_script:
+        if (int(addr, 16), data) not in seen:
+            seen.add((int(addr, 16), data))
+            unique.append([addr, data])
+    return unique
+
+def assemble_object(script, cmd_table=None):
+    ''' Compile a plain script into a relocatable object (see link),
+        without placing anything, so no ROM is needed '''
+    parsed_script, dyn = asm_parse(script, cmd_table=cmd_table)
+    relocations = []
+    hex_script = make_bytecode(parsed_script, cmd_table, relocations)
+    from . import link
+    return link.make_object(hex_script, relocations, dyn)
+
+def assemble_patch(script, rom_file_name, fmt, cmd_table=None):
+    ''' Like assemble, but instead of the chunks returns a patch
+        (fmt is "ips", "ups" or "bps") with them, and the #dyn log.
+        The ROM is only read. '''
+    from . import patch
+    hex_script, log = assemble(script, rom_file_name, cmd_table=cmd_table)
+    if not rom_file_name:
+        return patch.make_patch(hex_script, fmt, None), log
+    with patch.map_rom(rom_file_name) as source:
+        return patch.make_patch(hex_script, fmt, source), log
+
+GAME_CODES = {
+    b"AXVE": "RS",
+    b"BPRE": "FR",
+    b"BPEE": "EM"}
+
 def get_base_directive(rom_fn):
     with open(rom_fn, "rb") as f:
         f.seek(0xAC)
         code = f.read(4)
-    return "#define " + {
-        b"AXVE": "RS",
-        b"BPRE": "FR",
-        b"BPEE": "EM"}[code] + "\n"
+    return "#define " + GAME_CODES[code] + "\n"
+
+def base_directive(rom):
+    ''' get_base_directive for a ROM in memory '''
+    return "#define " + GAME_CODES[bytes(rom[0xAC:0xB0])] + "\n"
+
+def compile_script(text_script, rom=None, include_path=None, cmd_table=None):
+    ''' The whole compiler, without touching the disk (unless the
+        include resolver does).
+        text_script is the script text, rom the ROM as bytes, bytearray
+        or mmap (or None, then #dyn can't be used), and include_path a
+        resolver function (name -> text, or None if not found) or a
+        list of directories; by default, only the stdlib is found.
+        Returns a tuple with the chunks (a list of [offset, bytes]), the
+        #dyn log and a list of diagnostics, (level, message) tuples.
+        If there are errors, there are no chunks. '''
+    if include_path is None:
+        include_path = path_resolver((data_path,))
+    diagnostics = []
+    text_script = text_script.replace("\r\n", "\n")
+    if rom is not None:
+        try:
+            text_script = base_directive(rom) + text_script
+        except KeyError:
+            diagnostics.append(("warning", "unknown game code, RS/FR/EM "
+                                "won't be #define'd"))
+    try:
+        text_script = dirty_compile(text_script, include_path)
+        hex_script, log = assemble_rom(text_script, rom, cmd_table)
+    except Exception as e:
+        diagnostics.append(("error", str(e)))
+        return [], '', diagnostics
+    if rom is None and any(chunk[0][0] == "@" for chunk in hex_script):
+        diagnostics.append(("warning", "#dyn needs a ROM, @labels were "
+                            "not placed"))
+    from . import overlap
+    diagnostics += overlap.check_build([c for c in hex_script
+                                        if c[0][0] != "@"], rom,
+                                       overlap.dynamic_offsets(log))
+    if any(level == "error" for level, _ in diagnostics):
+        return [], log, diagnostics
+    return hex_script, log, diagnostics
+
+def compile_targets(text_script, roms, include_paths, optimize=False,
+                    cmd_table=None):
+    ''' The part of compiling text_script that comes before assembling,
+        for every ROM in roms (file names), include_paths having the
+        include path of each one. Only the base directive changes from
+        one game to another, so comments are removed once, every
+        #include'd file is read once, the preprocessor runs once per
+        game and what comes after it once per different script.
+        Returns a (plain script, peephole report or '') tuple for every
+        ROM. '''
+    if cmd_table is None:
+        cmd_table = pk.pkcommands
+    text_script = strip_script(text_script.replace("\r\n", "\n"))
+    includes = {}
+    preprocessed = {}
+    compiled = {}
+    results = []
+    for rom, include_path in zip(roms, include_paths):
+        try:
+            directive = get_base_directive(rom)
+        except KeyError:
+            directive = ''
+        key = (directive, tuple(include_path))
+        if key not in preprocessed:
+            preprocessed[key] = preprocess(directive + text_script,
+                                           cached_resolver(include_path,
+                                                           includes))
+        text = preprocessed[key]
+        if text not in compiled:
+            script = compile_high_level(text)
+            report = ''
+            if optimize:
+                from . import peephole
+                script, saved = peephole.optimize(script, cmd_table)
+                report = peephole.report(saved)
+            compiled[text] = (script, report)
+        results.append(compiled[text])
+    return results
+
+def target_file(file_name, rom):
+    ''' file_name with the name of the ROM before the extension, so
+        every target gets its own (build.ips -> build.fire.ips) '''
+    if file_name is None:
+        return None
+    base, ext = os.path.splitext(file_name)
+    return base + "." + os.path.splitext(os.path.basename(rom))[0] + ext
+
+def set_build_options(quiet, verbose, align, margin, dedupe):
+    ''' Set what main sets from the arguments, for worker processes '''
+    global QUIET, VERBOSE, DYN_ALIGN, DYN_MARGIN, DEDUPE
+    QUIET = quiet
+    VERBOSE = verbose
+    DYN_ALIGN = align
+    DYN_MARGIN = margin
+    DEDUPE = dedupe
+
+def build_target(script, args, cmd_table=None):
+    ''' Assemble a plain script for args.rom and write it (see
+        write_build). Returns the #dyn log. '''
+    hex_script, log = assemble(script, args.rom, cmd_table=cmd_table)
+    write_build(hex_script, log, args)
+    return log
+
+def build_targets(scripts, targets, jobs=None, cmd_table=None):
+    ''' build_target for every script and target, with up to jobs
+        processes at once (by default, one per CPU). Returns the logs. '''
+    if jobs == 1 or len(targets) < 2:
+        return [build_target(script, target, cmd_table)
+                for script, target in zip(scripts, targets)]
+    from concurrent.futures import ProcessPoolExecutor
+    options = (QUIET, VERBOSE, DYN_ALIGN, DYN_MARGIN, DEDUPE)
+    with ProcessPoolExecutor(jobs, initializer=set_build_options,
+                             initargs=options) as pool:
+        futures = [pool.submit(build_target, script, target, cmd_table)
+                   for script, target in zip(scripts, targets)]
+        return [future.result() for future in futures]
 
 def nice_dbg_output(hex_scripts):
     text = ''
@@ -817,11 +1382,70 @@ def make_clean_script(hex_script):
     text = "// cleaning script"
     for addr, chunk in hex_script:
         text += "\n#org {}\n".format(addr)
-        for _ in range(len(chunk)):
-            text += "#raw 0xFF\n"
-        #text += "="+"\\xFF"*len(chunk)+"\n"
+        text += "#fill {} 0xFF\n".format(hex(len(chunk)))
     return text
 
+def write_placement_log(hex_script, file_name, append=False):
+    ''' Write where every chunk went, one "offset length" line each,
+        so the build can be undone later without recompiling. With
+        append, it's added to the file, to keep a history of builds. '''
+    with open(file_name, "a" if append else "w") as f:
+        f.write("// placement log: offset length\n")
+        for addr, chunk in hex_script:
+            f.write("{} {}\n".format(addr, hex(len(chunk))))
+
+def write_build(hex_script, log, args):
+    ''' The end of c and link: check the chunks against the ROM and the
+        --history, then write them to the ROM or a --patch '''
+    from . import patch, overlap
+    history = None
+    if args.history and os.path.isfile(args.history):
+        history = read_placement_log(args.history)
+    with patch.map_rom(args.rom) as rom:
+        diagnostics = overlap.check_build(hex_script, rom,
+                                          overlap.dynamic_offsets(log),
+                                          history)
+    for level, msg in diagnostics:
+        sys.stderr.write(level + ": " + msg + "\n")
+    if (any(level == "error" for level, _ in diagnostics) and
+            not args.force):
+        raise Exception("ERROR: not writing anything, the build "
+                        "overlaps itself (use --force to write "
+                        "anyway)")
+    if args.patch:
+        fmt = patch.get_format(args.patch)
+        with open(args.patch, "wb") as f, patch.map_rom(args.rom) as rom:
+            f.write(patch.make_patch(hex_script, fmt, rom))
+        if args.placements:
+            write_placement_log(hex_script, args.placements)
+    else:
+        write_hex_script(hex_script, args.rom, args.journal)
+        if args.placements:
+            write_placement_log(hex_script, args.placements)
+        if args.history:
+            write_placement_log(hex_script, args.history, append=True)
+
+def read_placement_log(file_name):
+    ''' Returns a list of (offset, length) '''
+    ranges = []
+    with open(file_name) as f:
+        for line in remove_comments(f.read()).split("\n"):
+            words = line.split()
+            if not words:
+                continue
+            if len(words) != 2:
+                raise Exception("ERROR: bad placement log line: " + line)
+            ranges.append((int(words[0], 16), int(words[1], 16)))
+    return ranges
+
+def erase_ranges(ranges, rom_file_name, byte=0xFF):
+    ''' Fill every (offset, length) range in the ROM with byte, writing
+        only the ranges, like write_hex_script '''
+    with open(rom_file_name, "r+b") as f:
+        for offset, length in ranges:
+            f.seek(get_rom_offset(offset))
+            f.write(bytes((byte,)) * length)
+
 def get_program_dir():
     try:
         return os.path.dirname(__file__)
@@ -829,6 +1453,11 @@ def get_program_dir():
         return os.path.dirname(sys.executable)
 
 def main():
+    import argparse
+    if getattr(sys, 'frozen', False):
+        # The worker processes of multi start here too
+        from multiprocessing import freeze_support
+        freeze_support()
     description = 'Red Alien, an Advanced (Pokémon) Script Compiler'
     parser = argparse.ArgumentParser(description=description)
 
@@ -843,8 +1472,115 @@ def main():
     parser_c.add_argument('script', help='path to pokemon script')
     parser_c.add_argument('--clean', action='store_true',
                           help='Produce a cleaning script')
+    parser_c.add_argument('--patch', metavar='FILE',
+                          help='Write an IPS, UPS or BPS patch (from the '
+                               'extension) instead of changing the ROM')
+    parser_c.add_argument('--journal', metavar='FILE',
+                          help='Append the bytes we overwrite to FILE, '
+                               'for revert')
+    parser_c.add_argument('--placements', metavar='LOG',
+                          help='Write where every chunk was put to LOG, '
+                               'for erase')
+    parser_c.add_argument('--history', metavar='LOG',
+                          help='Check the build against the placements of '
+                               'earlier builds in LOG, then add it there')
+    parser_c.add_argument('--force', action='store_true',
+                          help='Write even if chunks overlap')
+    parser_c.add_argument('--align', type=int,
+                          help='Put #dyn chunks at multiples of ALIGN '
+                               '(4 for data with pointers)')
+    parser_c.add_argument('--margin', type=int,
+                          help='Free bytes to leave before every #dyn chunk')
+    parser_c.add_argument('--dedupe', action='store_true',
+                          help='Put identical #dyn chunks that don\'t point '
+                               'anywhere (text, movements...) only once')
+    parser_c.add_argument('--optimize', action='store_true',
+                          help='Thread jumps, remove dead code and share '
+                               'common script ends (reports bytes saved)')
     parser_c.set_defaults(command='c')
 
+    parser_o = subparsers.add_parser('obj', help='compile to a relocatable '
+                                     'object, to link later')
+    parser_o.add_argument('rom', help='path to ROM image (only read, for '
+                          'the game and the includes)')
+    parser_o.add_argument('script', help='path to pokemon script')
+    parser_o.add_argument('-o', '--output', metavar='FILE',
+                          help='where to write the object, the script with '
+                               '.pko by default')
+    parser_o.add_argument('--optimize', action='store_true',
+                          help='Thread jumps, remove dead code and share '
+                               'common script ends (reports bytes saved)')
+    parser_o.set_defaults(command='obj')
+
+    parser_l = subparsers.add_parser('link', help='place objects in a ROM, '
+                                     'all at once')
+    parser_l.add_argument('rom', help='path to ROM image')
+    parser_l.add_argument('objects', nargs='+', metavar='OBJECT',
+                          help='objects made with obj')
+    parser_l.add_argument('--dyn', metavar='OFFSET',
+                          help='where free space starts, by default the '
+                               'first #dyn in the objects')
+    parser_l.add_argument('--patch', metavar='FILE',
+                          help='Write an IPS, UPS or BPS patch (from the '
+                               'extension) instead of changing the ROM')
+    parser_l.add_argument('--journal', metavar='FILE',
+                          help='Append the bytes we overwrite to FILE, '
+                               'for revert')
+    parser_l.add_argument('--placements', metavar='LOG',
+                          help='Write where every chunk was put to LOG, '
+                               'for erase')
+    parser_l.add_argument('--history', metavar='LOG',
+                          help='Check the build against the placements of '
+                               'earlier builds in LOG, then add it there')
+    parser_l.add_argument('--force', action='store_true',
+                          help='Write even if chunks overlap')
+    parser_l.add_argument('--align', type=int,
+                          help='Put #dyn chunks at multiples of ALIGN '
+                               '(4 for data with pointers)')
+    parser_l.add_argument('--margin', type=int,
+                          help='Free bytes to leave before every #dyn chunk')
+    parser_l.add_argument('--dedupe', action='store_true',
+                          help='Put identical #dyn chunks that don\'t point '
+                               'anywhere (text, movements...) only once')
+    parser_l.set_defaults(command='link')
+
+    parser_m = subparsers.add_parser('multi', help='compile a script for '
+                                     'several ROMs (RS, FR, EM...) at once')
+    parser_m.add_argument('script', help='path to pokemon script')
+    parser_m.add_argument('roms', nargs='+', metavar='ROM',
+                          help='paths to ROM images')
+    parser_m.add_argument('-j', '--jobs', type=int,
+                          help='How many ROMs to build at once, by default '
+                               'one per CPU')
+    parser_m.add_argument('--patch', metavar='FILE',
+                          help='Write IPS, UPS or BPS patches (from the '
+                               'extension) instead of changing the ROMs. '
+                               'The name of each ROM goes before the '
+                               'extension, like for the files below')
+    parser_m.add_argument('--journal', metavar='FILE',
+                          help='Append the bytes we overwrite to FILE, '
+                               'for revert')
+    parser_m.add_argument('--placements', metavar='LOG',
+                          help='Write where every chunk was put to LOG, '
+                               'for erase')
+    parser_m.add_argument('--history', metavar='LOG',
+                          help='Check the build against the placements of '
+                               'earlier builds in LOG, then add it there')
+    parser_m.add_argument('--force', action='store_true',
+                          help='Write even if chunks overlap')
+    parser_m.add_argument('--align', type=int,
+                          help='Put #dyn chunks at multiples of ALIGN '
+                               '(4 for data with pointers)')
+    parser_m.add_argument('--margin', type=int,
+                          help='Free bytes to leave before every #dyn chunk')
+    parser_m.add_argument('--dedupe', action='store_true',
+                          help='Put identical #dyn chunks that don\'t point '
+                               'anywhere (text, movements...) only once')
+    parser_m.add_argument('--optimize', action='store_true',
+                          help='Thread jumps, remove dead code and share '
+                               'common script ends (reports bytes saved)')
+    parser_m.set_defaults(command='multi')
+
     parser_b = subparsers.add_parser('b', help='debug')
     parser_b.add_argument('rom', help='path to ROM image')
     parser_b.add_argument('script', help='path to pokemon script')
@@ -854,6 +1590,17 @@ def main():
                           help='Parse only, don\'t assemble')
     parser_b.add_argument('--clean', action='store_true',
                           help='Produce a cleaning script')
+    parser_b.add_argument('--align', type=int,
+                          help='Put #dyn chunks at multiples of ALIGN '
+                               '(4 for data with pointers)')
+    parser_b.add_argument('--margin', type=int,
+                          help='Free bytes to leave before every #dyn chunk')
+    parser_b.add_argument('--dedupe', action='store_true',
+                          help='Put identical #dyn chunks that don\'t point '
+                               'anywhere (text, movements...) only once')
+    parser_b.add_argument('--optimize', action='store_true',
+                          help='Thread jumps, remove dead code and share '
+                               'common script ends (reports bytes saved)')
     parser_b.set_defaults(command='b')
 
     parser_d = subparsers.add_parser('d', help='decompile')
@@ -863,8 +1610,23 @@ def main():
                           help='Be dumb (display everything as raw bytes)')
     parser_d.add_argument('--text', action='store_true',
                           help='Decompile as text')
+    parser_d.add_argument('--no-symbols', action='store_true',
+                          help='Write every argument as a number, even if '
+                          'the stdlib has a name for it')
+    parser_d.add_argument('--json', action='store_true',
+                          help='Write one JSON record per #org block '
+                          '(offset, length, instructions and pointers) '
+                          'instead of a script')
     h = 'How many nop bytes until it stops (0 to never stop). Defaults to 10'
     parser_d.add_argument('--max-nops', default=10, type=int, help=h)
+    parser_d.add_argument('-o', '--output',
+                          help='write to this file instead of stdout')
+    parser_d.add_argument('--max-bytes', default=0, type=int,
+                          help='stop after decoding this many bytes')
+    parser_d.add_argument('--max-instructions', default=0, type=int,
+                          help='stop after decoding this many instructions')
+    parser_d.add_argument('--max-time', default=0, type=float,
+                          help='stop after this many seconds')
 
     for end_command in END_COMMANDS:
         msg = ('whether or not to stop decompiling when a ' + end_command +
@@ -877,23 +1639,348 @@ def main():
     parser_d.add_argument('--continue-on-0xFF', action='store_true', help=h)
     parser_d.set_defaults(command='d')
 
+    parser_a = subparsers.add_parser('apply', help='apply an IPS, UPS or '
+                                     'BPS patch')
+    parser_a.add_argument('rom', help='path to ROM image')
+    parser_a.add_argument('patch', help='path to patch')
+    parser_a.add_argument('-o', '--output', help='write the patched ROM here '
+                          'instead of changing it in place')
+    parser_a.set_defaults(command='apply')
+
+    parser_u = subparsers.add_parser('revert', help='undo builds made with '
+                                     'c --journal')
+    parser_u.add_argument('rom', help='path to ROM image')
+    parser_u.add_argument('journal', help='path to journal')
+    parser_u.add_argument('-n', '--count', default=1, type=int,
+                          help='how many builds to undo, defaults to 1')
+    parser_u.add_argument('--all', action='store_true',
+                          help='undo every build in the journal')
+    parser_u.add_argument('--force', action='store_true',
+                          help='revert even if the ROM changed since')
+    parser_u.add_argument('--verify', action='store_true',
+                          help='check the whole ROM hash before and after')
+    parser_u.set_defaults(command='revert')
+
+    parser_e = subparsers.add_parser('erase', help='erase what a previous '
+                                     'build wrote, without compiling')
+    parser_e.add_argument('rom', help='path to ROM image')
+    parser_e.add_argument('placements', help='placement log written by '
+                          'c --placements')
+    parser_e.add_argument('--byte', default="0xFF",
+                          help='fill byte, defaults to 0xFF')
+    parser_e.set_defaults(command='erase')
+
+    parser_r = subparsers.add_parser('reflow', help='wrap every = string '
+                                     'to fit in the text box')
+    parser_r.add_argument('file', help='pokemon script, or ROM image if an '
+                          'offset is given')
+    parser_r.add_argument('offset', nargs='?',
+                          help='decompile from here and reflow the result')
+    parser_r.add_argument('--check', action='store_true',
+                          help='only report the lines that overflow')
+    parser_r.add_argument('--join-lines', action='store_true',
+                          help='rewrap across the \\n and \\l already in '
+                          'the strings too, instead of keeping them')
+    parser_r.add_argument('-o', '--output', help='write the script here '
+                          'instead of stdout')
+    parser_r.set_defaults(command='reflow')
+
+    parser_s = subparsers.add_parser('strings', help='find every string in '
+                                     'a ROM')
+    parser_s.add_argument('rom', help='path to ROM image')
+    parser_s.add_argument('--min-length', type=int,
+                          help='shortest string to report, in characters. '
+                          'Defaults to 4')
+    parser_s.add_argument('--start', default="0",
+                          help='where to start looking')
+    parser_s.add_argument('--end', help='where to stop looking')
+    parser_s.add_argument('--json', action='store_true',
+                          help='write one JSON record per string')
+    parser_s.add_argument('-o', '--output', help='write the strings here '
+                          'instead of stdout')
+    parser_s.set_defaults(command='strings')
+
+    parser_f = subparsers.add_parser('search', help='find text in a ROM, '
+                                     'and the pointers to it')
+    parser_f.add_argument('rom', help='path to ROM image')
+    parser_f.add_argument('queries', nargs='*', help='text to look for, as '
+                          'written in scripts. \\? matches any character '
+                          'and \\* any run of them')
+    parser_f.add_argument('-f', '--file', help='read more queries from this '
+                          'file, one per line')
+    parser_f.add_argument('--start', default="0",
+                          help='where to start looking')
+    parser_f.add_argument('--end', help='where to stop looking')
+    parser_f.add_argument('--no-references', action='store_true',
+                          help="don't look for pointers to what's found")
+    parser_f.add_argument('--json', action='store_true',
+                          help='write one JSON record per hit')
+    parser_f.set_defaults(command='search')
+
+    parser_p = subparsers.add_parser('repoint', help='make every pointer to '
+                                     'an old address point to a new one')
+    parser_p.add_argument('rom', help='path to ROM image')
+    parser_p.add_argument('moves', nargs='*', metavar='OLD:NEW',
+                          help='what moved where')
+    parser_p.add_argument('--map', help='read more moves from this file, '
+                          'one "OLD NEW" per line')
+    parser_p.add_argument('--script', action='append', default=[],
+                          metavar='OFFSET', help='also fix the pointers in '
+                          'the scripts reachable from here (can be repeated)')
+    parser_p.add_argument('--unaligned', action='store_true',
+                          help='also take pointers that aren\'t 4-byte '
+                          'aligned from the ROM scan')
+    parser_p.add_argument('--dry-run', action='store_true',
+                          help='only list what would change')
+    parser_p.add_argument('--patch', help='write an IPS, UPS or BPS patch '
+                          'instead of changing the ROM')
+    parser_p.add_argument('--journal', help='record the overwritten bytes '
+                          'here, so asc-cli revert can undo it')
+    parser_p.set_defaults(command='repoint')
+
+    parser_i = subparsers.add_parser('usage', help='which scripts use a '
+                                     'flag or var, and which ones are free')
+    parser_i.add_argument('rom', help='path to ROM image')
+    parser_i.add_argument('--script', action='append', default=[],
+                          metavar='OFFSET', help='index the scripts '
+                          'reachable from here (can be repeated)')
+    parser_i.add_argument('--scripts', metavar='FILE', help='read more '
+                          'script offsets from this file, one per line')
+    parser_i.add_argument('--index', metavar='FILE', help='where the index '
+                          'is kept, the ROM with .usage by default. It\'s '
+                          'made again when the ROM or the scripts change')
+    parser_i.add_argument('--rebuild', action='store_true',
+                          help='make the index again anyway')
+    parser_i.add_argument('--flag', action='append', default=[],
+                          help='list the scripts that use this flag (can '
+                          'be repeated)')
+    parser_i.add_argument('--var', action='append', default=[],
+                          help='list the scripts that use this var (can be '
+                          'repeated)')
+    parser_i.add_argument('--reads', action='store_true',
+                          help='only list the scripts that read them')
+    parser_i.add_argument('--writes', action='store_true',
+                          help='only list the scripts that write them')
+    parser_i.add_argument('--free-flags', metavar='LOW:HIGH',
+                          help='list the flags no script uses in the range')
+    parser_i.add_argument('--free-vars', metavar='LOW:HIGH',
+                          help='list the vars no script uses in the range')
+    parser_i.add_argument('--json', action='store_true',
+                          help='write one JSON record per line')
+    parser_i.set_defaults(command='usage')
+
     args = parser.parse_args()
+    # Only the table we use gets loaded
     modes = {
-            "event": (pk.pkcommands, pk.dec_pkcommands, pk.end_pkcommands),
+            "event": lambda: (pk.pkcommands, pk.dec_pkcommands,
+                              pk.end_pkcommands),
             #"battle": ,
-            "battle_ai": (pk.aicommands, pk.dec_aicommands, pk.end_aicommands),
+            "battle_ai": lambda: (pk.aicommands, pk.dec_aicommands,
+                                  pk.end_aicommands),
             }
     if "command" not in args or args.mode not in modes:
         parser.print_help()
         sys.exit(1)
-    cmd_table, dec_table, end_cmds = modes[args.mode]
+    cmd_table, dec_table, end_cmds = modes[args.mode]()
 
-    global QUIET, MAX_NOPS, VERBOSE
+    global QUIET, MAX_NOPS, VERBOSE, DYN_ALIGN, DYN_MARGIN, DEDUPE
     QUIET = args.quiet
     VERBOSE = args.verbose
-    MAX_NOPS = (args.MAX_NOPS if MAX_NOPS in args else 10)
+    MAX_NOPS = getattr(args, "max_nops", 10)
+    DYN_ALIGN = getattr(args, "align", None)
+    DYN_MARGIN = getattr(args, "margin", None)
+    DEDUPE = getattr(args, "dedupe", False)
+
+    if args.command == "apply":
+        from . import patch
+        patch.apply_patch(args.patch, args.rom, args.output)
+
+    elif args.command == "revert":
+        from . import journal
+        n = journal.revert(args.rom, args.journal,
+                           None if args.all else args.count,
+                           force=args.force, verify=args.verify)
+        debug("reverted {} builds".format(n))
+
+    elif args.command == "erase":
+        ranges = read_placement_log(args.placements)
+        erase_ranges(ranges, args.rom, int(args.byte, 16))
+        debug("erased {} ranges".format(len(ranges)))
+
+    elif args.command == "reflow":
+        if args.offset:
+            QUIET = True
+            script = decompile(args.file, int(args.offset, 16),
+                               cmd_table=cmd_table, dec_table=dec_table,
+                               end_commands=end_cmds)
+        else:
+            script = open_script(args.file)
+        script, report = textlayout.reflow_script(
+            script, check=args.check, keep_breaks=not args.join_lines)
+        for line_n, width, line in report:
+            sys.stderr.write("line {}: {}/{} px: {}\n".format(
+                line_n, width, textlayout.MAX_WIDTH, line))
+        if args.check:
+            sys.exit(1 if report else 0)
+        if args.output:
+            write_text_script(script, args.output)
+        else:
+            print(script)
+
+    elif args.command == "strings":
+        from . import patch, romtext
+        with patch.map_rom(args.rom) as rom:
+            strings = romtext.extract_strings(
+                rom, args.min_length or romtext.MIN_LENGTH, get_rom_offset(int(args.start, 16)),
+                get_rom_offset(int(args.end, 16)) if args.end else None)
+        f = open(args.output, "w", encoding="utf8") if args.output else sys.stdout
+        if args.json:
+            import json
+            for offset, text in strings:
+                f.write(json.dumps({"offset": offset, "text": text}) + "\n")
+        else:
+            romtext.write_strings(strings, f)
+        if args.output:
+            f.close()
+
+    elif args.command == "search":
+        from . import patch, romtext
+        queries = list(args.queries)
+        if args.file:
+            with open(args.file, encoding="utf8") as f:
+                queries += [l for l in f.read().split("\n") if l]
+        if not queries:
+            raise Exception("ERROR: nothing to search for")
+        with patch.map_rom(args.rom) as rom:
+            hits = romtext.search(rom, queries, not args.no_references,
+                                  get_rom_offset(int(args.start, 16)),
+                                  get_rom_offset(int(args.end, 16))
+                                  if args.end else None)
+        if args.json:
+            import json
+            for offset, query, refs in hits:
+                print(json.dumps({"offset": offset, "query": query,
+                                  "references": refs}))
+        else:
+            romtext.write_hits(hits, sys.stdout)
+
+    elif args.command == "repoint":
+        from . import patch, repoint
+        mapping = repoint.parse_mapping(args.moves)
+        if args.map:
+            mapping.update(repoint.read_mapping(args.map))
+        if not mapping:
+            raise Exception("ERROR: nothing to repoint")
+        with patch.map_rom(args.rom) as rom:
+            refs = repoint.find_references(
+                rom, mapping,
+                script_pointers(rom, [int(o, 16) for o in args.script]),
+                aligned=not args.unaligned)
+            repoint.write_listing(refs, mapping, sys.stdout)
+            chunks = repoint.repoint_chunks(refs, mapping)
+            if chunks and not args.dry_run and args.patch:
+                with open(args.patch, "wb") as f:
+                    f.write(patch.make_patch(
+                        chunks, patch.get_format(args.patch), rom))
+        if chunks and not args.dry_run and not args.patch:
+            write_hex_script(chunks, args.rom, args.journal)
+
+    elif args.command == "usage":
+        from . import patch, usage
+        roots = [get_rom_offset(int(o, 16)) for o in args.script]
+        if args.scripts:
+            with open(args.scripts) as f:
+                roots += [get_rom_offset(int(line.split()[0], 16))
+                          for line in remove_comments(f.read()).split("\n")
+                          if line.strip()]
+        index_fn = args.index or args.rom + ".usage"
+        index = None
+        stat = usage.rom_stat(args.rom)
+        with patch.map_rom(args.rom) as rom:
+            if os.path.isfile(index_fn):
+                index = usage.read_index(index_fn)
+                roots = roots or index["roots"]
+                old_stat = index.get("stat")
+                if args.rebuild or not usage.is_current(index, rom, roots,
+                                                        stat):
+                    index = None
+                elif index["stat"] != old_stat:
+                    usage.write_index(index, index_fn)
+            if index is None:
+                if not roots:
+                    raise Exception("ERROR: there is no index yet, say "
+                                    "where the scripts are with --script")
+                records = decompile_records(rom, roots, cmd_table=cmd_table,
+                                            dec_table=dec_table,
+                                            end_commands=end_cmds,
+                                            symbolize=False)
+                index = usage.build_index(records, roots, rom, cmd_table,
+                                          stat)
+                usage.write_index(index, index_fn)
+                debug("indexed {} scripts".format(index["scripts"]))
+        access = "read" if args.reads else "write" if args.writes else None
+        if args.json:
+            import json
+        for kind, values in (("flag", args.flag), ("var", args.var)):
+            for value in values:
+                value = int(value, 16)
+                found = usage.users(index, kind, value, access)
+                if not args.json:
+                    usage.write_users(kind, value, found, sys.stdout)
+                    continue
+                for script, a in found:
+                    print(json.dumps({"kind": kind, "value": value,
+                                      "access": a, "script": script}))
+        for kind, text in (("flag", args.free_flags),
+                           ("var", args.free_vars)):
+            if not text:
+                continue
+            runs = usage.free(index, kind, *usage.parse_range(text))
+            if not args.json:
+                usage.write_free(kind, runs, sys.stdout)
+                continue
+            for first, last in runs:
+                print(json.dumps({"kind": kind, "free": [first, last]}))
+        if not (args.flag or args.var or args.free_flags or args.free_vars):
+            debug("{} scripts use {} flags and {} vars".format(
+                index["scripts"], len(index["flag"]), len(index["var"])))
+
+    elif args.command == "link":
+        from . import patch, link
+        objects = [link.read_object(fn) for fn in args.objects]
+        with patch.map_rom(args.rom) as rom:
+            hex_script, log = link.link(objects, rom, args.dyn,
+                                        *dyn_options(), dedupe=DEDUPE)
+        write_build(hex_script, log, args)
+        print("\nLog:")
+        print(log)
 
-    if args.command in ["b", "c"]:
+    elif args.command == "multi":
+        names = [os.path.splitext(os.path.basename(rom))[0]
+                 for rom in args.roms]
+        if len(set(names)) != len(names):
+            raise Exception("ERROR: the ROMs need different file names")
+        script = open_script(args.script)
+        include_paths = [(".", os.path.dirname(rom),
+                          os.path.dirname(args.script), get_program_dir(),
+                          data_path) for rom in args.roms]
+        compiled = compile_targets(script, args.roms, include_paths,
+                                   args.optimize, cmd_table)
+        targets = []
+        for rom in args.roms:
+            target = argparse.Namespace(**vars(args))
+            target.rom = rom
+            for option in ("patch", "journal", "placements", "history"):
+                setattr(target, option, target_file(getattr(args, option),
+                                                    rom))
+            targets.append(target)
+        logs = build_targets([script for script, _ in compiled], targets,
+                             args.jobs, cmd_table)
+        for rom, (_, optimized), log in zip(args.roms, compiled, logs):
+            print("\nLog for " + rom + ":")
+            print(optimized + log)
+
+    elif args.command in ["b", "c", "obj"]:
         debug("reading file...", args.script)
         script = open_script(args.script)
         vdebug(script)
@@ -905,13 +1992,28 @@ def main():
         include_path = (".", os.path.dirname(args.rom),
                         os.path.dirname(args.script), get_program_dir(),
                         data_path)
-        script = dirty_compile(script, include_path)
+        script = dirty_compile(script, include_path,
+                               check_labels=args.command != "obj")
+        optimized = ''
+        if args.optimize:
+            from . import peephole
+            script, saved = peephole.optimize(script, cmd_table)
+            optimized = peephole.report(saved)
         vdebug(script)
         if args.command == "b" and args.compile_only:
             print(script)
             return
+        elif args.command == "obj":
+            from . import link
+            obj = assemble_object(script, cmd_table=cmd_table)
+            output = args.output or os.path.splitext(args.script)[0] + ".pko"
+            with open(output, "w") as f:
+                link.write_object(obj, f)
+            print(optimized, end="")
+            return
         elif args.command == "b" and args.parse_only:
             parsed_script, dyn = asm_parse(script, cmd_table=cmd_table)
+            from pprint import pprint
             pprint(parsed_script)
             print(dyn)
             return
@@ -921,31 +2023,60 @@ def main():
                 f.write(make_clean_script(hex_script))
 
         if args.command == "c":
-            write_hex_script(hex_script, args.rom)
+            write_build(hex_script, log, args)
         else:
             debug("\nHex:")
             for addr, chunk in hex_script:
                 debug(addr)
                 phdebug(chunk)
         print("\nLog:")
-        print(log)
+        print(optimized + log)
 
     elif args.command == "d":
         if not args.END_COMMANDS_to_delete:
             args.END_COMMANDS_to_delete = []
         for end_command in args.END_COMMANDS_to_delete:
             END_COMMANDS.remove(end_command)
-        print("'" + '-'*20)
         end_hex_commands = [] if args.continue_on_0xFF else END_HEX_COMMANDS
         type_ = "text" if args.text else "script"
-        print(end_cmds)
-        print(decompile(args.rom, int(args.offset, 16), type_, raw=args.raw,
-                        end_hex_commands=end_hex_commands,
-                        cmd_table=cmd_table,
-                        dec_table=dec_table,
-                        end_commands=end_cmds,
-                        verbose=args.verbose if args.verbose is not None else 0))
-
+        budgets = {"max_bytes": args.max_bytes,
+                   "max_instructions": args.max_instructions,
+                   "max_time": args.max_time,
+                   "symbolize": not args.no_symbols}
+        if args.json:
+            import json
+            blocks = (json.dumps(record) + "\n" for record in
+                      iter_decompile_records(args.rom, int(args.offset, 16),
+                                             type_, raw=args.raw,
+                                             end_commands=end_cmds,
+                                             end_hex_commands=end_hex_commands,
+                                             cmd_table=cmd_table,
+                                             dec_table=dec_table,
+                                             **budgets))
+        else:
+            blocks = iter_decompile(args.rom, int(args.offset, 16), type_,
+                                    raw=args.raw,
+                                    end_hex_commands=end_hex_commands,
+                                    cmd_table=cmd_table,
+                                    dec_table=dec_table,
+                                    end_commands=end_cmds,
+                                    verbose=(args.verbose
+                                             if args.verbose is not None
+                                             else 0),
+                                    **budgets)
+        if args.output:
+            with open(args.output, "w") as f:
+                for block in blocks:
+                    f.write(block)
+            return
+        if not args.json:
+            print("'" + '-'*20)
+            print(end_cmds)
+        for block in blocks:
+            sys.stdout.write(block)
+            sys.stdout.flush()
+        if not args.json:
+            print()
 
 if __name__ == "__main__":
     main()
@@ -6,10 +6,120 @@ import sys
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5 import Qsci
 import argparse
-import pkgutil
 import os
+import io
 from .qtgui import Ui_MainWindow
 from . import asc
+from .lexer import PKSLexer
+from . import completion
+from . import textlayout
+from . import romtext
+from . import patch
+
+class Cancelled(Exception):
+    pass
+
+class PipelineThread(QtCore.QThread):
+    ''' Runs a compile/decompile job away from the UI thread.
+        The job gets a stage(msg) callback, which reports progress and
+        raises Cancelled if the user asked to stop, and an output(text)
+        callback to send partial results. Signals are delivered
+        to the UI thread by Qt. '''
+    stage = QtCore.pyqtSignal(str)
+    partial = QtCore.pyqtSignal(str)
+    result = QtCore.pyqtSignal(object)
+    error = QtCore.pyqtSignal(str)
+    cancelled = QtCore.pyqtSignal()
+
+    def __init__(self, job, parent=None):
+        QtCore.QThread.__init__(self, parent)
+        self.job = job
+        self._cancel = False
+
+    def cancel(self):
+        self._cancel = True
+
+    def check(self, msg):
+        if self._cancel:
+            raise Cancelled()
+        self.stage.emit(msg)
+
+    def run(self):
+        try:
+            r = self.job(self.check, self.partial.emit)
+        except Cancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.error.emit(str(e))
+        else:
+            self.result.emit(r)
+
+def compile_job(script, rom_file_name, include_path, mode, stage):
+    ''' The whole compile pipeline, run in a PipelineThread '''
+    stage("preprocessing...")
+    script = asc.dirty_compile(script, include_path)
+    stage("parsing...")
+    parsed_script, dyn = asc.asm_parse(script)
+    stage("assembling...")
+    hex_script = asc.make_bytecode(parsed_script)
+    log = ''
+    if dyn[0]: # If there are dynamic addresses, we have to replace
+               # them with real adresses and recompile
+        stage("searching free space...")
+        script, log = asc.put_addresses(hex_script, script,
+                                        rom_file_name, dyn[1])
+    script = asc.put_addresses_labels(hex_script, script)
+    stage("reassembling...")
+    parsed_script, dyn = asc.asm_parse(script)
+    hex_script = asc.make_bytecode(parsed_script)
+
+    for chunk in hex_script:
+        del chunk[2] # Will always be []
+
+    stage("checking...")
+    from . import overlap
+    with patch.map_rom(rom_file_name) as rom:
+        errors = [msg for level, msg in
+                  overlap.check_build(hex_script, rom,
+                                      overlap.dynamic_offsets(log))
+                  if level == "error"]
+    if errors and mode == "compile":
+        raise Exception("Not writing anything:\n" + "\n".join(errors))
+    if errors:
+        log += "\n".join(errors) + "\n"
+
+    if mode == "compile":
+        # Last chance to stop, we don't want to leave a half-written ROM
+        stage("writing ROM...")
+        asc.write_hex_script(hex_script, rom_file_name)
+    return mode, hex_script, log
+
+# How much decompiled text we gather before handing it to the editor
+DECOMPILE_CHUNK_SIZE = 32 * 1024
+
+def decompile_job(rom_file_name, offset, stage, output):
+    ''' Decompile, sending the text to the UI in chunks as the
+        scripts are found '''
+    stage("decompiling...")
+    buf = []
+    size = 0
+    n = 0
+    for block in asc.iter_decompile(rom_file_name, offset):
+        buf.append(block)
+        size += len(block)
+        n += 1
+        if size >= DECOMPILE_CHUNK_SIZE:
+            output("".join(buf))
+            buf = []
+            size = 0
+            stage("decompiling... ({} blocks)".format(n))
+    output("".join(buf))
+    return n
+
+def search_job(rom_file_name, queries, stage):
+    stage("searching...")
+    with patch.map_rom(rom_file_name) as rom:
+        return romtext.search(rom, queries)
 
 class Window(QtWidgets.QMainWindow):
     def __init__(self, parent=None):
@@ -17,20 +127,6 @@ class Window(QtWidgets.QMainWindow):
         self.ui = Ui_MainWindow()
         self.ui.setupUi(self)
 
-        if getattr(sys, 'frozen', False):
-            iconpath = os.path.join(
-                os.path.dirname(sys.executable),
-                "asc", "data", "icon.svg")
-            pixmap = QtGui.QPixmap(iconpath)
-        else:
-            icon = pkgutil.get_data('asc', os.path.join('data', 'icon.svg'))
-            pixmap = QtGui.QPixmap()
-            pixmap.loadFromData(icon)
-        icon = QtGui.QIcon()
-        icon.addPixmap(pixmap,
-                       QtGui.QIcon.Normal, QtGui.QIcon.Off)
-        self.setWindowIcon(icon)
-
         cons = ((self.ui.actionOpen, self.load_file),
                 (self.ui.actionNew, self.new_file),
                 (self.ui.actionSave, self.save_file),
@@ -48,6 +144,7 @@ class Window(QtWidgets.QMainWindow):
                 (self.ui.actionRedo, self.ui.textEdit.redo),
                 (self.ui.actionFind, self.find),
                 (self.ui.actionInsert_String, self.insert_string),
+                (self.ui.actionSearch_ROM, self.search_rom),
                 (self.ui.actionAbout, self.help_about))
         for action, function in cons:
             action.triggered.connect(function)
@@ -59,11 +156,124 @@ class Window(QtWidgets.QMainWindow):
         self.ui.textEdit.setMarginWidth(1, 30)
         self.font = QtGui.QFont("mono", 10)
         self.ui.textEdit.setFont(self.font)
-        lexer = Qsci.QsciLexerCPP()
+
+        # Background work
+        self.worker = None
+        self.pending_compile = None
+        self.cancel_button = QtWidgets.QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel_worker)
+        self.cancel_button.hide()
+        self.ui.statusbar.addPermanentWidget(self.cancel_button)
+
+        self.index_worker = None
+
+    def late_init(self):
+        ''' The slow parts of starting up, done once the window is
+            already on screen '''
+        if getattr(sys, 'frozen', False):
+            iconpath = os.path.join(
+                os.path.dirname(sys.executable),
+                "asc", "data", "icon.svg")
+        else:
+            iconpath = os.path.join(asc.data_path, "icon.svg")
+        icon = QtGui.QIcon()
+        icon.addPixmap(QtGui.QPixmap(iconpath),
+                       QtGui.QIcon.Normal, QtGui.QIcon.Off)
+        self.setWindowIcon(icon)
+
+        lexer = PKSLexer(self.ui.textEdit)
         lexer.setDefaultFont(self.font)
         self.ui.textEdit.setLexer(lexer)
-
-        self.ui.textEdit.setText(asc.get_canvas())
+        # Decompiles can be huge: only style and lay out what is on screen
+        self.ui.textEdit.SendScintilla(
+            self.ui.textEdit.SCI_SETIDLESTYLING,
+            self.ui.textEdit.SC_IDLESTYLING_NONE)
+        self.ui.textEdit.SendScintilla(
+            self.ui.textEdit.SCI_SETLAYOUTCACHE,
+            self.ui.textEdit.SC_CACHE_PAGE)
+
+        if not self.ui.textEdit.text():
+            self.ui.textEdit.setText(asc.get_canvas())
+
+        # Autocompletion and call tips, the index is built in the background
+        self.apis = Qsci.QsciAPIs(lexer)
+        self.calltips = {}
+        self.ui.textEdit.setAutoCompletionSource(Qsci.QsciScintilla.AcsAPIs)
+        self.ui.textEdit.setAutoCompletionThreshold(3)
+        self.ui.textEdit.SCN_CHARADDED.connect(self.char_added)
+        cache_dir = QtCore.QStandardPaths.writableLocation(
+            QtCore.QStandardPaths.CacheLocation)
+        self.index_worker = PipelineThread(
+            lambda stage, _: completion.build_index(asc.data_path, cache_dir),
+            self)
+        self.index_worker.result.connect(self.index_ready)
+        self.index_worker.start()
+
+    def index_ready(self, result):
+        path, entries, calltips = result
+        self.calltips = calltips
+        if entries is None:
+            self.apis.loadPrepared(path)
+            return
+        for entry in entries:
+            self.apis.add(entry)
+        # prepare() does its work in its own thread
+        self.apis.apiPreparationFinished.connect(
+            lambda: self.apis.savePrepared(path))
+        self.apis.prepare()
+
+    def char_added(self, char):
+        # Commands don't use parentheses, so show the call tip after
+        # the space that follows the command name
+        if char != ord(" "):
+            return
+        editor = self.ui.textEdit
+        line, index = editor.getCursorPosition()
+        words = editor.text(line)[:index].split()
+        if len(words) == 1 and words[0] in self.calltips:
+            pos = editor.SendScintilla(editor.SCI_GETCURRENTPOS)
+            editor.SendScintilla(editor.SCI_CALLTIPSHOW, pos,
+                                 self.calltips[words[0]].encode())
+
+    def busy(self):
+        return self.worker is not None
+
+    def start_worker(self, job, on_result, on_partial=None, on_finished=None):
+        self.worker = PipelineThread(job, self)
+        self.worker.stage.connect(self.ui.statusbar.showMessage)
+        if on_partial:
+            self.worker.partial.connect(on_partial)
+        if on_finished:
+            self.worker.finished.connect(on_finished)
+        self.worker.result.connect(on_result)
+        self.worker.error.connect(self.error_message)
+        self.worker.cancelled.connect(
+            lambda: self.ui.statusbar.showMessage("cancelled"))
+        self.worker.finished.connect(self.worker_finished)
+        self.cancel_button.show()
+        self.worker.start()
+
+    def worker_finished(self):
+        self.worker.deleteLater()
+        self.worker = None
+        self.cancel_button.hide()
+        if self.pending_compile:
+            mode = self.pending_compile
+            self.pending_compile = None
+            self.compile(mode)
+
+    def cancel_worker(self):
+        self.pending_compile = None
+        if self.worker:
+            self.worker.cancel()
+
+    def closeEvent(self, event):
+        if self.index_worker:
+            self.index_worker.wait()
+        if self.worker:
+            self.cancel_worker()
+            self.worker.wait()
+        event.accept()
 
     def load_file(self):
         reply = QtWidgets.QMessageBox.question(self, 'Are you sure?',
@@ -159,7 +369,32 @@ class Window(QtWidgets.QMainWindow):
                 except ValueError:
                     QtWidgets.QMessageBox.critical(self, "Error", "Invalid offset")
                     return
-        self.ui.textEdit.setText(asc.decompile(self.rom_file_name, offset))
+        if self.busy():
+            self.error_message("Wait for the current job to finish")
+            return
+        rom_file_name = self.rom_file_name
+        # The new text replaces the document, so there's nothing to undo,
+        # and recording every streamed chunk would only waste memory
+        editor = self.ui.textEdit
+        editor.clear()
+        editor.SendScintilla(editor.SCI_SETUNDOCOLLECTION, 0)
+        self.start_worker(lambda stage, output:
+                          decompile_job(rom_file_name, offset, stage, output),
+                          self.decompile_done, self.decompile_chunk,
+                          self.decompile_finished)
+
+    def decompile_chunk(self, text):
+        # append() goes through SCI_APPENDTEXT: no document reset, and
+        # the lexer only styles what becomes visible
+        self.ui.textEdit.append(text)
+
+    def decompile_done(self, n):
+        self.ui.statusbar.showMessage("decompiled {} blocks".format(n))
+
+    def decompile_finished(self):
+        editor = self.ui.textEdit
+        editor.SendScintilla(editor.SCI_SETUNDOCOLLECTION, 1)
+        editor.SendScintilla(editor.SCI_EMPTYUNDOBUFFER)
 
     def error_message(self, msg):
         QtWidgets.QMessageBox.critical(self, "Error", msg)
@@ -169,38 +404,27 @@ class Window(QtWidgets.QMainWindow):
         if not self.rom_file_name:
             QtWidgets.QMessageBox.critical(self, "Error", "No ROM loaded")
             return
-        #with open(self.rom_file_name, 'rb') as f:
-        #    self.rom_contents = f.read()
+        if self.busy():
+            # Only the latest editor contents get compiled, once the
+            # running job is done
+            self.pending_compile = mode
+            self.ui.statusbar.showMessage("compile queued")
+            return
         script = str(self.ui.textEdit.text())
         script = script.replace("\r\n", "\n")
+        rom_file_name = self.rom_file_name
         include_path = (".", os.path.dirname(self.rom_file_name),
                         os.path.dirname(self.file_name), asc.get_program_dir(),
                         asc.data_path)
-        try:
-            script = asc.dirty_compile(script, include_path)
-            parsed_script, dyn = asc.asm_parse(script)
-            hex_script = asc.make_bytecode(parsed_script)
-        except Exception as e:
-            self.error_message(str(e))
-            return
-        log = ''
-        if dyn[0]: # If there are dynamic addresses, we have to replace
-                   # them with real adresses and recompile
-            script, log = asc.put_addresses(hex_script, script,
-                                            self.rom_file_name, dyn[1])
-        script = asc.put_addresses_labels(hex_script, script)
-        try:
-            parsed_script, dyn = asc.asm_parse(script)
-            hex_script = asc.make_bytecode(parsed_script)
-        except Exception as e:
-            self.error_message(str(e))
-            return
-
-        for chunk in hex_script:
-            del chunk[2] # Will always be []
-
+        self.start_worker(lambda stage, _: compile_job(script, rom_file_name,
+                                                       include_path, mode,
+                                                       stage),
+                          self.compile_done)
+
+    def compile_done(self, result):
+        mode, hex_script, log = result
+        self.ui.statusbar.showMessage("done")
         if mode == "compile":
-            asc.write_hex_script(hex_script, self.rom_file_name)
             QtWidgets.QMessageBox.information(self, "Done!",
                                               "Script compiled and written "
                                               "successfully")
@@ -251,13 +475,44 @@ class Window(QtWidgets.QMainWindow):
     def insert_string(self):
         popup = InsertTextBoxPopup(self)
         popup.exec_()
+        if not popup.text:
+            return
         line, _ = self.ui.textEdit.getCursorPosition()
-        text = self.ui.textEdit.text()
-        i = asc.find_nth(text, "\n", line)
         to_insert = "".join(["= " + l + "\n" for l in popup.text.split("\n")])
-        self.ui.textEdit.setText(text[:i] + to_insert + text[i:])
+        # Positional insert, so we keep the undo history and don't
+        # relex the whole document
+        self.ui.textEdit.insertAt(to_insert, line, 0)
         print(popup.text)
 
+    def search_rom(self):
+        if not self.rom_file_name:
+            QtWidgets.QMessageBox.critical(self, "Error", "No ROM loaded")
+            return
+        text, ok = QtWidgets.QInputDialog.getMultiLineText(
+            self, 'Search Text', 'Text to find, one per line '
+            '(\\? matches any character, \\* any run of them):')
+        queries = [l for l in text.split("\n") if l]
+        if not ok or not queries:
+            return
+        if self.busy():
+            self.error_message("Wait for the current job to finish")
+            return
+        rom_file_name = self.rom_file_name
+        self.start_worker(lambda stage, _: search_job(rom_file_name, queries,
+                                                      stage),
+                          self.search_done)
+
+    def search_done(self, hits):
+        self.ui.statusbar.showMessage("{} hits".format(len(hits)))
+        if not hits:
+            QtWidgets.QMessageBox.information(self, "Search Text",
+                                              "Text not found")
+            return
+        out = io.StringIO()
+        out.write("offset\ttext\tpointers\n")
+        romtext.write_hits(hits, out)
+        LogPopup(self, out.getvalue())
+
 class LogPopup(QtWidgets.QDialog):
     def __init__(self, parent=None, text=""):
         QtWidgets.QDialog.__init__(self, parent)
@@ -305,9 +560,10 @@ class InsertTextBoxPopup(QtWidgets.QDialog):
         self.text = ""
 
     def curPosChanged(self, l, _):
-        text = self.textedit.text()
-        line = text.split("\n")[l]
-        out = str(asc.text_len(line)) + "/" + str(35*6) + " px"
+        # Only the line the cursor is on gets measured
+        line = self.textedit.text(l).rstrip("\r\n")
+        out = (str(textlayout.text_len(line)) + "/" +
+               str(textlayout.MAX_WIDTH) + " px")
         self.label.setText(out)
         return
 
@@ -322,18 +578,31 @@ def main():
     parser = argparse.ArgumentParser(description='Red Alien, the Advanced Pokémon Script Compiler')
     parser.add_argument('file', nargs='?', help="Either a script or a ROM")
     parser.add_argument('offset', nargs='?', help="Needed if the file is a ROM image")
+    # Used by utils/startup_bench.py
+    parser.add_argument('--startup-bench', action='store_true',
+                        help=argparse.SUPPRESS)
     args = parser.parse_args()
     app = QtWidgets.QApplication(sys.argv)
     win = Window()
     win.show()
-    if args.file and not args.offset: # opening a script
-        win.file_name = args.file
-        with open(args.file, 'r') as f:
-            text = f.read()
-        win.ui.textEdit.setText(text)
-    elif args.offset:
-        win.rom_file_name = args.file
-        win.decompile(int(args.offset, 16))
+
+    def startup():
+        # We get here once the event loop has shown the window
+        if args.startup_bench:
+            print("first paint", flush=True)
+        if args.file and not args.offset: # opening a script
+            win.file_name = args.file
+            with open(args.file, 'r') as f:
+                text = f.read()
+            win.ui.textEdit.setText(text)
+        win.late_init()
+        if args.offset:
+            win.rom_file_name = args.file
+            win.decompile(int(args.offset, 16))
+        if args.startup_bench:
+            print("ready", flush=True)
+            win.close()
+    QtCore.QTimer.singleShot(0, startup)
     sys.exit(app.exec_())
 
 if __name__ == "__main__":
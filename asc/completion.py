@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Red Alien.
+
+#    Red Alien is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    Red Alien is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with Red Alien.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Autocompletion and call tip index for the editor.
+    Built from the command table and the stdlib #define's, and cached
+    as a prepared QsciAPIs file keyed by the hash of the data files. '''
+
+import os
+import hashlib
+from . import pokecommands as pk
+from .preprocessor import get_defines
+
+# Bump when the format of the entries changes
+INDEX_VERSION = 1
+# Some headers (movements) depend on the game
+GAMES = ("RS", "FR", "EM")
+
+def stdlib_files(data_path):
+    stdlib = os.path.join(data_path, "stdlib")
+    return sorted(fn for fn in os.listdir(stdlib) if fn.endswith(".rbh"))
+
+def data_key(data_path):
+    ''' Hash of everything the index is built from '''
+    h = hashlib.sha1(str(INDEX_VERSION).encode())
+    paths = ([os.path.join(data_path, "commands.txt")] +
+             [os.path.join(data_path, "stdlib", fn)
+              for fn in stdlib_files(data_path)])
+    for path in paths:
+        h.update(os.path.basename(path).encode())
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def command_signature(name, data):
+    ''' "checkflag flag[2]" - argument descriptions with their
+        widths in bytes '''
+    if "args" not in data:
+        return name
+    desc, widths = data["args"][:2]
+    names = [d.strip() for d in desc.split(",")]
+    if len(names) == len(widths):
+        args = ["{}[{}]".format(n, w) for n, w in zip(names, widths)]
+    else:
+        args = ["{}[{}]".format(desc, ", ".join(str(w) for w in widths))]
+    return name + " " + ", ".join(args)
+
+def make_calltips(cmd_table=None):
+    if cmd_table is None:
+        cmd_table = pk.pkcommands
+    return {name: command_signature(name, data)
+            for name, data in cmd_table.items()}
+
+def make_entries(data_path, cmd_table=None):
+    ''' QsciAPIs entries: commands as "name(args)" and every stdlib
+        #define name '''
+    if cmd_table is None:
+        cmd_table = pk.pkcommands
+    entries = []
+    for name, data in sorted(cmd_table.items()):
+        if name[0] in "#=":
+            continue
+        sig = command_signature(name, data)
+        entries.append(name + "(" + sig[len(name)+1:] + ")")
+    seen = set(GAMES)
+    for fn in stdlib_files(data_path):
+        for game in GAMES:
+            text = '#define {}\n#include "stdlib/{}"'.format(game, fn)
+            for name, _ in get_defines(text, (data_path,)):
+                if name not in seen:
+                    seen.add(name)
+                    entries.append(name)
+    return entries
+
+def build_index(data_path, cache_dir):
+    ''' Meant to be run in a worker thread. Returns the prepared file
+        path, the entries (None if the prepared file is up to date, so
+        they don't need rebuilding) and the call tips. '''
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, "pks-{}.api".format(data_key(data_path)))
+    calltips = make_calltips()
+    if os.path.isfile(path):
+        return path, None, calltips
+    return path, make_entries(data_path), calltips
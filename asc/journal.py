@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Red Alien.
+
+#    Red Alien is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    Red Alien is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with Red Alien.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Undo journal: the bytes every build overwrote, so it can be
+    reverted without keeping a copy of the ROM.
+
+    Every build appends a block like this:
+        build <sha1 before> <sha1 after> <ROM size before>
+        <offset> <original bytes in hex> <crc32 of the new bytes>
+        ...
+        end
+    Blocks without their "end" line (the build was interrupted while
+    writing the journal) are ignored. Reverting undoes the last
+    blocks first and removes them from the journal. '''
+
+import os
+import zlib
+import hashlib
+from . import patch
+
+def sha1_pieces(pieces):
+    h = hashlib.sha1()
+    for piece in pieces:
+        h.update(piece)
+    return h.hexdigest()
+
+def make_entry(rom, hex_scripts):
+    ''' The journal block for writing hex_scripts onto rom (bytes) '''
+    segments = patch.merge_chunks(hex_scripts)
+    size = patch.target_size(segments, len(rom))
+    before = hashlib.sha1(rom).hexdigest()
+    after = sha1_pieces(patch.iter_target(rom, segments, size))
+    text = "build {} {} {}\n".format(before, after, hex(len(rom)))
+    view = memoryview(rom)
+    for offset, data in segments:
+        old = patch.source_slice(view, offset, offset + len(data))
+        text += "{} {} {}\n".format(hex(offset), old.hex(),
+                                    hex(zlib.crc32(data)))
+    text += "end\n"
+    return text
+
+def record(rom_file, hex_scripts, journal_file_name):
+    ''' Append the block for this build to the journal. rom_file is the
+        open ROM, which we're about to write to. The journal is synced
+        to disk before we return, so the ROM is only touched once it
+        can be reverted. '''
+    rom_file.seek(0)
+    entry = make_entry(rom_file.read(), hex_scripts)
+    # Don't glue our first line to the half line an interrupted build
+    # may have left
+    if os.path.isfile(journal_file_name) and os.path.getsize(journal_file_name):
+        with open(journal_file_name, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                entry = "\n" + entry
+    with open(journal_file_name, "a") as f:
+        f.write(entry)
+        f.flush()
+        os.fsync(f.fileno())
+
+def read_journal(journal_file_name):
+    ''' Returns a list of complete builds, oldest first, as dicts with
+        "before", "after", "size", "ranges" (list of (offset, original
+        bytes, crc32 of the new bytes)) and "pos" (where the block
+        starts in the file) '''
+    builds = []
+    build = None
+    pos = 0
+    with open(journal_file_name, "rb") as f:
+        for line in f:
+            words = line.decode().split()
+            if words and words[0] == "build" and len(words) == 4:
+                build = {"before": words[1], "after": words[2],
+                         "size": int(words[3], 16), "ranges": [],
+                         "pos": pos}
+            elif words == ["end"] and build is not None:
+                builds.append(build)
+                build = None
+            elif len(words) == 3 and build is not None:
+                build["ranges"].append((int(words[0], 16),
+                                        bytes.fromhex(words[1]),
+                                        int(words[2], 16)))
+            else:
+                build = None
+            pos += len(line)
+    return builds
+
+def revert(rom_file_name, journal_file_name, count=1, force=False,
+           verify=False):
+    ''' Undo the last count builds (all of them if count is None).
+        Only the journaled ranges are read and written. Unless forced,
+        they have to hold what the build wrote. With verify, the whole
+        ROM hash is checked before and after every build too. Returns
+        how many builds were reverted. '''
+    builds = read_journal(journal_file_name)
+    if count is not None:
+        builds = builds[max(0, len(builds) - count):] if count else []
+    with open(rom_file_name, "r+b") as f:
+        for build in reversed(builds):
+            if verify:
+                check_hash(f, build["after"])
+            if not force:
+                for offset, old, crc in build["ranges"]:
+                    f.seek(offset)
+                    if zlib.crc32(f.read(len(old))) != crc:
+                        raise Exception("ERROR: the ROM changed at {} since "
+                                        "the build we're reverting, use "
+                                        "--force to revert anyway"
+                                        .format(hex(offset)))
+            for offset, old, _ in build["ranges"]:
+                f.seek(offset)
+                f.write(old)
+            f.truncate(build["size"])
+            if verify:
+                check_hash(f, build["before"])
+            # Forget it right away, so an interrupted revert never
+            # reverts the same build twice
+            with open(journal_file_name, "r+b") as journal:
+                journal.truncate(build["pos"])
+    return len(builds)
+
+def check_hash(f, expected):
+    f.seek(0)
+    if hashlib.sha1(f.read()).hexdigest() != expected:
+        raise Exception("ERROR: ROM hash mismatch")
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Red Alien.
+
+#    Red Alien is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    Red Alien is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with Red Alien.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Syntax highlighting for pokemon scripts (.pks) in QScintilla '''
+
+import re
+from PyQt5 import QtGui
+from PyQt5 import Qsci
+from . import pokecommands as pk
+
+# The preprocessor's, the rest are the # entries of the command table
+PREPROCESSOR_DIRECTIVES = ("#define", "#include", "#ifdef", "#ifndef",
+                           "#endif")
+KEYWORDS = ("if", "else", "while", "switch", "case", "default", "goto")
+
+# Line states, stored with SCI_SETLINESTATE so that styling can start
+# at any line without looking back
+STATE_NORMAL = 0
+STATE_TEXT_CONTINUES = 1 # text line ending with \, the next one is text too
+
+TOKEN_RE = re.compile(rb"[#:@]?\w+|\S")
+NUMBER_RE = re.compile(rb"(0x[0-9a-fA-F]+|[0-9]+)$")
+COMMENT_RE = re.compile(rb"//|'")
+
+def directives(cmd_table):
+    return PREPROCESSOR_DIRECTIVES + tuple(c for c in cmd_table
+                                           if c[0] == "#")
+
+class PKSLexer(Qsci.QsciLexerCustom):
+    ''' Incremental lexer: only the lines Scintilla asks for get styled,
+        and every line stores the state the next one starts with. '''
+    (DEFAULT, COMMENT, COMMAND, DIRECTIVE, LABEL, DYN_LABEL, NUMBER, TEXT,
+     KEYWORD) = range(9)
+
+    STYLES = {
+        DEFAULT: ("Default", "#000000"),
+        COMMENT: ("Comment", "#808080"),
+        COMMAND: ("Command", "#00007F"),
+        DIRECTIVE: ("Directive", "#7F007F"),
+        LABEL: ("Label", "#007F7F"),
+        DYN_LABEL: ("Dynamic label", "#7F7F00"),
+        NUMBER: ("Number", "#007F00"),
+        TEXT: ("Text", "#7F0000"),
+        KEYWORD: ("Keyword", "#0000FF"),
+    }
+
+    def __init__(self, parent=None, cmd_table=None):
+        Qsci.QsciLexerCustom.__init__(self, parent)
+        if cmd_table is None:
+            cmd_table = pk.pkcommands
+        self.commands = frozenset(c.encode() for c in cmd_table
+                                  if c[0] not in "#=" and c != "if")
+        self.directives = frozenset(d.encode() for d in
+                                    directives(cmd_table))
+        self.keywords = frozenset(k.encode() for k in KEYWORDS)
+
+    def language(self):
+        return "PKS"
+
+    def description(self, style):
+        if style in self.STYLES:
+            return self.STYLES[style][0]
+        return ""
+
+    def defaultColor(self, style):
+        if style in self.STYLES:
+            return QtGui.QColor(self.STYLES[style][1])
+        return Qsci.QsciLexerCustom.defaultColor(self, style)
+
+    def defaultFont(self, style):
+        font = Qsci.QsciLexerCustom.defaultFont(self, style)
+        if style in (self.COMMAND, self.KEYWORD, self.DIRECTIVE):
+            font.setBold(True)
+        return font
+
+    def styleText(self, start, end):
+        editor = self.editor()
+        if editor is None:
+            return
+        first = editor.SendScintilla(editor.SCI_LINEFROMPOSITION, start)
+        last = editor.SendScintilla(editor.SCI_LINEFROMPOSITION, end)
+        line_count = editor.SendScintilla(editor.SCI_GETLINECOUNT)
+        while True:
+            changed = self.style_lines(editor, first, last)
+            # If the state the next line starts with changed (someone
+            # added or removed a trailing \ in a text line), keep going
+            # until it's stable again
+            if not changed or last + 1 >= line_count:
+                break
+            first = last = last + 1
+
+    def style_lines(self, editor, first, last):
+        start = editor.SendScintilla(editor.SCI_POSITIONFROMLINE, first)
+        end = editor.SendScintilla(editor.SCI_GETLINEENDPOSITION, last)
+        # +1 for the NUL Scintilla writes at the end
+        buf = bytearray(end - start + 1)
+        editor.SendScintilla(editor.SCI_GETTEXTRANGE, start, end, buf)
+        text = bytes(buf[:end - start])
+
+        if first > 0:
+            state = editor.SendScintilla(editor.SCI_GETLINESTATE, first - 1)
+        else:
+            state = STATE_NORMAL
+        self.startStyling(start)
+        for n, line in enumerate(text.split(b"\n")):
+            if n:
+                self.setStyling(1, self.DEFAULT) # the \n
+            state = self.style_line(line, state)
+            line_n = first + n
+            old_state = editor.SendScintilla(editor.SCI_GETLINESTATE, line_n)
+            editor.SendScintilla(editor.SCI_SETLINESTATE, line_n, state)
+        return state != old_state
+
+    def style_line(self, line, state):
+        ''' Style one line (bytes, no \\n) and return the state for the
+            next one '''
+        if not line:
+            return STATE_NORMAL
+        stripped = line.lstrip()
+        indent = len(line) - len(stripped)
+        if state == STATE_TEXT_CONTINUES or stripped[:1] == b"=":
+            self.setStyling(len(line), self.TEXT)
+            if line.rstrip().endswith(b"\\"):
+                return STATE_TEXT_CONTINUES
+            return STATE_NORMAL
+
+        comment = COMMENT_RE.search(line)
+        code_end = comment.start() if comment else len(line)
+        pos = 0
+        for m in TOKEN_RE.finditer(line, indent, code_end):
+            if m.start() > pos:
+                self.setStyling(m.start() - pos, self.DEFAULT)
+            self.setStyling(m.end() - m.start(), self.token_style(m.group()))
+            pos = m.end()
+        if code_end > pos:
+            self.setStyling(code_end - pos, self.DEFAULT)
+        if comment:
+            self.setStyling(len(line) - code_end, self.COMMENT)
+        return STATE_NORMAL
+
+    def token_style(self, token):
+        first = token[:1]
+        if first == b"#":
+            return self.DIRECTIVE if token in self.directives else self.DEFAULT
+        if first == b":":
+            return self.LABEL
+        if first == b"@":
+            return self.DYN_LABEL
+        if token in self.commands:
+            return self.COMMAND
+        if token in self.keywords:
+            return self.KEYWORD
+        if NUMBER_RE.match(token):
+            return self.NUMBER
+        return self.DEFAULT
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Red Alien.
+
+#    Red Alien is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    Red Alien is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with Red Alien.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Relocatable objects: compiled scripts whose #dyn chunks aren't
+    placed yet, and whose @labels and :labels are still to be filled
+    in, so many of them can be placed in a ROM at once.
+
+    An object file looks like this:
+        object
+        dyn <#dyn offset, or - if it has none>
+        chunk <offset or @label> <bytes in hex>
+        label <chunk number> <offset in the chunk> <:label>
+        reloc <chunk number> <offset in the chunk> <size> <label> <0 or 1>
+        ...
+        end
+    @labels are the #org @label chunks, and are shared between all the
+    objects that get linked together, :labels only exist in their
+    object. reloc lines are the arguments that take a label, 1 meaning
+    it's a pointer (the address gets 0x8000000). '''
+
+from . import alloc
+
+POINTER_BASE = 0x8000000
+
+def labels_dict(hex_script):
+    ''' {:label: (chunk number, offset in the chunk)}, the first one
+        wins, like in put_addresses_labels '''
+    labels = {}
+    for n, (_, _, chunk_labels) in enumerate(hex_script):
+        for name, pos in chunk_labels:
+            labels.setdefault(name, (n, pos))
+    return labels
+
+def make_object(hex_script, relocations, dyn):
+    ''' The object (a dict) for make_bytecode's output (with the
+        :labels lists still there) and relocations, and asm_parse's dyn '''
+    return {
+        "dyn": dyn[1] if dyn[0] else None,
+        "chunks": [[addr, data] for addr, data, _ in hex_script],
+        "labels": labels_dict(hex_script),
+        "relocations": [(n, pos, size, label, pointer)
+                        for n, chunk_relocations in enumerate(relocations)
+                        for pos, size, label, pointer in chunk_relocations],
+    }
+
+def write_object(obj, f):
+    f.write("object\n")
+    f.write("dyn {}\n".format(obj["dyn"] or "-"))
+    for addr, data in obj["chunks"]:
+        f.write("chunk {} {}\n".format(addr, data.hex()))
+    for name, (n, pos) in sorted(obj["labels"].items(),
+                                 key=lambda item: item[1]):
+        f.write("label {} {} {}\n".format(n, hex(pos), name))
+    for n, pos, size, label, pointer in obj["relocations"]:
+        f.write("reloc {} {} {} {} {}\n".format(n, hex(pos), size, label,
+                                                int(pointer)))
+    f.write("end\n")
+
+def read_object(fn):
+    obj = {"dyn": None, "chunks": [], "labels": {}, "relocations": []}
+    with open(fn) as f:
+        lines = f.read().split("\n")
+    if not lines or lines[0] != "object" or "end" not in lines:
+        raise Exception("ERROR: " + fn + " is not an object file, or it's "
+                        "incomplete")
+    try:
+        for line in lines[1:lines.index("end")]:
+            words = line.split()
+            if words[0] == "dyn":
+                obj["dyn"] = None if words[1] == "-" else words[1]
+            elif words[0] == "chunk":
+                obj["chunks"].append([words[1], bytes.fromhex(words[2])])
+            elif words[0] == "label":
+                obj["labels"][words[3]] = (int(words[1]), int(words[2], 16))
+            elif words[0] == "reloc":
+                obj["relocations"].append((int(words[1]), int(words[2], 16),
+                                           int(words[3]), words[4],
+                                           words[5] == "1"))
+            else:
+                raise ValueError
+    except (ValueError, IndexError):
+        raise Exception("ERROR: bad line in " + fn + ": " + line)
+    return obj
+
+def link(objects, rom, dyn=None, align=alloc.ALIGN, margin=alloc.MARGIN,
+         dedupe=False):
+    ''' Place the #dyn chunks of all the objects at once (see
+        alloc.place) in rom (bytes or mmap), from dyn (a hex string; by
+        default the first #dyn in the objects), and fill in the labels.
+        With dedupe, chunks without relocations that have the same bytes
+        (in any of the objects) are placed only once.
+        Returns the chunks ([offset, bytes] list) and the #dyn log. '''
+    if dyn is None:
+        dyn = next((obj["dyn"] for obj in objects if obj["dyn"]), None)
+    chunks = []
+    dynamic = []
+    pure = []
+    for obj in objects:
+        relocated = {n for n, _, _, _, _ in obj["relocations"]}
+        for n, (addr, data) in enumerate(obj["chunks"]):
+            if addr[0] == "@":
+                dynamic.append(len(chunks))
+                pure.append(n not in relocated)
+            chunks.append([addr, bytearray(data)])
+    addresses = {}
+    shared = set()
+    log = ''
+    if dynamic:
+        if dyn is None:
+            raise Exception("ERROR: there are @ chunks but no #dyn")
+        same = list(range(len(dynamic)))
+        report = ''
+        if dedupe:
+            same, saved = alloc.duplicates([bytes(chunks[i][1]) if pure[n]
+                                            else None
+                                            for n, i in enumerate(dynamic)])
+            report = alloc.duplicates_report(same, saved)
+        unique = [n for n, first in enumerate(same) if first == n]
+        offsets, stats = alloc.place([len(chunks[dynamic[n]][1])
+                                      for n in unique], rom, int(dyn, 16),
+                                     align, margin)
+        placed = dict(zip(unique, offsets))
+        offsets = [placed[first] for first in same]
+        shared = {dynamic[n] for n, first in enumerate(same) if first != n}
+        for i, offset in zip(dynamic, offsets):
+            label = chunks[i][0]
+            if label in addresses:
+                raise Exception("ERROR: " + label + " is in more than one "
+                                "#org")
+            addresses[label] = offset
+            chunks[i][0] = hex(offset)
+            log += label + ' - ' + hex(offset) + '\n'
+        log += alloc.pack_report(stats) + report
+    first = 0
+    for obj in objects:
+        own = obj["chunks"]
+        local = {name: int(chunks[first + n][0], 16) + pos
+                 for name, (n, pos) in obj["labels"].items()}
+        for n, pos, size, label, pointer in obj["relocations"]:
+            if label in local:
+                address = local[label]
+            elif label in addresses:
+                address = addresses[label]
+            else:
+                raise Exception("ERROR: " + label + " is never defined")
+            if pointer:
+                address |= POINTER_BASE
+            try:
+                value = address.to_bytes(size, "little")
+            except OverflowError:
+                raise Exception("ERROR: the address of " + label +
+                                " doesn't fit in " + str(size) + " bytes")
+            chunks[first + n][1][pos:pos+size] = value
+        first += len(own)
+    # The chunks that share a placement are written once
+    return [[addr, bytes(data)] for n, (addr, data) in enumerate(chunks)
+            if n not in shared], log
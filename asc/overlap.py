@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Red Alien.
+
+#    Red Alien is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    Red Alien is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with Red Alien.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Checks for a build before it gets written: chunks on top of each
+    other or of what earlier builds wrote, and #dyn chunks landing on
+    data '''
+
+import heapq
+from .patch import chunk_offset
+
+FREE = b"\xFF"
+
+def dynamic_offsets(log):
+    ''' Where the #dyn chunks went, from the put_addresses log
+        ("@label - 0x800000" lines) '''
+    offsets = set()
+    for line in log.split("\n"):
+        words = line.split(" - ")
+        if len(words) == 2:
+            offsets.add(chunk_offset(words[1].strip()))
+    return offsets
+
+def build_intervals(hex_script):
+    ''' (start, end) of every chunk '''
+    return [(chunk_offset(addr), chunk_offset(addr) + len(data))
+            for addr, data in hex_script if len(data)]
+
+def history_intervals(ranges):
+    ''' (start, end) of the (offset, length) ranges from placement
+        logs, without repeats '''
+    return sorted({(chunk_offset(offset), chunk_offset(offset) + length)
+                   for offset, length in ranges if length})
+
+def find_overlaps(build, history=()):
+    ''' Every pair of overlapping intervals where at least one is from
+        build, as (build interval, other interval, True if the other
+        one is from build too).
+        Everything is sorted by start and swept once, keeping the
+        intervals still open in heaps by end, so this is O(n log n)
+        plus the number of overlaps. History intervals are never
+        compared with each other. '''
+    events = sorted([(start, end, True) for start, end in build] +
+                    [(start, end, False) for start, end in history])
+    open_build = []
+    open_history = []
+    overlaps = []
+    for start, end, in_build in events:
+        for heap in (open_build, open_history):
+            while heap and heap[0][0] <= start:
+                heapq.heappop(heap)
+        for other_end, other_start in open_build:
+            overlaps.append(((other_start, other_end), (start, end),
+                             in_build))
+        if in_build:
+            for other_end, other_start in open_history:
+                overlaps.append(((start, end), (other_start, other_end),
+                                 False))
+        heapq.heappush(open_build if in_build else open_history,
+                       (end, start))
+    return overlaps
+
+def check_build(hex_script, rom=None, dynamic=(), history=None):
+    ''' Check the chunks of a build (list of [offset, bytes]) before
+        writing them. rom is the ROM they will be written to (bytes or
+        mmap) or None, dynamic the offsets of the #dyn chunks (see
+        dynamic_offsets) and history the (offset, length) ranges
+        earlier builds wrote (see read_placement_log), or None.
+        Returns a list of (level, message):
+        errors for chunks on top of each other and #dyn chunks on
+        anything but 0xFF bytes, and warnings for chunks partly on top
+        of something an earlier build wrote, or, when there's a
+        history, fixed chunks on data no earlier build wrote. Chunks
+        starting where an earlier one did are taken as rebuilds of it. '''
+    diagnostics = []
+    build = build_intervals(hex_script)
+    history = history_intervals(history or ())
+    history_starts = {start for start, _ in history}
+    for (start1, end1), (start2, end2), both in find_overlaps(build,
+                                                              history):
+        size = min(end1, end2) - max(start1, start2)
+        if both:
+            diagnostics.append(("error", "chunks at {} and {} overlap ({} "
+                                "bytes)".format(hex(start1), hex(start2),
+                                                hex(size))))
+        elif start1 != start2:
+            diagnostics.append(("warning", "chunk at {} overlaps what an "
+                                "earlier build wrote at {} ({} bytes)".format(
+                                    hex(start1), hex(start2), hex(size))))
+    if rom is None:
+        return diagnostics
+    for (start, end), (addr, data) in zip(build, (c for c in hex_script
+                                                  if len(c[1]))):
+        current = rom[start:end]
+        if current.count(FREE) == len(current) or current == data:
+            continue
+        if start in dynamic:
+            diagnostics.append(("error", "#dyn chunk at {} would overwrite "
+                                "data".format(hex(start))))
+        elif history and start not in history_starts:
+            diagnostics.append(("warning", "chunk at {} overwrites data no "
+                                "earlier build wrote".format(hex(start))))
+    return diagnostics
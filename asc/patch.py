@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Red Alien.
+
+#    Red Alien is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    Red Alien is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with Red Alien.  If not, see <http://www.gnu.org/licenses/>.
+
+''' IPS, UPS and BPS patches, made straight from the compiled chunks
+    (never from a patched copy of the ROM) and applied by streaming
+    them onto a ROM file '''
+
+import os
+import re
+import mmap
+import zlib
+import shutil
+import tempfile
+from bisect import bisect_right
+from contextlib import contextmanager
+
+FORMATS = ("ips", "ups", "bps")
+IPS_MAX_OFFSET = 0xFFFFFF
+IPS_MAX_RECORD = 0xFFFF
+IPS_EOF = 0x454F46 # "EOF", can't be used as a record offset
+# Don't bother with RLE records for shorter runs
+IPS_MIN_RLE = 8
+COPY_BLOCK = 1024 * 1024
+
+def get_format(file_name):
+    ''' Patch format from the file extension '''
+    ext = os.path.splitext(file_name)[1][1:].lower()
+    if ext not in FORMATS:
+        raise Exception("ERROR: unknown patch format '{}', use one of {}"
+                        .format(ext, ", ".join(FORMATS)))
+    return ext
+
+def chunk_offset(addr):
+    offset = int(addr, 16) if isinstance(addr, str) else addr
+    if offset >= 0x8000000:
+        offset -= 0x8000000
+    return offset
+
+def merge_chunks(hex_script):
+    ''' Turn a list of [offset, bytes] chunks into sorted, non
+        overlapping, non adjacent (offset, bytearray) segments. Where
+        chunks overlap, the later one wins, like in write_hex_script. '''
+    chunks = [(chunk_offset(addr), data) for addr, data in hex_script]
+    ranges = sorted((offset, offset + len(data)) for offset, data in chunks
+                    if data)
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    starts = [start for start, _ in merged]
+    segments = [(start, bytearray(end - start)) for start, end in merged]
+    for offset, data in chunks:
+        if not data:
+            continue
+        start, segment = segments[bisect_right(starts, offset) - 1]
+        segment[offset-start:offset-start+len(data)] = data
+    return segments
+
+def target_size(segments, source_size):
+    if not segments:
+        return source_size
+    return max(source_size, segments[-1][0] + len(segments[-1][1]))
+
+def source_slice(source, start, end):
+    ''' source[start:end], padded with zeros past the end '''
+    data = source[start:min(end, len(source))] if start < len(source) else b""
+    return bytes(data) + bytes(end - start - len(data))
+
+def iter_target(source, segments, size):
+    ''' The patched ROM in pieces, without building it '''
+    view = memoryview(source)
+    pos = 0
+    for offset, data in segments:
+        if offset > pos:
+            yield source_slice(view, pos, offset)
+        yield data
+        pos = offset + len(data)
+    if size > pos:
+        yield source_slice(view, pos, size)
+
+def target_crc(source, segments, size):
+    ''' CRC32 of the patched ROM '''
+    crc = 0
+    for piece in iter_target(source, segments, size):
+        crc = zlib.crc32(piece, crc)
+    return crc
+
+def encode_number(n):
+    ''' The variable length numbers of UPS and BPS '''
+    out = bytearray()
+    while True:
+        x = n & 0x7f
+        n >>= 7
+        if n == 0:
+            out.append(0x80 | x)
+            return bytes(out)
+        out.append(x)
+        n -= 1
+
+def decode_number(f):
+    n = 0
+    shift = 1
+    while True:
+        x = f.read(1)
+        if not x:
+            raise Exception("ERROR: truncated patch")
+        x = x[0]
+        n += (x & 0x7f) * shift
+        if x & 0x80:
+            return n
+        shift <<= 7
+        n += shift
+
+def make_ips(hex_script, source=None):
+    ''' source is only needed if something has to be written at 0x454F46 '''
+    out = bytearray(b"PATCH")
+    for offset, data in merge_chunks(hex_script):
+        if offset == IPS_EOF:
+            if source is None:
+                raise Exception("ERROR: IPS can't write at 0x454F46 without "
+                                "the ROM, use UPS or BPS")
+            offset -= 1
+            data = bytearray(source[offset:offset+1]) + data
+        if offset + len(data) - 1 > IPS_MAX_OFFSET:
+            raise Exception("ERROR: IPS patches can't go past 16 MB, "
+                            "use UPS or BPS")
+        for i in range(0, len(data), IPS_MAX_RECORD):
+            record = data[i:i+IPS_MAX_RECORD]
+            record_offset = offset + i
+            if record_offset == IPS_EOF:
+                # Split the previous record differently
+                raise Exception("ERROR: IPS record at 0x454F46, "
+                                "use UPS or BPS")
+            out += record_offset.to_bytes(3, "big")
+            if (len(record) >= IPS_MIN_RLE and
+                    record.count(record[0]) == len(record)):
+                out += b"\x00\x00" + len(record).to_bytes(2, "big")
+                out.append(record[0])
+            else:
+                out += len(record).to_bytes(2, "big") + record
+    out += b"EOF"
+    return bytes(out)
+
+def make_ups(hex_script, source):
+    segments = merge_chunks(hex_script)
+    size = target_size(segments, len(source))
+    out = bytearray(b"UPS1")
+    out += encode_number(len(source)) + encode_number(size)
+    view = memoryview(source)
+    pos = 0
+    for offset, data in segments:
+        n = len(data)
+        old = source_slice(view, offset, offset + n)
+        xor = (int.from_bytes(data, "big") ^
+               int.from_bytes(old, "big")).to_bytes(n, "big")
+        for m in re.finditer(rb"[^\x00]+", xor):
+            start = offset + m.start()
+            out += encode_number(start - pos) + m.group() + b"\x00"
+            pos = offset + m.end() + 1
+    out += zlib.crc32(view).to_bytes(4, "little")
+    out += target_crc(source, segments, size).to_bytes(4, "little")
+    out += zlib.crc32(out).to_bytes(4, "little")
+    return bytes(out)
+
+def make_bps(hex_script, source):
+    segments = merge_chunks(hex_script)
+    size = target_size(segments, len(source))
+    out = bytearray(b"BPS1")
+    out += encode_number(len(source)) + encode_number(size)
+    out += encode_number(0) # no metadata
+    def source_read(n):
+        return encode_number(((n - 1) << 2) | 0)
+    def target_read(data):
+        return encode_number(((len(data) - 1) << 2) | 1) + data
+    pos = 0
+    for offset, data in segments:
+        if offset > pos:
+            source_end = min(offset, len(source))
+            if source_end > pos:
+                out += source_read(source_end - pos)
+            # Past the end of the source there's nothing to read
+            gap = offset - max(pos, source_end)
+            if gap > 0:
+                out += target_read(bytes(gap))
+        out += target_read(data)
+        pos = offset + len(data)
+    if size > pos:
+        out += source_read(size - pos)
+    out += zlib.crc32(memoryview(source)).to_bytes(4, "little")
+    out += target_crc(source, segments, size).to_bytes(4, "little")
+    out += zlib.crc32(out).to_bytes(4, "little")
+    return bytes(out)
+
+def make_patch(hex_script, fmt, source=None):
+    ''' hex_script is a list of [offset, bytes] like assemble() returns.
+        source (the unpatched ROM, any bytes-like object or mmap) is
+        needed for UPS and BPS, which store checksums and (UPS) XOR
+        with the original bytes. '''
+    if fmt == "ips":
+        return make_ips(hex_script, source)
+    if source is None:
+        raise Exception("ERROR: {} patches need the ROM".format(fmt.upper()))
+    if fmt == "ups":
+        return make_ups(hex_script, source)
+    if fmt == "bps":
+        return make_bps(hex_script, source)
+    raise Exception("ERROR: unknown patch format " + fmt)
+
+@contextmanager
+def map_rom(rom_file_name):
+    ''' Read only view of a ROM file, for a with block. It's closed at
+        the end of the block, so nothing from it can be kept after. '''
+    with open(rom_file_name, "rb") as f:
+        if not os.path.getsize(rom_file_name):
+            yield b""
+            return
+        rom = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        yield rom
+    finally:
+        rom.close()
+
+def file_crc(f, size=None):
+    f.seek(0)
+    crc = 0
+    left = size
+    while left is None or left > 0:
+        block = f.read(COPY_BLOCK if left is None else min(COPY_BLOCK, left))
+        if not block:
+            break
+        crc = zlib.crc32(block, crc)
+        if left is not None:
+            left -= len(block)
+    return crc
+
+def check_crc(expected, got, what):
+    if expected != got:
+        raise Exception("ERROR: {} checksum mismatch".format(what))
+
+def apply_ips(p, rom):
+    if p.read(5) != b"PATCH":
+        raise Exception("ERROR: not an IPS patch")
+    while True:
+        offset = p.read(3)
+        if offset == b"EOF":
+            break
+        if len(offset) != 3:
+            raise Exception("ERROR: truncated patch")
+        offset = int.from_bytes(offset, "big")
+        size = int.from_bytes(p.read(2), "big")
+        rom.seek(offset)
+        if size:
+            rom.write(p.read(size))
+        else:
+            size = int.from_bytes(p.read(2), "big")
+            rom.write(p.read(1) * size)
+    # Lunar IPS truncation extension
+    truncate = p.read(3)
+    if len(truncate) == 3:
+        rom.truncate(int.from_bytes(truncate, "big"))
+
+def read_checksums(p):
+    ''' The three CRC32s at the end of UPS and BPS patches. Leaves the
+        patch file where it was. '''
+    pos = p.tell()
+    p.seek(-12, os.SEEK_END)
+    end = p.tell()
+    crcs = [int.from_bytes(p.read(4), "little") for _ in range(3)]
+    p.seek(0)
+    check_crc(crcs[2], zlib.crc32(p.read(end + 8)), "patch")
+    p.seek(pos)
+    return crcs[0], crcs[1], end
+
+def apply_ups(p, rom):
+    if p.read(4) != b"UPS1":
+        raise Exception("ERROR: not a UPS patch")
+    source_crc, target_crc_, end = read_checksums(p)
+    source_size = decode_number(p)
+    size = decode_number(p)
+    check_crc(source_crc, file_crc(rom, source_size), "source ROM")
+    pos = 0
+    while p.tell() < end:
+        pos += decode_number(p)
+        xor = bytearray()
+        while True:
+            b = p.read(1)
+            if not b or b == b"\x00":
+                break
+            xor += b
+        rom.seek(pos)
+        old = rom.read(len(xor))
+        old += bytes(len(xor) - len(old))
+        rom.seek(pos)
+        rom.write(bytes(a ^ b for a, b in zip(old, xor)))
+        pos += len(xor) + 1
+    rom.truncate(size)
+    check_crc(target_crc_, file_crc(rom), "patched ROM")
+
+def apply_bps(p, source, out):
+    ''' source is a read only view of the original ROM, out is where the
+        patched one gets written (sequentially) '''
+    if p.read(4) != b"BPS1":
+        raise Exception("ERROR: not a BPS patch")
+    source_crc, target_crc_, end = read_checksums(p)
+    decode_number(p) # source size
+    decode_number(p) # target size
+    p.read(decode_number(p)) # metadata
+    check_crc(source_crc, zlib.crc32(source), "source ROM")
+    out_pos = 0
+    source_rel = 0
+    target_rel = 0
+    while p.tell() < end:
+        data = decode_number(p)
+        mode = data & 3
+        length = (data >> 2) + 1
+        if mode == 0: # SourceRead
+            out.write(source[out_pos:out_pos+length])
+        elif mode == 1: # TargetRead
+            out.write(p.read(length))
+        elif mode == 2: # SourceCopy
+            n = decode_number(p)
+            source_rel += (-1 if n & 1 else 1) * (n >> 1)
+            out.write(source[source_rel:source_rel+length])
+            source_rel += length
+        else: # TargetCopy, can overlap what it's writing
+            n = decode_number(p)
+            target_rel += (-1 if n & 1 else 1) * (n >> 1)
+            for _ in range(length):
+                out.seek(target_rel)
+                b = out.read(1)
+                out.seek(0, os.SEEK_END)
+                out.write(b)
+                target_rel += 1
+        out_pos += length
+    out.flush()
+    check_crc(target_crc_, file_crc(out), "patched ROM")
+
+def apply_patch(patch_file_name, rom_file_name, out_file_name=None):
+    ''' Apply a patch onto a ROM. IPS and UPS are applied in place,
+        seeking to every changed range. BPS can copy from anywhere in
+        the source, so it writes a new file. '''
+    if out_file_name and out_file_name != rom_file_name:
+        if get_format(patch_file_name) != "bps":
+            shutil.copyfile(rom_file_name, out_file_name)
+            rom_file_name = out_file_name
+    else:
+        out_file_name = rom_file_name
+    fmt = get_format(patch_file_name)
+    with open(patch_file_name, "rb") as p:
+        if fmt == "ips":
+            with open(rom_file_name, "r+b") as rom:
+                apply_ips(p, rom)
+        elif fmt == "ups":
+            with open(rom_file_name, "r+b") as rom:
+                apply_ups(p, rom)
+        else:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(
+                os.path.abspath(out_file_name)))
+            try:
+                with map_rom(rom_file_name) as source, \
+                        os.fdopen(fd, "w+b") as out:
+                    apply_bps(p, source, out)
+                shutil.copymode(rom_file_name, tmp)
+                os.replace(tmp, out_file_name)
+            except:
+                os.remove(tmp)
+                raise
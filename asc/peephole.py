@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Red Alien.
+
+#    Red Alien is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    Red Alien is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with Red Alien.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Peephole optimizer for the plain script that comes out of the
+    preprocessing (what if/while blocks turn into), before it gets
+    assembled:
+    - jumps to a jump go straight to where that one goes, and jumps to
+      an end or a return are that end or return,
+    - jumps to the next instruction go away,
+    - commands after an end, return or jump that no :label leads to go
+      away,
+    - code paths ending the same way share the end, with a jump.
+    :labels only exist in their file, so one that nothing in the file
+    jumps to can't be jumped to. '''
+
+from . import text_translate
+
+TERMINATORS = ("end", "return", "jump")
+ENDS = ("end", "return")
+IF_BRANCHES = {"jump": "jumpif", "call": "callif", "jumpstd": "jumpstdif",
+               "callstd": "callstdif"}
+JUMP_SIZE = 5
+TAIL_LABEL = ":tail"
+
+def is_label(line):
+    return line[:1] == ":"
+
+def is_command(line, cmd_table):
+    ''' A command (not a label, text or directive like #raw, which are
+        in cmd_table too) '''
+    words = line.split()
+    return (bool(words) and words[0] != "=" and words[0][0] != "#" and
+            (words[0] == "if" or words[0] in cmd_table))
+
+def jump_target(words):
+    ''' Index of the word with the destination, if it's a jump '''
+    if words[:1] == ["jump"] and len(words) == 2:
+        return 1
+    if len(words) == 4 and words[0] == "if" and words[2] == "jump":
+        return 3
+    if words[:1] == ["jumpif"] and len(words) == 3:
+        return 2
+    return None
+
+def line_size(line, cmd_table):
+    ''' How many bytes the line assembles to (0 for labels and what we
+        don't know) '''
+    words = line.split()
+    if not words or is_label(line):
+        return 0
+    if words[0] == "=":
+        return len(text_translate.ascii_to_hex(line[2:]))
+    if words[0] == "#raw":
+        return 1
+    if words[0] == "#fill" and len(words) == 3:
+        return int(words[1], 0) if words[1][:2] == "0x" else int(words[1])
+    if words[0] == "if" and len(words) == 4:
+        words = [IF_BRANCHES.get(words[2], "")] + [words[1], words[3]]
+    data = cmd_table.get(words[0])
+    if data is None:
+        return 0
+    if "args" not in data:
+        return 1
+    widths = data["args"][1]
+    prefix = data["args"][2] if len(data["args"]) == 3 else b""
+    return 1 + sum(widths) + len(prefix) * len(widths)
+
+def split_blocks(text_script):
+    ''' [[#org line or None for what comes before, [lines]], ...] '''
+    blocks = [[None, []]]
+    for line in text_script.split("\n"):
+        if line.split()[:1] == ["#org"]:
+            blocks.append([line, []])
+        else:
+            blocks[-1][1].append(line)
+    return blocks
+
+def join_blocks(blocks):
+    lines = []
+    for org, block in blocks:
+        if org is not None:
+            lines.append(org)
+        lines += block
+    return "\n".join(lines)
+
+def label_positions(blocks):
+    positions = {}
+    for b, (_, block) in enumerate(blocks):
+        for i, line in enumerate(block):
+            if is_label(line):
+                positions.setdefault(line.split()[0], (b, i))
+    return positions
+
+def referenced_labels(blocks):
+    return {word for _, block in blocks for line in block
+            if not is_label(line) and line.split()[:1] != ["="]
+            for word in line.split()[1:] if word[:1] == ":"}
+
+def next_instruction(blocks, b, i):
+    ''' The first line after line i that isn't a label (or empty), or
+        None if the block ends first '''
+    block = blocks[b][1]
+    for line in block[i+1:]:
+        if line.strip() and not is_label(line):
+            return line
+    return None
+
+def resolve(blocks, positions, label):
+    ''' Where jumping to label ends up, following jumps '''
+    seen = {label}
+    while label in positions:
+        line = next_instruction(blocks, *positions[label])
+        words = line.split() if line else []
+        if words[:1] != ["jump"] or len(words) != 2 or words[1] in seen:
+            break
+        label = words[1]
+        seen.add(label)
+    return label
+
+def thread_jumps(blocks):
+    positions = label_positions(blocks)
+    changed = False
+    for b, (_, block) in enumerate(blocks):
+        for i, line in enumerate(block):
+            words = line.split()
+            n = jump_target(words)
+            if n is None or words[n] not in positions:
+                continue
+            target = resolve(blocks, positions, words[n])
+            if target != words[n]:
+                words[n] = target
+                changed = True
+            if words[0] == "jump" and target in positions:
+                line = next_instruction(blocks, *positions[target])
+                if line is not None and line.split() in ([e] for e in ENDS):
+                    words = line.split()
+                    changed = True
+            block[i] = " ".join(words)
+    return changed
+
+def drop_next_jumps(blocks):
+    ''' Remove jumps to the line right after them. When a :label is
+        there twice, the first one is the one that counts, like when
+        assembling. '''
+    positions = label_positions(blocks)
+    changed = False
+    for b, (_, block) in enumerate(blocks):
+        dropped = set()
+        for i, line in enumerate(block):
+            words = line.split()
+            n = jump_target(words)
+            if (n is None or words[n] not in positions or
+                    positions[words[n]][0] != b):
+                continue
+            for j in range(i + 1, len(block)):
+                if (b, j) == positions[words[n]]:
+                    dropped.add(i)
+                if block[j].strip() and not is_label(block[j]):
+                    break
+        if dropped:
+            block[:] = [line for i, line in enumerate(block)
+                        if i not in dropped]
+            changed = True
+    return changed
+
+def drop_dead_code(blocks, cmd_table):
+    ''' Remove commands nothing can get to, after an end, a return or a
+        jump and before any :label we jump to. Text and other data
+        stays. '''
+    referenced = referenced_labels(blocks)
+    changed = False
+    for _, block in blocks:
+        dead = False
+        i = 0
+        while i < len(block):
+            line = block[i]
+            if is_label(line):
+                if line.split()[0] in referenced:
+                    dead = False
+            elif dead and is_command(line, cmd_table):
+                del block[i]
+                changed = True
+                continue
+            elif line.strip():
+                dead = line.split()[0] in TERMINATORS
+            i += 1
+    return changed
+
+def segments(blocks, cmd_table):
+    ''' (block, start, end) of every run of commands that ends with an
+        end, a return or a jump and that nothing jumps into '''
+    referenced = referenced_labels(blocks)
+    found = []
+    for b, (_, block) in enumerate(blocks):
+        start = None
+        for i, line in enumerate(block + [":"]):
+            if not line.strip() or (is_label(line) and
+                                    line.split()[0] not in referenced):
+                continue
+            if is_command(line, cmd_table):
+                if start is None:
+                    start = i
+                if line.split()[0] in TERMINATORS:
+                    found.append((b, start, i + 1))
+                    start = None
+            else:
+                start = None
+    return found
+
+def merge_tails(blocks, cmd_table):
+    ''' Make code paths that end with the same commands jump to the
+        first one's copy of them, when that's smaller. The ends are
+        found by walking a trie of reversed paths, so this is linear
+        in the length of the script. '''
+    taken = {line.split()[0] for _, block in blocks for line in block
+             if is_label(line)}
+    trie = {}
+    new_labels = {}
+    edits = []
+    for b, start, end in segments(blocks, cmd_table):
+        block = blocks[b][1]
+        lines = [" ".join(block[i].split()) for i in range(end - 1, start - 1,
+                                                           -1)
+                 if is_command(block[i], cmd_table)]
+        node = trie
+        depth = 0
+        size = 0
+        best = None
+        for line in lines:
+            if line not in node:
+                break
+            node = node[line]
+            depth += 1
+            size += line_size(line, cmd_table)
+            if size > JUMP_SIZE:
+                best = (node[None], depth)
+        if best is not None:
+            (b2, end2), depth = best
+            key = (b2, end2, depth)
+            if key not in new_labels:
+                n = len(new_labels)
+                while TAIL_LABEL + str(n) in taken:
+                    n += 1
+                taken.add(TAIL_LABEL + str(n))
+                new_labels[key] = TAIL_LABEL + str(n)
+            edits.append((b, start, end, depth, new_labels[key]))
+            continue
+        node = trie
+        for i, line in enumerate(lines):
+            node = node.setdefault(line, {None: (b, end)})
+    if not edits:
+        return False
+    # Replacing a tail doesn't move the lines before it, and the tails we
+    # jump to are never replaced, so going from the end keeps every
+    # position right
+    changes = ([(b, end, depth, None, label) for b, start, end, depth, label
+                in edits] +
+               [(b, end, depth, label, None) for (b, end, depth), label
+                in new_labels.items()])
+    # Labels in the same path go in from the end too
+    for b, end, depth, label, jump in sorted(changes, key=lambda c: (c[0],
+                                             c[1], -c[2]), reverse=True):
+        block = blocks[b][1]
+        # depth counts commands, skip back over the rest
+        i = end
+        left = depth
+        while left:
+            i -= 1
+            if is_command(block[i], cmd_table):
+                left -= 1
+        if label is not None:
+            block.insert(i, label)
+        else:
+            block[i:end] = ["jump " + jump]
+    return True
+
+def block_sizes(blocks, cmd_table):
+    return [sum(line_size(line, cmd_table) for line in block)
+            for _, block in blocks]
+
+def optimize(text_script, cmd_table):
+    ''' Optimize a preprocessed script. Returns it and a list of (#org
+        line, bytes before, bytes after) for the scripts that got
+        smaller. '''
+    blocks = split_blocks(text_script)
+    before = block_sizes(blocks, cmd_table)
+    passes = (thread_jumps, drop_next_jumps,
+              lambda blocks: drop_dead_code(blocks, cmd_table))
+    while any([p(blocks) for p in passes]):
+        pass
+    if merge_tails(blocks, cmd_table):
+        while any([p(blocks) for p in passes]):
+            pass
+    after = block_sizes(blocks, cmd_table)
+    saved = [(org, size1, size2) for (org, _), size1, size2
+             in zip(blocks, before, after) if size2 < size1]
+    return join_blocks(blocks), saved
+
+def report(saved):
+    ''' The list from optimize as comment lines '''
+    text = ""
+    for org, size1, size2 in saved:
+        text += "' {}: {} -> {} bytes ({} saved)\n".format(
+            org, hex(size1), hex(size2), hex(size1 - size2))
+    total = sum(size1 - size2 for _, size1, size2 in saved)
+    return text + "' optimizing saved {} bytes\n".format(hex(total))
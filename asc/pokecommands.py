@@ -57,6 +57,19 @@ def make_tables(fn):
 
     pkcommands = pkcommands_and_aliases
     return pkcommands, dec_pkcommands, end_cmds
-pkcommands, dec_pkcommands, end_pkcommands = make_tables("commands.txt")
-aicommands, dec_aicommands, end_aicommands = make_tables("aicommands.txt")
+
+# The tables are only built the first time they are used, so starting
+# up doesn't pay for the ones we don't need
+TABLES = {
+    "commands.txt": ("pkcommands", "dec_pkcommands", "end_pkcommands"),
+    "aicommands.txt": ("aicommands", "dec_aicommands", "end_aicommands"),
+}
+
+def __getattr__(name):
+    for fn, names in TABLES.items():
+        if name in names:
+            globals().update(zip(names, make_tables(fn)))
+            return globals()[name]
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__,
+                                                                    name))
 
@@ -9,15 +9,41 @@ def remove_comments(text):
                       for s in text.split("\n")])
     return text
 
+def path_resolver(include_path):
+    ''' Include resolver that looks for files in the include_path
+        directories '''
+    def resolve(name):
+        for d in include_path:
+            fname = os.path.join(d, name)
+            if os.path.isfile(fname):
+                with open(fname) as f:
+                    return f.read()
+        return None
+    return resolve
+
+def cached_resolver(include_path, cache):
+    ''' path_resolver that reads every file only once, cache being a
+        {file name: text} dict that can be shared between resolvers '''
+    def resolve(name):
+        for d in include_path:
+            fname = os.path.join(d, name)
+            if fname not in cache and os.path.isfile(fname):
+                with open(fname) as f:
+                    cache[fname] = f.read()
+            if fname in cache:
+                return cache[fname]
+        return None
+    return resolve
+
 def do_include(lines, line_n, name, include_path):
+    ''' include_path is either a list of directories or a resolver:
+        a function that takes the #include'd name and returns its
+        text, or None if it doesn't exist '''
     name = name.strip("<>\"")
-    t = None
-    for d in include_path:
-        fname = os.path.join(d, name)
-        if os.path.isfile(fname):
-            with open(fname) as f:
-                t = f.read()
-            break
+    if callable(include_path):
+        t = include_path(name)
+    else:
+        t = path_resolver(include_path)(name)
     if t is None:
         raise FileNotFoundError("#include'd file {} not found".format(name))
     lines = lines[:line_n] + t.split('\n') + lines[line_n+1:]
@@ -86,7 +112,7 @@ def preprocess(text_script, include_path, symbols=None):
 
         elif "#if" in command:
             name = words[1]
-            parse_if(command, name, list(zip(*symbols))[0], lines, line_n)
+            parse_if(command, name, [s[0] for s in symbols], lines, line_n)
         else:
             # Replace #define'd symbols
             for name, value in symbols:
@@ -100,3 +126,10 @@ def preprocess(text_script, include_path, symbols=None):
             lines[line_n] = line
             line_n += 1
     return '\n'.join(lines)
+
+def get_defines(text_script, include_path):
+    ''' Preprocess a script and return the (name, value) pairs it
+        #define's (including the ones in #include'd files) '''
+    symbols = []
+    preprocess(text_script, include_path, symbols)
+    return symbols
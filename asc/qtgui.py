@@ -79,6 +79,8 @@ class Ui_MainWindow(object):
         self.actionInsert_String = QtWidgets.QAction(MainWindow)
         self.actionInsert_String.setShortcutContext(QtCore.Qt.ApplicationShortcut)
         self.actionInsert_String.setObjectName("actionInsert_String")
+        self.actionSearch_ROM = QtWidgets.QAction(MainWindow)
+        self.actionSearch_ROM.setObjectName("actionSearch_ROM")
         self.menuFile.addAction(self.actionNew)
         self.menuFile.addAction(self.actionOpen)
         self.menuFile.addSeparator()
@@ -102,6 +104,8 @@ class Ui_MainWindow(object):
         self.menuROM.addAction(self.actionDecompile)
         self.menuROM.addAction(self.actionCompile)
         self.menuROM.addAction(self.actionDebug)
+        self.menuROM.addSeparator()
+        self.menuROM.addAction(self.actionSearch_ROM)
         self.menuHelp.addAction(self.actionAbout)
         self.menubar.addAction(self.menuFile.menuAction())
         self.menubar.addAction(self.menuEdit.menuAction())
@@ -138,5 +142,6 @@ class Ui_MainWindow(object):
         self.actionFind.setShortcut(_translate("MainWindow", "Ctrl+F"))
         self.actionInsert_String.setText(_translate("MainWindow", "Insert String"))
         self.actionInsert_String.setShortcut(_translate("MainWindow", "Ctrl+B"))
+        self.actionSearch_ROM.setText(_translate("MainWindow", "Search Text"))
 
 from PyQt5 import Qsci
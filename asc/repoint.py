@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Red Alien.
+
+#    Red Alien is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    Red Alien is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with Red Alien.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Repointing: find the pointers to things that moved and make them
+    point to the new place '''
+
+from . import romtext
+from .patch import chunk_offset
+
+def parse_mapping(pairs):
+    ''' ["OLD:NEW", ...] (hex) -> {old offset: new offset} '''
+    mapping = {}
+    for pair in pairs:
+        try:
+            old, new = pair.split(":")
+            mapping[chunk_offset(int(old, 16))] = chunk_offset(int(new, 16))
+        except ValueError:
+            raise Exception("ERROR: bad repoint " + repr(pair) +
+                            ", it should be OLD:NEW")
+    return mapping
+
+def read_mapping(fn):
+    ''' A file with "OLD NEW" lines (hex), // starts a comment '''
+    with open(fn) as f:
+        return parse_mapping(":".join(line.split()) for line in f
+                             if line.strip() and not line.startswith("//"))
+
+def find_references(rom, old_offsets, script_pointers=(), aligned=True):
+    ''' Every pointer to one of old_offsets: the ones found scanning
+        the whole ROM in one pass (only 4-byte aligned ones, which is
+        where pointers in data tables are, unless aligned is False),
+        plus the ones in script_pointers, (pointer offset, target)
+        pairs that the decompiler found.
+        Returns a sorted list of (pointer offset, old offset, "data" or
+        "script"). '''
+    old_offsets = set(old_offsets)
+    refs = {}
+    for target, positions in romtext.find_pointers(rom, old_offsets).items():
+        for pos in positions:
+            if not aligned or pos % 4 == 0:
+                refs[pos] = (target, "data")
+    for pos, target in script_pointers:
+        target = chunk_offset(target)
+        if target in old_offsets:
+            refs[pos] = (target, "script")
+    return sorted((pos, old, source) for pos, (old, source) in refs.items())
+
+def repoint_chunks(refs, mapping):
+    ''' The chunks that fix every reference, to be written in one go '''
+    return [[hex(pos), romtext.pointer_bytes(mapping[old])]
+            for pos, old, _ in refs]
+
+def write_listing(refs, mapping, f):
+    for pos, old, source in refs:
+        f.write("{} {} -> {} ({})\n".format(hex(pos), hex(old),
+                                            hex(mapping[old]), source))
+    missing = set(mapping) - {old for _, old, _ in refs}
+    for old in sorted(missing):
+        f.write("' nothing points to {}\n".format(hex(old)))
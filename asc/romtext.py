@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Red Alien.
+
+#    Red Alien is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    Red Alien is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with Red Alien.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Finding the text in a ROM '''
+
+import re
+from functools import lru_cache
+from . import text_translate
+
+TERMINATOR = 0xFF
+# Bytes that take the next one as an argument (\c and \v)
+ESCAPES = (0xFC, 0xFD)
+SPACE = 0x00
+MIN_LENGTH = 4
+
+def byte_class(values):
+    return b"[" + b"".join(re.escape(bytes((n,))) for n in values) + b"]"
+
+@lru_cache(maxsize=None)
+def run_re(min_length=1):
+    ''' Matches maximal runs of at least min_length characters that
+        decode to text. Nothing follows the run in the pattern, so the
+        regex engine never backtracks over a whole run and the scan
+        stays linear. '''
+    valid = [n for n in text_translate.get_decode_table()
+             if n != TERMINATOR and n not in ESCAPES]
+    return re.compile(b"(?:" + byte_class(valid) + b"|" +
+                      byte_class(ESCAPES) + b"[\\x00-\\xff])" +
+                      b"{" + str(max(min_length, 1)).encode() + b",}")
+
+def find_strings(rom, min_length=MIN_LENGTH, start=0, end=None):
+    ''' Find the candidate strings in rom (bytes or an mmap): runs of
+        at least min_length characters in the text table, followed by 0xFF
+        and not just spaces. Yields (offset, bytes without the 0xFF). '''
+    if end is None:
+        end = len(rom)
+    for m in run_re(min_length).finditer(rom, start, end):
+        run_end = m.end()
+        if run_end < len(rom) and rom[run_end] == TERMINATOR:
+            data = m.group()
+            if data.count(SPACE) != len(data):
+                yield m.start(), data
+
+def extract_strings(rom, min_length=MIN_LENGTH, start=0, end=None):
+    ''' Every candidate string in rom, as a list of (offset, text) '''
+    return [(offset, text_translate.hex_to_ascii(data))
+            for offset, data in find_strings(rom, min_length, start, end)]
+
+def write_strings(strings, f):
+    ''' Write (offset, text) pairs, one "0xoffset<tab>text" per line.
+        Text never has tabs or newlines, they'd be escapes. '''
+    for offset, text in strings:
+        f.write(hex(offset) + "\t" + text + "\n")
+
+# Query wildcards: one character, or any run of them (within a string)
+WILDCARDS = {"\\?": b"[^\\xff]", "\\*": b"[^\\xff]*?"}
+WILDCARD_RE = re.compile(r"(\\\?|\\\*)")
+POINTER_BASE = 0x8000000
+
+def encode_query(query):
+    ''' Encode a query with the text table (\\h escapes work too).
+        Returns the encoded bytes, or a regex (bytes) if it has
+        wildcards. '''
+    parts = WILDCARD_RE.split(query)
+    if len(parts) == 1:
+        encoded = text_translate.ascii_to_hex(query)
+        if not encoded:
+            raise Exception("ERROR: empty search query: " + repr(query))
+        return encoded, False
+    pattern = b"".join(WILDCARDS[part] if i % 2 else
+                       re.escape(text_translate.ascii_to_hex(part))
+                       for i, part in enumerate(parts))
+    return pattern, True
+
+def make_trie(patterns):
+    trie = {}
+    for pattern in patterns:
+        node = trie
+        for byte in pattern:
+            node = node.setdefault(byte, {})
+        node[None] = True
+    return trie
+
+def trie_pattern(node):
+    ''' A regex matching the longest of the patterns in the trie.
+        Every branch starts with a literal byte, which the regex
+        engine checks before trying the branch, so matching at a
+        position costs about the length of the match, no matter how
+        many patterns there are. '''
+    alternatives = [re.escape(bytes((byte,))) + trie_pattern(node[byte])
+                    for byte in sorted(k for k in node if k is not None)]
+    if None in node:
+        alternatives.append(b"")
+    if len(alternatives) == 1:
+        return alternatives[0]
+    return b"(?:" + b"|".join(alternatives) + b")"
+
+def find_patterns(rom, literals=(), regexes=(), start=0, end=None):
+    ''' Find every occurrence of every pattern in one pass over rom.
+        literals are bytes, regexes compiled bytes regexes. Matches may
+        overlap. Returns a sorted list of (offset, pattern). '''
+    if end is None:
+        end = len(rom)
+    literals = set(literals)
+    alternatives = [r.pattern for r in regexes]
+    if literals:
+        trie_re = re.compile(trie_pattern(make_trie(literals)), re.DOTALL)
+        alternatives.insert(0, trie_re.pattern)
+        # The trie only gives the longest match at a position, the
+        # patterns that are a prefix of it match there too
+        prefixes = {p: [q for q in literals if p.startswith(q)]
+                    for p in literals}
+    if not alternatives:
+        return []
+    # Only finds where something matches, then every matcher is tried
+    # there
+    any_re = re.compile(b"|".join(b"(?:" + a + b")" for a in alternatives),
+                        re.DOTALL)
+    hits = []
+    pos = start
+    while True:
+        m = any_re.search(rom, pos, end)
+        if m is None:
+            break
+        pos = m.start()
+        if literals:
+            lm = trie_re.match(rom, pos, end)
+            if lm:
+                hits += [(pos, p) for p in prefixes[lm.group()]]
+        for r in regexes:
+            if r.match(rom, pos, end):
+                hits.append((pos, r))
+        pos += 1
+    return hits
+
+def pointer_bytes(offset):
+    return (offset | POINTER_BASE).to_bytes(4, "little")
+
+# The last byte of a pointer to a (up to 32 MB) ROM
+POINTER_HIGH_RE = re.compile(b"[\\x08\\x09]")
+
+def find_pointers(rom, targets, start=0, end=None):
+    ''' Find the pointers to any of targets (ROM offsets) in one pass.
+        Pointers are found by their last byte, so this takes the same
+        time for one target or for thousands. Returns {target: [pointer
+        offsets]}, for the targets that have any. '''
+    if end is None:
+        end = len(rom)
+    wanted = {pointer_bytes(target): target for target in targets}
+    found = {}
+    for m in POINTER_HIGH_RE.finditer(rom, start + 3, end):
+        pos = m.start() - 3
+        pointer = rom[pos:pos + 4]
+        if pointer in wanted:
+            found.setdefault(wanted[pointer], []).append(pos)
+    return found
+
+def search(rom, queries, references=True, start=0, end=None):
+    ''' Look for every query (script text, see encode_query) in one
+        pass over rom. Returns a list of (offset, query, references),
+        references being the offsets of the pointers to the hit
+        (another pass, for all of them at once), sorted by offset. '''
+    literals = {}
+    regexes = {}
+    for query in queries:
+        pattern, is_regex = encode_query(query)
+        if is_regex:
+            regexes[re.compile(pattern, re.DOTALL)] = query
+        else:
+            literals.setdefault(pattern, []).append(query)
+    found = find_patterns(rom, literals, regexes, start, end)
+    hits = []
+    for offset, pattern in found:
+        if pattern in regexes:
+            hits.append((offset, regexes[pattern]))
+        else:
+            hits += [(offset, query) for query in literals[pattern]]
+    refs = {}
+    if references and hits:
+        refs = find_pointers(rom, {offset for offset, _ in hits})
+    return [(offset, query, refs.get(offset, [])) for offset, query in hits]
+
+def write_hits(hits, f):
+    ''' One "0xoffset<tab>query<tab>0xref,0xref..." line per hit '''
+    for offset, query, refs in hits:
+        f.write(hex(offset) + "\t" + query + "\t" +
+                ",".join(hex(r) for r in refs) + "\n")
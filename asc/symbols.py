@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Red Alien.
+
+#    Red Alien is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    Red Alien is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with Red Alien.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Reverse index of the stdlib #define's, so the decompiler can write
+    names (ITEM_POKEBALL, MSG_NORMAL...) instead of numbers. '''
+
+from functools import lru_cache
+from . import pokecommands as pk
+from .preprocessor import get_defines
+
+# Role of an argument, from its description in the command table
+ARG_ROLES = {
+    "flag": "flag",
+    "var": "var",
+    "item": "item",
+    "itm": "item",
+    "item?": "item",
+    "poke": "pokemon",
+    "atk": "attack",
+    "attk": "attack",
+    "minisprite": "sprite",
+}
+# Where the description is too vague (or wrong), by (command, argument)
+COMMAND_ROLES = {
+    ("jumpstd", 0): "msgtype",
+    ("callstd", 0): "msgtype",
+    ("fakejumpstd", 0): "msgtype",
+    ("fakecallstd", 0): "msgtype",
+    ("special", 0): "special",
+    ("special2", 1): "special",
+    # Trainer IDs, not flags
+    ("checktrainerflag", 0): None,
+    ("cleartrainerflag", 0): None,
+    ("settrainerflag", 0): None,
+    # 1 byte, so it can't be one of the std.rbh vars
+    ("comparehiddenvar", 0): None,
+}
+# The #define's each role takes its names from: (file, name prefixes).
+# For flags, the prefix is the game's ("FR_BADGE1").
+ROLE_DEFINES = {
+    "flag": ("std.rbh", None),
+    "var": ("std.rbh", ("LASTRESULT", "LASTTALKED", "PLAYERFACING")),
+    "msgtype": ("std.rbh", ("MSG_",)),
+    "special": ("std.rbh", ("SP_",)),
+    "sprite": ("std.rbh", ("MOVE_",)),
+    "item": ("stditems.rbh", ("ITEM_",)),
+    "pokemon": ("stdpoke.rbh", ("PKMN_",)),
+    "attack": ("stdattacks.rbh", ("ATK_",)),
+}
+STDLIB_DIR = "stdlib/"
+
+def arg_role(command, n, desc):
+    if (command, n) in COMMAND_ROLES:
+        return COMMAND_ROLES[(command, n)]
+    return ARG_ROLES.get(desc)
+
+@lru_cache(maxsize=None)
+def role_names(data_path, game):
+    ''' {role: {value: name}}. The first name #define'd for a value
+        wins. '''
+    names = {}
+    defines = {}
+    for role, (fn, prefixes) in ROLE_DEFINES.items():
+        if prefixes is None:
+            if game is None:
+                continue
+            prefixes = (game + "_",)
+        if fn not in defines:
+            text = "#include \"{}{}\"".format(STDLIB_DIR, fn)
+            if game is not None:
+                text = "#define {}\n".format(game) + text
+            defines[fn] = get_defines(text, (data_path,))
+        table = {}
+        for name, value in defines[fn]:
+            if name.startswith(prefixes):
+                try:
+                    table.setdefault(int(value, 16), name)
+                except ValueError:
+                    continue
+        names[role] = table
+    return names
+
+@lru_cache(maxsize=None)
+def symbol_index(data_path, game=None):
+    ''' The reverse index for the script command table: for every
+        command with named arguments, a tuple of (argument number,
+        {value: name}). Built once per game. '''
+    names = role_names(data_path, game)
+    index = {}
+    for command, data in pk.pkcommands.items():
+        if "args" not in data:
+            continue
+        descs = [d.strip() for d in data["args"][0].split(",")]
+        tables = []
+        for n in range(len(data["args"][1])):
+            desc = descs[n] if n < len(descs) else ""
+            table = names.get(arg_role(command, n, desc))
+            if table:
+                tables.append((n, table))
+        if tables:
+            index[command] = tuple(tables)
+    return index
+
+@lru_cache(maxsize=None)
+def name_files(data_path, game=None):
+    ''' The stdlib file every name in the index comes from, as
+        #include'd ("stdlib/std.rbh") '''
+    files = {}
+    for role, table in role_names(data_path, game).items():
+        fn = STDLIB_DIR + ROLE_DEFINES[role][0]
+        for name in table.values():
+            files[name] = fn
+    return files
@@ -16,11 +16,10 @@
 #    You should have received a copy of the GNU General Public License
 #    along with ASC.  If not, see <http://www.gnu.org/licenses/>.
 
-import string
 from string import hexdigits
 import sys
 import os
-import pkgutil
+from functools import lru_cache
 
 # windows builds are frozen
 if getattr(sys, 'frozen', False):
@@ -28,10 +27,29 @@ if getattr(sys, 'frozen', False):
 else:
     data_path = os.path.join(os.path.dirname(__file__), "data")
 
-with open(os.path.join(data_path, "pktext.tbl"), encoding="utf8") as f:
-    table_str = f.read().rstrip("\n")
-
-def read_table_encode(table_string=table_str):
+@lru_cache(maxsize=None)
+def get_table_str():
+    ''' pktext.tbl contents, read the first time they are needed '''
+    with open(os.path.join(data_path, "pktext.tbl"), encoding="utf8") as f:
+        return f.read().rstrip("\n")
+
+def __getattr__(name):
+    if name == "table_str":
+        return get_table_str()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__,
+                                                                    name))
+
+@lru_cache(maxsize=None)
+def get_encode_table():
+    return read_table_encode(get_table_str())
+
+@lru_cache(maxsize=None)
+def get_decode_table():
+    return read_table_decode(get_table_str())
+
+def read_table_encode(table_string=None):
+    if table_string is None:
+        table_string = get_table_str()
     table = table_string.split("\n")
     dictionary = {}
     for line in table:
@@ -40,7 +58,9 @@ def read_table_encode(table_string=table_str):
     return dictionary
 
 
-def read_table_decode(table_string=table_str):
+def read_table_decode(table_string=None):
+    if table_string is None:
+        table_string = get_table_str()
     table = table_string.split("\n")
     dictionary = {}
     for line in table:
@@ -49,7 +69,9 @@ def read_table_decode(table_string=table_str):
     return dictionary
 
 
-def ascii_to_hex(astring, dictionary=read_table_encode(table_str)):
+def ascii_to_hex(astring, dictionary=None):
+    if dictionary is None:
+        dictionary = get_encode_table()
     trans_string = b''
     i = 0
     while i < len(astring):
@@ -77,15 +99,20 @@ def ascii_to_hex(astring, dictionary=read_table_encode(table_str)):
     return trans_string
 
 
-def hex_to_ascii(string, dictionary=read_table_decode(table_str)):
-    trans_string = ''
-    for i in range(len(string)):
-        pos = i
-        byte = string[pos]
-        if byte in dictionary:
-            trans_string += dictionary[byte]
-        else:
-            trans_string += "\\h" + hex(byte)[2:]
-    return trans_string
+def decode_chars(dictionary):
+    ''' What every byte value decodes to '''
+    return tuple(dictionary[byte] if byte in dictionary
+                 else "\\h" + hex(byte)[2:] for byte in range(256))
+
+@lru_cache(maxsize=None)
+def get_decode_chars():
+    return decode_chars(get_decode_table())
+
+def hex_to_ascii(string, dictionary=None):
+    if dictionary is None:
+        chars = get_decode_chars()
+    else:
+        chars = decode_chars(dictionary)
+    return "".join([chars[byte] for byte in string])
 
 
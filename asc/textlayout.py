@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Red Alien.
+
+#    Red Alien is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    Red Alien is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with Red Alien.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Text box layout: glyph widths, word wrapping and overflow checks '''
+
+import re
+from functools import lru_cache
+from . import text_translate
+
+MAX_WIDTH = 35 * 6 # px in a text box line
+DEFAULT_WIDTH = 6
+
+# Glyphs that aren't DEFAULT_WIDTH px wide. We only have measurements
+# for the normal dialogue font, which is shared by RS, FR and EM.
+#"0-9", "..", "A-Z", "a-h", "s-z", "m-q", "€", '"' (both), "k", "/",
+#"male", "female": 6
+FONTS = {
+    "normal": {
+        "!": 3,
+        "?": 6,
+        ".": 3,
+        #":": 5,
+        "·": 3,
+        "'": 3,
+        ",": 3,
+        "i": 4,
+        "j": 5,
+        "l": 3,
+        "r": 5,
+        ":": 3,
+        "↑": 7,
+        "→": 7,
+        "↓": 7,
+        "←": 7,
+        "+": 7,
+        " ": 3,
+    },
+}
+GAME_FONTS = {"RS": "normal", "FR": "normal", "EM": "normal"}
+
+# \n goes to the second line of the box, \p to a new box, and \l
+# scrolls. \c and \v take a byte argument and print nothing themselves
+# (or something we can't know about, like the player's name).
+LINE_BREAKS = ("\\n", "\\l")
+BOX_BREAK = "\\p"
+BREAKS = LINE_BREAKS + (BOX_BREAK,)
+
+@lru_cache(maxsize=None)
+def glyph_widths(game=None, font="normal"):
+    ''' Width of every glyph in the text table, for the given game's
+        font. Built once. '''
+    if game is not None:
+        font = GAME_FONTS[game]
+    kernings = FONTS[font]
+    widths = {}
+    for glyph in text_translate.get_encode_table():
+        if glyph.startswith("\\"):
+            widths[glyph] = 0
+        else:
+            widths[glyph] = kernings.get(glyph, DEFAULT_WIDTH)
+    return widths
+
+@lru_cache(maxsize=None)
+def glyph_re():
+    ''' Splits text into glyphs: escapes, the multi-character names in
+        the table ([pk], >>...) and single characters '''
+    multi = sorted((g for g in text_translate.get_encode_table()
+                    if len(g) > 1 and not g.startswith("\\")),
+                   key=len, reverse=True)
+    return re.compile(r"\\[cv]\\h[0-9a-fA-F]{2}|\\h[0-9a-fA-F]{2}|\\.|" +
+                      "".join(re.escape(g) + "|" for g in multi) + ".",
+                      re.DOTALL)
+
+def glyph_width(glyph, widths):
+    if glyph in widths:
+        return widths[glyph]
+    if glyph.startswith("\\h"):
+        return DEFAULT_WIDTH
+    if glyph.startswith("\\"):
+        return 0
+    return DEFAULT_WIDTH
+
+def text_len(text, game=None):
+    ''' Width in px of a piece of text with no line breaks '''
+    widths = glyph_widths(game)
+    return sum(glyph_width(g, widths) for g in glyph_re().findall(text))
+
+def split_lines(text):
+    ''' Split text at \\n, \\l and \\p. Returns a list of
+        (line, delimiter after it) '''
+    lines = []
+    line = []
+    for glyph in glyph_re().findall(text):
+        if glyph in BREAKS:
+            lines.append(("".join(line), glyph))
+            line = []
+        else:
+            line.append(glyph)
+    lines.append(("".join(line), ""))
+    return lines
+
+def wrap(words, max_width=MAX_WIDTH, game=None):
+    ''' Greedy word wrap. Every word is measured once, so this is
+        linear in the length of the text. Returns a list of lines. '''
+    space = text_len(" ", game)
+    lines = []
+    line = []
+    width = 0
+    for word in words:
+        word_width = text_len(word, game)
+        if line and width + word_width >= max_width:
+            lines.append(" ".join(line))
+            line = []
+            width = 0
+        line.append(word)
+        width += word_width + space
+    lines.append(" ".join(line))
+    return lines
+
+def reflow(text, max_width=MAX_WIDTH, game=None, keep_breaks=True):
+    ''' Rewrap text so it fits in the text box. The new breaks alternate
+        \\n and \\p (two lines per box), and existing \\p's still start a
+        new box. Existing \\n's and \\l's stay where they are, or with
+        keep_breaks=False they're replaced too. '''
+    paragraphs = []
+    for paragraph in text.split(BOX_BREAK):
+        if not keep_breaks:
+            for line_break in LINE_BREAKS:
+                paragraph = paragraph.replace(line_break, " ")
+        out = ""
+        # Which line of the box we're in
+        row = 0
+        for line, delim in split_lines(paragraph):
+            words = [w for w in line.split(" ") if w]
+            lines = wrap(words, max_width, game)
+            out += lines[0]
+            for wrapped in lines[1:]:
+                out += ("\\n", "\\p")[row] + wrapped
+                row = 1 - row
+            out += delim
+            if delim:
+                row = 1
+        paragraphs.append(out)
+    return BOX_BREAK.join(paragraphs)
+
+def overflows(text, max_width=MAX_WIDTH, game=None):
+    ''' Lines in text that don't fit in the box, as a list of
+        (line number, width, line) '''
+    return [(n, text_len(line, game), line)
+            for n, (line, _) in enumerate(split_lines(text))
+            if text_len(line, game) > max_width]
+
+def text_runs(lines):
+    ''' Find the strings in a script: runs of consecutive = lines.
+        Yields (first line index, last line index + 1, joined text) '''
+    start = None
+    for i, line in enumerate(lines + [""]):
+        is_text = line.lstrip().startswith("=")
+        if is_text and start is None:
+            start = i
+        elif not is_text and start is not None:
+            text = "".join(l.lstrip()[2:] for l in lines[start:i])
+            yield start, i, text
+            start = None
+
+def reflow_script(text_script, max_width=MAX_WIDTH, game=None, check=False,
+                  keep_breaks=True):
+    ''' Reflow every = string in a script in one pass, writing every
+        line of the result on its own = line (see reflow for
+        keep_breaks). With check=True the script is left as is. Returns
+        the script and a list of (script line number, width, line) for
+        the lines that (still) overflow. When checking, the line number
+        is the one where the string starts. '''
+    lines = text_script.split("\n")
+    out = []
+    report = []
+    last = 0
+    for start, end, text in text_runs(lines):
+        out += lines[last:start]
+        if not check:
+            text = reflow(text, max_width, game, keep_breaks)
+            new_lines = ["= " + line + delim
+                         for line, delim in split_lines(text)]
+            # Keep the line numbers we report pointing at the output
+            line_n = len(out)
+            out += new_lines
+        else:
+            out += lines[start:end]
+        for n, width, line in overflows(text, max_width, game):
+            report.append((line_n + n + 1 if not check else start + 1,
+                           width, line))
+        last = end
+    out += lines[last:]
+    return "\n".join(out), report
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Red Alien.
+
+#    Red Alien is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    Red Alien is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with Red Alien.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Flag and var usage index: which scripts read or write every flag
+    and var, from the decompiled scripts, saved to a file so questions
+    like "what flags are free from 0x200 to 0x2FF" or "who writes
+    0x4001" don't need a crawl of the ROM every time.
+
+    The index is a dict:
+        {"rom": hash of the ROM, "stat": [size, mtime] of the ROM file,
+         "roots": [script offsets the crawl started from], "scripts": how
+         many scripts were read,
+         "flag": {flag: {"read": [script offsets], "write": [...]}},
+         "var": {var: {...}}} '''
+
+import hashlib
+import json
+import os
+from . import pokecommands as pk
+from .symbols import arg_role
+
+KINDS = ("flag", "var")
+ACCESSES = ("read", "write")
+# The arguments that are written, everything else is read
+WRITES = {
+    "setvar": (0,),
+    "addvar": (0,),
+    "subtractvar": (0,),
+    "copyvar": (0,),
+    "copyvarifnotzero": (0,),
+    "special2": (0,),
+    "getplayerxy": (0, 1),
+    "coincasetovar": (0,),
+    "setflag": (0,),
+    "clearflag": (0,),
+    "setworldmapflag": (0,),
+}
+# Written after reading them
+READ_WRITES = {"addvar": (0,), "subtractvar": (0,)}
+# Vars the description in the command table doesn't call var
+MORE_VARS = {("comparevars", 1)}
+# Lower numbers aren't vars, the game takes them as values
+MIN_VAR = 0x4000
+
+def operand_accesses(cmd_table=None):
+    ''' {command: [(argument number, "flag" or "var", ("read",
+        "write"...))]} for the commands that take flags or vars '''
+    if cmd_table is None:
+        cmd_table = pk.pkcommands
+    accesses = {}
+    for command, data in cmd_table.items():
+        if "args" not in data:
+            continue
+        descs = [d.strip() for d in data["args"][0].split(",")]
+        for n in range(len(data["args"][1])):
+            desc = descs[n] if n < len(descs) else ""
+            kind = arg_role(command, n, desc)
+            if (command, n) in MORE_VARS:
+                kind = "var"
+            if kind not in KINDS:
+                continue
+            if n in READ_WRITES.get(command, ()):
+                access = ACCESSES
+            elif n in WRITES.get(command, ()):
+                access = ("write",)
+            else:
+                access = ("read",)
+            accesses.setdefault(command, []).append((n, kind, access))
+    return accesses
+
+def rom_hash(rom):
+    return hashlib.sha1(rom).hexdigest()
+
+def rom_stat(fn):
+    ''' [size, mtime] of the ROM file, to know it didn't change without
+        hashing it '''
+    stat = os.stat(fn)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def build_index(records, roots, rom, cmd_table=None, stat=None):
+    ''' The index, from the script records of decompile_records (a crawl
+        from roots) of rom (bytes or mmap), stat being its rom_stat '''
+    accesses = operand_accesses(cmd_table)
+    index = {"rom": rom_hash(rom), "stat": stat, "roots": sorted(set(roots)),
+             "scripts": 0, "flag": {}, "var": {}}
+    for record in records:
+        if record["type"] != "script":
+            continue
+        index["scripts"] += 1
+        script = record["offset"]
+        for ins in record["instructions"]:
+            for n, kind, access in accesses.get(ins["mnemonic"], ()):
+                value = ins["operands"][n]
+                if kind == "var" and value < MIN_VAR:
+                    continue
+                users = index[kind].setdefault(value, {"read": set(),
+                                                       "write": set()})
+                for a in access:
+                    users[a].add(script)
+    for kind in KINDS:
+        for users in index[kind].values():
+            for a in ACCESSES:
+                users[a] = sorted(users[a])
+    return index
+
+def is_current(index, rom, roots=(), stat=None):
+    ''' Whether index is for rom as it is now, and for the same roots (if
+        any are given). With the rom_stat of the file, rom is only hashed
+        when its size or mtime changed, and if it's the same ROM anyway
+        the index gets the new ones. '''
+    if roots and sorted(set(roots)) != index["roots"]:
+        return False
+    if stat is not None and index.get("stat") == stat:
+        return True
+    if index["rom"] != rom_hash(rom):
+        return False
+    if stat is not None:
+        index["stat"] = stat
+    return True
+
+def write_index(index, fn):
+    data = dict(index)
+    for kind in KINDS:
+        data[kind] = {hex(value): users
+                      for value, users in sorted(index[kind].items())}
+    with open(fn, "w") as f:
+        json.dump(data, f)
+
+def read_index(fn):
+    try:
+        with open(fn) as f:
+            index = json.load(f)
+        for kind in KINDS:
+            index[kind] = {int(value, 16): users
+                           for value, users in index[kind].items()}
+    except (ValueError, KeyError, AttributeError):
+        raise Exception("ERROR: " + fn + " is not a usage index")
+    return index
+
+def users(index, kind, value, access=None):
+    ''' The scripts that read and write (or only access) value, sorted,
+        as (script, access) '''
+    found = index[kind].get(value, {})
+    return sorted((script, a) for a in ACCESSES if access in (None, a)
+                  for script in found.get(a, ()))
+
+def free(index, kind, low, high):
+    ''' The (first, last) runs of values from low to high (both in) that
+        no script uses '''
+    runs = []
+    for value in range(low, high + 1):
+        if value in index[kind]:
+            continue
+        if runs and runs[-1][1] == value - 1:
+            runs[-1][1] = value
+        else:
+            runs.append([value, value])
+    return [tuple(run) for run in runs]
+
+def parse_range(text):
+    ''' "LOW:HIGH" (hex) -> (low, high) '''
+    try:
+        low, high = text.split(":")
+        return int(low, 16), int(high, 16)
+    except ValueError:
+        raise Exception("ERROR: bad range " + repr(text) + ", it should be "
+                        "LOW:HIGH")
+
+def write_users(kind, value, found, f):
+    if not found:
+        f.write("' no script uses {} {}\n".format(kind, hex(value)))
+    for script, access in found:
+        f.write("{} {} {} {}\n".format(kind, hex(value), access, hex(script)))
+
+def write_free(kind, runs, f):
+    for first, last in runs:
+        if first == last:
+            f.write("free {} {}\n".format(kind, hex(first)))
+        else:
+            f.write("free {} {}-{} ({})\n".format(kind, hex(first),
+                                                  hex(last),
+                                                  last - first + 1))
@@ -0,0 +1,62 @@
+import random
+import pytest
+from asc import alloc
+
+def check(lengths, runs, offsets, margin=alloc.MARGIN, gap=alloc.GAP):
+    ''' Every chunk is in a run, after the margin, and the chunks in the
+        same run are gap + margin bytes apart '''
+    placed = sorted((offset, offset + length)
+                    for offset, length in zip(offsets, lengths))
+    run_of = []
+    for start, end in placed:
+        found = [n for n, (run_start, run_end) in enumerate(runs)
+                 if run_start + margin <= start and end <= run_end]
+        assert len(found) == 1
+        run_of.append(found[0])
+    for n in range(len(placed) - 1):
+        assert placed[n][1] <= placed[n + 1][0]
+        if run_of[n] == run_of[n + 1]:
+            assert placed[n][1] + gap + margin <= placed[n + 1][0]
+
+def test_pack_never_overlaps():
+    rng = random.Random(1)
+    for _ in range(200):
+        runs = []
+        offset = 0
+        for _ in range(rng.randint(1, 8)):
+            offset += rng.randint(1, 0x40)
+            runs.append((offset, offset + rng.randint(1, 0x100)))
+            offset = runs[-1][1]
+        lengths = [rng.randint(1, 0x30) for _ in range(rng.randint(1, 10))]
+        align = rng.choice((1, 2, 4))
+        try:
+            offsets, stats = alloc.pack(lengths, runs, align)
+        except Exception:
+            continue
+        check(lengths, runs, offsets)
+        assert all(offset % align == 0 for offset in offsets)
+        assert stats["bytes"] == sum(lengths)
+
+def test_pack_best_fit():
+    runs = [(0x100, 0x200), (0x300, 0x310)]
+    offsets, _ = alloc.pack([0x8, 0x40], runs)
+    # The small chunk goes in the small run, the big one in the other
+    assert offsets == [0x302, 0x102]
+
+def test_pack_no_space():
+    with pytest.raises(Exception):
+        alloc.pack([0x20], [(0, 0x10)])
+
+def test_place_uses_short_runs():
+    rom = bytes(0x10) + b"\xff" * 8 + bytes(0x10) + b"\xff" * 0x40
+    offsets, _ = alloc.place([4, 0x20], rom, 0)
+    assert offsets == [0x12, 0x2A]
+
+def test_place_at_start_needs_no_margin():
+    rom = b"\xff" * 4 + bytes(4) + b"\xff" * 0x40
+    offsets, _ = alloc.place([4], rom, 0)
+    assert offsets == [0]
+
+def test_duplicates():
+    same, saved = alloc.duplicates([b"ab", None, b"cd", b"ab", None, b"ab"])
+    assert same == [0, 1, 2, 0, 4, 0] and saved == 4
@@ -0,0 +1,41 @@
+from asc import asc
+
+asc.QUIET = True
+
+def make_rom():
+    rom = bytearray(b"\xff" * 0x1000)
+    rom[0xAC:0xB0] = b"BPRE"
+    return bytes(rom)
+
+def test_compile_script():
+    chunks, log, diagnostics = asc.compile_script(
+        "#dyn 0x800\n#org @main\nmsgbox @text 0x6\nend\n#org @text\n= Hi\n",
+        make_rom())
+    assert not diagnostics
+    offsets = dict(line.split(" - ") for line in log.split("\n")
+                   if " - " in line)
+    assert sorted(offsets) == ["@main", "@text"]
+    assert [addr for addr, _ in chunks] == [offsets["@main"],
+                                            offsets["@text"]]
+
+def test_errors_give_no_chunks():
+    chunks, _, diagnostics = asc.compile_script("#org 0x100\nnotacommand\n",
+                                                make_rom())
+    assert chunks == [] and [level for level, _ in diagnostics] == ["error"]
+    chunks, _, diagnostics = asc.compile_script(
+        "#org 0x100\nsetflag 0x200\n#org 0x102\nsetflag 0x200\n", make_rom())
+    assert chunks == [] and [level for level, _ in diagnostics] == ["error"]
+
+def test_without_a_rom():
+    chunks, _, diagnostics = asc.compile_script("#org 0x100\nend\n")
+    assert chunks == [["0x100", b"\x02"]] and not diagnostics
+    _, _, diagnostics = asc.compile_script("#dyn 0x800\n#org @a\nend\n")
+    assert [level for level, _ in diagnostics] == ["warning"]
+
+def test_include_resolver():
+    files = {"mine.rbh": "#define MYFLAG 0x234\n"}
+    chunks, _, diagnostics = asc.compile_script(
+        '#include "mine.rbh"\n#org 0x100\nsetflag MYFLAG\n', make_rom(),
+        files.get)
+    assert not diagnostics
+    assert chunks == [["0x100", b"\x29\x34\x02"]]
@@ -0,0 +1,30 @@
+from asc import asc, completion
+from asc import pokecommands as pk
+from asc.preprocessor import get_defines
+
+def test_command_signature():
+    assert completion.command_signature(
+        "checkflag", pk.pkcommands["checkflag"]) == "checkflag flag[2]"
+    assert completion.command_signature("end", pk.pkcommands["end"]) == "end"
+
+def test_entries():
+    entries = completion.make_entries(asc.data_path)
+    assert "checkflag(flag[2])" in entries
+    assert "MSG_NORMAL" in entries
+    assert not any(entry[0] in "#=" for entry in entries)
+    assert len(entries) == len(set(entries))
+
+def test_index_is_cached(tmp_path):
+    path, entries, calltips = completion.build_index(asc.data_path,
+                                                     str(tmp_path))
+    assert entries and calltips["checkflag"] == "checkflag flag[2]"
+    open(path, "w").close()
+    assert completion.build_index(asc.data_path, str(tmp_path)) == (
+        path, None, calltips)
+
+def test_get_defines():
+    files = {"a.rbh": "#define A 0x1\n#include \"b.rbh\"\n",
+             "b.rbh": "#define B 0x2\n"}
+    assert get_defines('#include "a.rbh"\n#define C 0x3\n',
+                       files.get) == [("A", "0x1"), ("B", "0x2"),
+                                      ("C", "0x3")]
@@ -0,0 +1,96 @@
+import json
+from asc import asc
+
+asc.QUIET = True
+
+SCRIPT = '''#include "stdlib/std.rbh"
+#org 0x100
+lock
+msgbox 0x200 MSG_NORMAL
+setflag 0x200
+call 0x180
+release
+end
+#org 0x180
+return
+#org 0x200
+= Hi
+'''
+
+def build(text, rom):
+    chunks, _, diagnostics = asc.compile_script(text, bytes(rom))
+    assert not diagnostics
+    rom = bytearray(rom)
+    for addr, data in chunks:
+        rom[int(addr, 16):int(addr, 16) + len(data)] = data
+    return rom
+
+def clean_rom():
+    rom = bytearray(b"\xff" * 0x1000)
+    rom[0xAC:0xB0] = b"BPRE"
+    return rom
+
+def make_rom(tmp_path):
+    rom = build(SCRIPT, clean_rom())
+    fn = tmp_path / "rom.gba"
+    fn.write_bytes(rom)
+    return fn, rom
+
+def test_budgeted_text_decompile(tmp_path):
+    fn, _ = make_rom(tmp_path)
+    for budget in ({"max_instructions": 2}, {"max_bytes": 4}):
+        text = "".join(asc.iter_decompile(str(fn), 0x100, **budget))
+        assert "' Unexplored:" in text
+
+def test_names_round_trip(tmp_path):
+    fn, rom = make_rom(tmp_path)
+    text = "".join(asc.iter_decompile(str(fn), 0x100))
+    assert "callstd MSG_NORMAL" in text
+    assert build(text, clean_rom()) == rom
+
+def test_raw_ends_like_movements():
+    rom = bytes(0x100) + bytes((1, 2, 0xFE, 3, 0xFF))
+    for type_ in ("raw", "movs"):
+        record = next(asc.decompile_records(rom, 0x100, type_))
+        assert record["data"] == "0102fe"
+
+def test_records():
+    rom = bytes(build(SCRIPT, clean_rom()))
+    records = list(asc.decompile_records(rom, 0x100))
+    assert [(r["offset"], r["type"]) for r in records] == [
+        (0x100, "script"), (0x200, "text"), (0x180, "script")]
+    script = records[0]
+    assert [ins["mnemonic"] for ins in script["instructions"]] == [
+        "lock", "loadpointer", "callstd", "setflag", "call", "release", "end"]
+    assert script["length"] == sum(ins["length"]
+                                   for ins in script["instructions"])
+    assert script["instructions"][3]["operands"] == [0x200]
+    assert records[1]["text"] == "Hi"
+    # Every record is plain JSON
+    assert [json.loads(json.dumps(r)) for r in records] == records
+
+def test_record_budgets():
+    rom = bytes(build(SCRIPT, clean_rom()))
+    records = list(asc.decompile_records(rom, 0x100, max_instructions=3))
+    summary = records[-1]
+    assert summary["type"] == "summary"
+    assert summary["stopped"] == "instructions"
+    assert summary["instructions"] == 3 and summary["blocks"] == 1
+    assert records[0]["stopped"] == "instructions"
+    assert len(records[0]["instructions"]) == 3
+    assert summary["unexplored"] == [[0x200, "text"]]
+    # No summary when nothing ran out
+    records = list(asc.decompile_records(rom, 0x100, max_bytes=0x1000))
+    assert "summary" not in [r["type"] for r in records]
+
+def test_crawl_from_many_roots():
+    rom = bytes(build(SCRIPT, clean_rom()))
+    records = list(asc.decompile_records(rom, [0x180, 0x100, 0x180]))
+    assert sorted(r["offset"] for r in records) == [0x100, 0x180, 0x200]
+
+def test_iter_decompile_yields_every_block(tmp_path):
+    fn, _ = make_rom(tmp_path)
+    blocks = list(asc.iter_decompile(str(fn), 0x100))
+    assert "".join(blocks) == asc.decompile(str(fn), 0x100)
+    assert sum(block.count("#org ") for block in blocks) == 3
+    assert all(block.count("#org ") <= 1 for block in blocks)
@@ -0,0 +1,21 @@
+from asc import asc
+
+def test_erase_only_the_ranges(tmp_path):
+    fn = tmp_path / "rom.gba"
+    fn.write_bytes(bytes(range(0x40)))
+    asc.erase_ranges([(0x08000004, 4), (0x10, 2)], str(fn))
+    rom = fn.read_bytes()
+    assert rom[4:8] == b"\xff" * 4 and rom[0x10:0x12] == b"\xff" * 2
+    expected = bytearray(range(0x40))
+    expected[4:8] = b"\xff" * 4
+    expected[0x10:0x12] = b"\xff" * 2
+    assert rom == expected
+
+def test_fill_directive():
+    text = "#org 0x10\n#fill 0x4 0xAA\n"
+    rom = bytearray(b"\xff" * 0x100)
+    rom[0xAC:0xB0] = b"BPRE"
+    chunks, _, diagnostics = asc.compile_script(text, bytes(rom))
+    assert not diagnostics
+    assert [(int(addr, 16), data) for addr, data in chunks] == [
+        (0x10, b"\xaa" * 4)]
@@ -0,0 +1,21 @@
+from asc import journal
+from asc.asc import write_hex_script
+
+def build(tmp_path, count):
+    ''' A ROM with count journaled builds, one byte each '''
+    rom = tmp_path / "rom.gba"
+    rom.write_bytes(b"\xff" * 0x10)
+    for n in range(count):
+        write_hex_script([[hex(n), bytes((n,))]], str(rom),
+                         str(tmp_path / "journal"))
+    return rom
+
+def test_revert_more_than_journaled(tmp_path):
+    rom = build(tmp_path, 3)
+    assert journal.revert(str(rom), str(tmp_path / "journal"), 5) == 3
+    assert rom.read_bytes() == b"\xff" * 0x10
+
+def test_revert_some(tmp_path):
+    rom = build(tmp_path, 3)
+    assert journal.revert(str(rom), str(tmp_path / "journal"), 2) == 2
+    assert rom.read_bytes() == b"\x00" + b"\xff" * 0xF
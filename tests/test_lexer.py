@@ -0,0 +1,10 @@
+import pytest
+from asc import pokecommands as pk
+
+lexer = pytest.importorskip("asc.lexer")
+
+def test_directives_follow_the_command_table():
+    directives = lexer.directives(pk.pkcommands)
+    for directive in ("#org", "#dyn", "#raw", "#fill", "#include"):
+        assert directive in directives
+    assert "=" not in directives
@@ -0,0 +1,57 @@
+from asc import asc, link
+
+asc.QUIET = True
+
+MAIN = '''#dyn 0x100
+#org @main
+msgbox @hello 0x6
+call @sub
+end
+'''
+LIB = '''#org @sub
+msgbox @hello2 0x6
+:loop
+jump :loop
+#org @hello
+= Hello
+#org @hello2
+= Hello
+'''
+
+def make_rom():
+    rom = bytearray(b"\xff" * 0x1000)
+    rom[0xAC:0xB0] = b"BPRE"
+    return bytes(rom)
+
+def obj(text):
+    script = asc.dirty_compile(text, asc.path_resolver((asc.data_path,)),
+                               check_labels=False)
+    return asc.assemble_object(script)
+
+def chunks(hex_script):
+    return sorted((int(addr, 16) & 0x1FFFFFF, bytes(data))
+                  for addr, data in hex_script)
+
+def test_link_matches_compiling_at_once():
+    rom = make_rom()
+    compiled, _, diagnostics = asc.compile_script(MAIN + LIB, rom)
+    assert not diagnostics
+    linked, _ = link.link([obj(MAIN), obj(LIB)], rom)
+    assert chunks(linked) == chunks(compiled)
+
+def test_object_file_round_trip(tmp_path):
+    fn = tmp_path / "lib.o"
+    with open(fn, "w") as f:
+        link.write_object(obj(LIB), f)
+    assert link.read_object(str(fn)) == obj(LIB)
+
+def test_dedupe():
+    rom = make_rom()
+    linked, log = link.link([obj(MAIN), obj(LIB)], rom, dedupe=True)
+    offsets = dict(line.split(" - ") for line in log.split("\n")
+                   if " - " in line)
+    assert offsets["@hello"] == offsets["@hello2"]
+    # The copy isn't written again
+    assert len(chunks(linked)) == 3
+    normal, _ = link.link([obj(MAIN), obj(LIB)], rom)
+    assert len(chunks(normal)) == 4
@@ -0,0 +1,56 @@
+from asc import asc
+
+asc.QUIET = True
+
+SCRIPT = '''#include "stdlib/std.rbh"
+#org 0x100
+#ifdef FR
+setflag 0x200
+#endif
+#ifndef FR
+setflag 0x201
+#endif
+if (0x4001 == 1) {
+  jump :a
+}
+:a
+end
+'''
+
+def make_roms(tmp_path):
+    roms = []
+    for name, code in (("fire", b"BPRE"), ("ruby", b"AXVE"),
+                       ("leaf", b"BPRE")):
+        rom = bytearray(b"\xff" * 0x200)
+        rom[0xAC:0xB0] = code
+        fn = tmp_path / (name + ".gba")
+        fn.write_bytes(rom)
+        roms.append(str(fn))
+    return roms
+
+def single(text, rom):
+    return asc.dirty_compile(asc.get_base_directive(rom) + text,
+                             asc.path_resolver((asc.data_path,)))
+
+def test_compile_targets_matches_compiling_each_rom(tmp_path):
+    roms = make_roms(tmp_path)
+    include_paths = [[asc.data_path]] * len(roms)
+    results = asc.compile_targets(SCRIPT, roms, include_paths)
+    assert [script for script, _ in results] == [single(SCRIPT, rom)
+                                                 for rom in roms]
+    assert "setflag 0x200" in results[0][0]
+    assert "setflag 0x201" in results[1][0]
+    # The same game is compiled once
+    assert results[2] is results[0]
+
+def test_compile_targets_optimize(tmp_path):
+    roms = make_roms(tmp_path)[:1]
+    script, report = asc.compile_targets(SCRIPT, roms, [[asc.data_path]],
+                                         optimize=True)[0]
+    assert "saved" in report
+    assert len(script) < len(single(SCRIPT, roms[0]))
+
+def test_target_file():
+    assert asc.target_file("out/build.ips", "roms/fire.gba") == \
+        "out/build.fire.ips"
+    assert asc.target_file(None, "fire.gba") is None
@@ -0,0 +1,54 @@
+import random
+from asc import overlap
+
+def brute_force(build, history):
+    found = set()
+    for n, (start1, end1) in enumerate(build):
+        for start2, end2 in build[n+1:]:
+            if start1 < end2 and start2 < end1:
+                found.add(frozenset(((start1, end1), (start2, end2))))
+        for start2, end2 in history:
+            if start1 < end2 and start2 < end1:
+                found.add(((start1, end1), (start2, end2)))
+    return found
+
+def test_find_overlaps_matches_brute_force():
+    rng = random.Random(0)
+    for _ in range(300):
+        intervals = []
+        for _ in range(rng.randint(0, 12)):
+            start = rng.randint(0, 100)
+            intervals.append((start, start + rng.randint(1, 20)))
+        intervals = list(set(intervals))
+        build = intervals[:len(intervals) // 2]
+        history = intervals[len(intervals) // 2:]
+        found = set()
+        for interval1, interval2, both in overlap.find_overlaps(build,
+                                                                history):
+            found.add(frozenset((interval1, interval2)) if both
+                      else (interval1, interval2))
+        assert found == brute_force(build, history)
+
+def test_touching_chunks_dont_overlap():
+    assert overlap.find_overlaps([(0, 4), (4, 8)]) == []
+
+def test_check_build():
+    rom = b"\xff" * 0x10 + b"\x01" * 0x10 + b"\xff" * 0x10
+    build = [["0x0", b"\x00" * 4], ["0x2", b"\x00" * 4]]
+    assert [level for level, _ in overlap.check_build(build)] == ["error"]
+    # A #dyn chunk on data
+    build = [["0x8000018", b"\x00" * 4]]
+    diagnostics = overlap.check_build(build, rom, {0x18})
+    assert [level for level, _ in diagnostics] == ["error"]
+    assert overlap.check_build(build, rom) == []
+    # Rebuilding over what the last build wrote is fine, on top of part
+    # of it is not
+    history = [(0x18, 4)]
+    assert overlap.check_build(build, rom, history=history) == []
+    build = [["0x1A", b"\x00" * 4]]
+    assert [level for level, _ in overlap.check_build(
+        build, rom, history=history)] == ["warning", "warning"]
+
+def test_dynamic_offsets():
+    log = "@a - 0x800000\n@b - 0x800010\n' a comment\n"
+    assert overlap.dynamic_offsets(log) == {0x800000, 0x800010}
@@ -0,0 +1,16 @@
+import pytest
+from asc import patch
+
+def test_map_rom_is_closed_after_the_block(tmp_path):
+    rom_file = tmp_path / "rom.gba"
+    rom_file.write_bytes(b"\x01\x02\x03")
+    with patch.map_rom(str(rom_file)) as rom:
+        assert rom[:] == b"\x01\x02\x03"
+    with pytest.raises(ValueError):
+        rom[0]
+
+def test_map_empty_rom(tmp_path):
+    rom_file = tmp_path / "rom.gba"
+    rom_file.write_bytes(b"")
+    with patch.map_rom(str(rom_file)) as rom:
+        assert rom == b""
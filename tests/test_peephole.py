@@ -0,0 +1,20 @@
+from asc import peephole
+from asc import pokecommands as pk
+
+def optimize(text):
+    return peephole.optimize(text, pk.pkcommands)[0].split("\n")
+
+def test_data_after_a_terminator_stays():
+    for terminator in ("end", "return", "jump @b"):
+        lines = ["#org @a", "setflag 0x200", terminator, "#raw 0x12",
+                 "#raw 0x34", "= Hello", "#fill 0x4 0xFF"]
+        assert optimize("\n".join(lines)) == lines
+
+def test_dead_commands_go():
+    lines = ["#org @a", "setflag 0x200", "end", "setflag 0x201", "end"]
+    assert optimize("\n".join(lines)) == lines[:3]
+
+def test_data_is_not_a_tail():
+    lines = ["#org @a", "checkflag 0x200", "if == jump :x", "= Hello World",
+             "end", ":x", "= Hello World", "end"]
+    assert optimize("\n".join(lines)) == lines
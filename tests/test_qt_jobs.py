@@ -0,0 +1,47 @@
+import pytest
+
+pytest.importorskip("PyQt5.Qsci")
+from asc import asc, asc_qt
+
+asc.QUIET = True
+
+SCRIPT = "#dyn 0x800\n#org @main\nmsgbox @text 0x6\nend\n#org @text\n= Hi\n"
+
+def make_rom(tmp_path):
+    rom = bytearray(b"\xff" * 0x1000)
+    rom[0xAC:0xB0] = b"BPRE"
+    fn = tmp_path / "rom.gba"
+    fn.write_bytes(rom)
+    return str(fn), bytes(rom)
+
+def test_compile_job(tmp_path):
+    fn, rom = make_rom(tmp_path)
+    stages = []
+    mode, chunks, _ = asc_qt.compile_job(SCRIPT, fn, [asc.data_path],
+                                         "debug", stages.append)
+    assert mode == "debug" and stages[-1] == "checking..."
+    assert chunks == asc.compile_script(SCRIPT, rom)[0]
+    # debug doesn't write
+    assert open(fn, "rb").read() == rom
+
+def test_cancelled_compile_job_writes_nothing(tmp_path):
+    fn, rom = make_rom(tmp_path)
+
+    def stage(msg):
+        if msg == "writing ROM...":
+            raise asc_qt.Cancelled()
+
+    with pytest.raises(asc_qt.Cancelled):
+        asc_qt.compile_job(SCRIPT, fn, [asc.data_path], "compile", stage)
+    assert open(fn, "rb").read() == rom
+
+def test_decompile_job(tmp_path, monkeypatch):
+    fn, rom = make_rom(tmp_path)
+    rom = bytearray(rom)
+    asc.apply_chunks(asc.compile_script(SCRIPT, bytes(rom))[0], rom)
+    open(fn, "wb").write(rom)
+    monkeypatch.setattr(asc_qt, "DECOMPILE_CHUNK_SIZE", 1)
+    parts = []
+    n = asc_qt.decompile_job(fn, 0x800, lambda msg: None, parts.append)
+    assert n == 2 and len(parts) == 3
+    assert "".join(parts) == asc.decompile(fn, 0x800)
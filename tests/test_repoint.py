@@ -0,0 +1,45 @@
+import struct
+from asc import asc, repoint
+
+asc.QUIET = True
+
+SCRIPT = '''#org 0x100
+msgbox 0x200 0x6
+end
+#org 0x200
+= Hi
+#org 0x300
+= Hello
+'''
+
+def make_rom():
+    rom = bytearray(b"\xff" * 0x1000)
+    rom[0xAC:0xB0] = b"BPRE"
+    chunks, _, diagnostics = asc.compile_script(SCRIPT, bytes(rom))
+    assert not diagnostics
+    asc.apply_chunks(chunks, rom)
+    rom[0x180:0x184] = struct.pack("<I", 0x8000200)
+    rom[0x185:0x189] = struct.pack("<I", 0x8000200)
+    return rom
+
+def test_parse_mapping():
+    assert repoint.parse_mapping(["0x8000200:300"]) == {0x200: 0x300}
+
+def test_repoint():
+    rom = bytes(make_rom())
+    mapping = {0x200: 0x300}
+    pointers = list(asc.script_pointers(rom, [0x100]))
+    refs = repoint.find_references(rom, mapping, pointers)
+    # The one in the script isn't aligned, but the decompiler found it
+    script_pointer = next(pos for pos, target in pointers
+                          if target & 0x1FFFFFF == 0x200)
+    assert refs == sorted([(0x180, 0x200, "data"),
+                           (script_pointer, 0x200, "script")])
+    assert len(repoint.find_references(rom, mapping, pointers,
+                                       aligned=False)) == 3
+    rom = bytearray(rom)
+    asc.apply_chunks(repoint.repoint_chunks(refs, mapping), rom)
+    assert rom[0x180:0x184] == struct.pack("<I", 0x8000300)
+    assert rom[0x185:0x189] == struct.pack("<I", 0x8000200)
+    assert [target & 0x1FFFFFF for _, target
+            in asc.script_pointers(rom, [0x100])] == [0x300]
@@ -0,0 +1,42 @@
+import struct
+from asc import romtext
+from asc.text_translate import ascii_to_hex
+
+def make_rom():
+    rom = bytearray(b"\xff" * 0x100)
+    rom[0x10:0x16] = ascii_to_hex("Hello") + b"\xff"
+    rom[0x40:0x49] = ascii_to_hex("Hi there") + b"\xff"
+    # Too short, and not ended
+    rom[0x60:0x63] = ascii_to_hex("Yo") + b"\xff"
+    rom[0xFC:] = ascii_to_hex("Bye!")
+    rom[0x80:0x84] = struct.pack("<I", 0x8000010)
+    rom[0x85:0x89] = struct.pack("<I", 0x8000040)
+    return bytes(rom)
+
+def test_extract_strings():
+    assert romtext.extract_strings(make_rom()) == [(0x10, "Hello"),
+                                                   (0x40, "Hi there")]
+    assert (0x60, "Yo") in romtext.extract_strings(make_rom(), 2)
+
+def test_find_pointers():
+    found = romtext.find_pointers(make_rom(), [0x10, 0x40, 0x60])
+    assert found == {0x10: [0x80], 0x40: [0x85]}
+
+def test_search():
+    hits = romtext.search(make_rom(), ["Hello", "Hell", "H\\?", "there",
+                                       "Hi\\*e"])
+    found = [(offset, query) for offset, query, _ in hits]
+    assert sorted(found) == sorted([(0x10, "Hello"), (0x10, "Hell"),
+                                    (0x10, "H\\?"), (0x40, "H\\?"),
+                                    (0x43, "there"), (0x40, "Hi\\*e")])
+    refs = {(offset, query): refs for offset, query, refs in hits}
+    assert refs[(0x10, "Hello")] == [0x80]
+    assert refs[(0x43, "there")] == []
+
+def test_find_patterns_matches_a_naive_search():
+    rom = make_rom()
+    patterns = [ascii_to_hex(q) for q in ("He", "Hello", "e", "ere", "!")]
+    expected = sorted((pos, p) for p in patterns
+                      for pos in range(len(rom))
+                      if rom.startswith(p, pos))
+    assert sorted(romtext.find_patterns(rom, patterns)) == expected
@@ -0,0 +1,29 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def loaded_after(code):
+    ''' The modules a fresh interpreter has after running code '''
+    out = subprocess.check_output(
+        [sys.executable, "-c", code + "\nimport sys, json\n"
+         "print(json.dumps(sorted(sys.modules)))"], cwd=ROOT)
+    return set(json.loads(out))
+
+def test_importing_the_compiler_loads_little():
+    modules = loaded_after("import asc.asc")
+    for name in ("patch", "journal", "symbols", "romtext", "repoint",
+                 "overlap", "alloc", "link", "peephole", "usage"):
+        assert "asc." + name not in modules
+    assert "argparse" not in modules and "pprint" not in modules
+
+def test_command_tables_are_built_when_used():
+    code = ("from asc import pokecommands as pk\n"
+            "pk.pkcommands\n"
+            "print(json.dumps(['aicommands' in vars(pk),"
+            " 'pkcommands' in vars(pk)]))\n")
+    out = subprocess.check_output([sys.executable, "-c",
+                                   "import json\n" + code], cwd=ROOT)
+    assert json.loads(out) == [False, True]
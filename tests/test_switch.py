@@ -0,0 +1,81 @@
+import random
+from asc import asc
+
+CONDITIONS = {"<": lambda c: c < 0, "<=": lambda c: c <= 0,
+              "==": lambda c: c == 0, "!=": lambda c: c != 0,
+              ">": lambda c: c > 0, ">=": lambda c: c >= 0}
+
+def run(script, value):
+    ''' Run a plain script of compares and jumps with the var at value,
+        until it gets to a :case label, a setflag or an end '''
+    lines = [line.strip() for line in script.split("\n") if line.strip()]
+    labels = {line: n for n, line in enumerate(lines) if line[0] == ":"}
+    pc = 0
+    compared = None
+    while True:
+        words = lines[pc].split()
+        if words[0] in ("setflag", "end"):
+            return words[-1]
+        if words[0] == "compare":
+            compared = (value > int(words[2], 16)) - (value < int(words[2], 16))
+        elif words[0] == "if" and CONDITIONS[words[1]](compared):
+            words = words[2:]
+        if words[0] == "jump":
+            if words[1] not in labels:
+                return words[1]
+            pc = labels[words[1]]
+        pc += 1
+
+def test_case_intervals():
+    targets = {1: ":a", 2: ":a", 3: ":b", 5: ":b", 6: ":b", 0xFFFF: ":a"}
+    assert asc.case_intervals(targets) == [[1, 2, ":a"], [3, 3, ":b"],
+                                           [5, 6, ":b"], [0xFFFF, 0xFFFF,
+                                                          ":a"]]
+
+def test_switch_tree_matches_a_linear_compare():
+    rng = random.Random(0)
+    for _ in range(500):
+        targets = {}
+        for _ in range(rng.randint(0, 30)):
+            value = rng.choice([0, 1, 2, 0xFFFE, 0xFFFF, rng.randint(0, 40)])
+            targets[value] = ":case{}".format(rng.randint(0, 4))
+        nodes = iter(range(1000))
+        script = asc.switch_tree("0x4001", asc.case_intervals(targets),
+                                 ":default",
+                                 lambda: ":node{}".format(next(nodes)))
+        for value in list(targets) + [0, 41, 0xFFFF, rng.randint(0, 0xFFFF)]:
+            assert run(script, value) == targets.get(value, ":default")
+
+def test_switch_statement():
+    script = asc.compile_clike_blocks('''#org 0x100
+switch (0x4001) {
+case 1:
+case 2:
+  setflag 0x201
+case 5:
+  setflag 0x205
+default:
+  setflag 0x300
+}
+end
+''')
+    for value, flag in ((0, "0x300"), (1, "0x201"), (2, "0x201"),
+                        (3, "0x300"), (5, "0x205"), (0xFFFF, "0x300")):
+        assert run(script.split("\n", 1)[1], value) == flag
+
+def test_nested_blocks_get_their_own_labels():
+    script = asc.compile_clike_blocks('''#org 0x100
+:case0
+switch (0x4001) {
+case 1:
+  switch (0x4002) {
+  case 1:
+    setflag 0x200
+  }
+case 2:
+  setflag 0x201
+}
+end
+''')
+    labels = [line for line in script.split("\n") if line[:1] == ":"]
+    assert len(labels) == len(set(labels))
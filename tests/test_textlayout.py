@@ -0,0 +1,43 @@
+from asc import textlayout
+
+WORDS = ["word{}".format(n) for n in range(40)]
+
+def test_wrap_fills_lines():
+    lines = textlayout.wrap(WORDS)
+    assert " ".join(lines) == " ".join(WORDS)
+    for n, line in enumerate(lines):
+        assert textlayout.text_len(line) < textlayout.MAX_WIDTH
+        if n + 1 < len(lines):
+            longer = line + " " + lines[n + 1].split(" ")[0]
+            assert textlayout.text_len(longer) >= textlayout.MAX_WIDTH
+
+def test_reflow_alternates_breaks():
+    text = textlayout.reflow(" ".join(WORDS))
+    delims = [delim for _, delim in textlayout.split_lines(text)][:-1]
+    assert delims == ["\\n", "\\p"] * (len(delims) // 2) + \
+        ["\\n"] * (len(delims) % 2)
+    assert not textlayout.overflows(text)
+
+def test_reflow_keeps_explicit_breaks():
+    text = "Hi!\\nHow are you?\\lFine.\\pBye."
+    assert textlayout.reflow(text) == text
+    assert textlayout.reflow(text, keep_breaks=False) == \
+        "Hi! How are you? Fine.\\pBye."
+
+def test_reflow_after_an_explicit_break():
+    # The second line of the box is taken, so the next box comes next
+    text = textlayout.reflow("Hi!\\n" + " ".join(WORDS))
+    lines = textlayout.split_lines(text)
+    assert lines[0] == ("Hi!", "\\n")
+    assert lines[1][1] == "\\p"
+    assert not textlayout.overflows(text)
+
+def test_reflow_script():
+    script = "#org 0x100\n= " + " ".join(WORDS) + "\n= \\pBye.\nend"
+    out, report = textlayout.reflow_script(script)
+    assert not report
+    lines = out.split("\n")
+    assert lines[0] == "#org 0x100" and lines[-1] == "end"
+    assert all(line.startswith("= ") for line in lines[1:-1])
+    _, check = textlayout.reflow_script(script, check=True)
+    assert check and check[0][0] == 2
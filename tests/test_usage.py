@@ -0,0 +1,63 @@
+import os
+from asc import asc, usage
+
+asc.QUIET = True
+
+SCRIPT = '''#org 0x100
+setflag 0x200
+checkflag 0x202
+setvar 0x4001 0x1
+addvar 0x4002 0x1
+compare 0x4003 0x1
+end
+'''
+
+def make_rom(tmp_path):
+    rom = bytearray(b"\xff" * 0x1000)
+    rom[0xAC:0xB0] = b"BPRE"
+    chunks, _, diagnostics = asc.compile_script(SCRIPT, bytes(rom))
+    assert not diagnostics
+    for addr, data in chunks:
+        rom[int(addr, 16):int(addr, 16) + len(data)] = data
+    fn = tmp_path / "rom.gba"
+    fn.write_bytes(rom)
+    return str(fn), bytes(rom)
+
+def index_of(fn, rom):
+    records = asc.decompile_records(rom, [0x100], symbolize=False)
+    return usage.build_index(records, [0x100], rom, stat=usage.rom_stat(fn))
+
+def test_users_and_free(tmp_path):
+    index = index_of(*make_rom(tmp_path))
+    assert usage.users(index, "flag", 0x200) == [(0x100, "write")]
+    assert usage.users(index, "flag", 0x202) == [(0x100, "read")]
+    assert usage.users(index, "var", 0x4002) == [(0x100, "read"),
+                                                 (0x100, "write")]
+    assert usage.users(index, "var", 0x4003, "write") == []
+    assert usage.free(index, "flag", 0x1FF, 0x203) == [(0x1FF, 0x1FF),
+                                                       (0x201, 0x201),
+                                                       (0x203, 0x203)]
+
+def test_index_file_round_trip(tmp_path):
+    index = index_of(*make_rom(tmp_path))
+    usage.write_index(index, str(tmp_path / "rom.usage"))
+    assert usage.read_index(str(tmp_path / "rom.usage")) == index
+
+def test_is_current_hashes_only_after_a_change(tmp_path, monkeypatch):
+    fn, rom = make_rom(tmp_path)
+    index = index_of(fn, rom)
+    hashed = []
+    rom_hash = usage.rom_hash
+    monkeypatch.setattr(usage, "rom_hash",
+                        lambda rom: hashed.append(1) or rom_hash(rom))
+    assert usage.is_current(index, rom, [0x100], usage.rom_stat(fn))
+    assert not usage.is_current(index, rom, [0x200], usage.rom_stat(fn))
+    assert not hashed
+    # Touched but the same ROM
+    os.utime(fn, ns=(0, 0))
+    assert usage.is_current(index, rom, (), usage.rom_stat(fn))
+    assert index["stat"] == usage.rom_stat(fn) and len(hashed) == 1
+    changed = rom[:0x100] + b"\x00" + rom[0x101:]
+    with open(fn, "wb") as f:
+        f.write(changed)
+    assert not usage.is_current(index, changed, (), usage.rom_stat(fn))
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+# This file is part of Red Alien.
+
+#    Red Alien is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    Red Alien is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with Red Alien.  If not, see <http://www.gnu.org/licenses/>.
+
+''' Startup benchmark: time to first output of asc-cli d and c, and
+    time to first paint of asc-qt. Exits with 1 if any of them is over
+    its budget.
+
+    Usage: utils/startup_bench.py ROM OFFSET [--runs N] [--no-gui] '''
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+# Seconds, for the median run
+BUDGETS = {
+    "cli-d": 0.15,
+    "cli-c": 0.20,
+    "qt-paint": 1.0,
+}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = '''#dyn 0x800000
+#org @main
+msgbox @hi 6
+end
+#org @hi
+= Hi
+'''
+
+def time_to_first_line(cmd, wait_for=None):
+    ''' Returns (seconds until the first line of output, or the first
+        line starting with wait_for; total seconds) '''
+    start = time.perf_counter()
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, cwd=ROOT,
+                         universal_newlines=True)
+    first = None
+    for line in p.stdout:
+        if first is None and (wait_for is None or line.startswith(wait_for)):
+            first = time.perf_counter() - start
+    p.wait()
+    total = time.perf_counter() - start
+    if p.returncode:
+        raise Exception("{} failed".format(" ".join(cmd)))
+    return (first if first is not None else total), total
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('rom', help='path to a ROM image (not modified)')
+    parser.add_argument('offset', help='script to decompile')
+    parser.add_argument('--runs', default=5, type=int)
+    parser.add_argument('--no-gui', action='store_true')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    rom = os.path.join(tmp, "rom.gba")
+    shutil.copy(args.rom, rom)
+    script = os.path.join(tmp, "bench.pks")
+    with open(script, "w") as f:
+        f.write(SCRIPT)
+
+    cli = [sys.executable, os.path.join(ROOT, "asc-cli")]
+    benches = {
+        "cli-d": cli + ["d", rom, args.offset],
+        "cli-c": cli + ["c", rom, script],
+    }
+    if not args.no_gui:
+        benches["qt-paint"] = [sys.executable, os.path.join(ROOT, "asc-qt"),
+                               "--startup-bench"]
+    over = False
+    try:
+        for name, cmd in benches.items():
+            wait_for = "first paint" if name == "qt-paint" else None
+            runs = [time_to_first_line(cmd, wait_for)
+                    for _ in range(args.runs)]
+            first = median([r[0] for r in runs])
+            total = median([r[1] for r in runs])
+            ok = first <= BUDGETS[name]
+            over = over or not ok
+            print("{:10} first output {:7.3f}s  total {:7.3f}s  "
+                  "budget {:.3f}s {}".format(name, first, total,
+                                             BUDGETS[name],
+                                             "" if ok else "OVER"))
+    finally:
+        shutil.rmtree(tmp)
+    sys.exit(1 if over else 0)
+
+if __name__ == "__main__":
+    main()